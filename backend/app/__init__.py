@@ -43,10 +43,12 @@ def create_app(config_name='default'):
     app.register_blueprint(medical_record_bp)
     from .api.logout_api import logout_bp
     app.register_blueprint(logout_bp)
+    from .api.metrics_api import metrics_bp
+    app.register_blueprint(metrics_bp)
 
     # 4. 导入数据库模型，以便 Flask-Migrate 能够检测到它们
     # 这是让 `flask db migrate` 正常工作的关键一步
-    from .models import user_model, consultation_model, appointment_model, review_model, medical_record_model, department_model
+    from .models import user_model, consultation_model, appointment_model, review_model, medical_record_model, department_model, answer_cache_model
 
     @app.route('/uploads/<path:filename>')
     def serve_uploaded_file(filename):
@@ -1,19 +1,43 @@
 import os
+import json
+import select
+import socket
 import logging
+import itertools
 from datetime import datetime
-from flask import Blueprint, jsonify, request, current_app
+from flask import Blueprint, jsonify, request, current_app, Response, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from werkzeug.utils import secure_filename
 
 # 导入现有的服务
-from ..services import llm_service
+from ..core.extensions import db
+from ..services import llm_service, answer_cache, faq_index
+from ..services.bulkhead import UpstreamBusyError
+from ..services.circuit_breaker import CircuitOpenError
+from ..services.llm_runtime import RequestCancelled
 from ..services.history_service import (
     get_chat_history, 
+    get_chat_history_page,
+    get_chat_history_delta,
+    decode_history_cursor,
+    latest_chat_message_id,
+    get_latest_ai_consultation,
     find_or_create_main_ai_consultation, 
     add_chat_message_to_consultation, 
-    start_new_chat_session, 
-    generate_medical_record_from_history
+    add_chat_messages_to_consultation,
+    start_new_chat_session
 )
+from ..services.context_service import build_context
+from ..services.chat_job_service import (
+    enqueue_chat_job, get_chat_job, cancel_chat_job, start_chat_job_workers, chat_priority
+)
+from ..services.medical_record_job_service import (
+    enqueue_medical_record_job, get_medical_record_job, start_medical_record_job_workers
+)
+from ..services.job_queue import FINISHED_STATUSES
+
+# 只传 before 不传 limit 时的每页问答数
+CHAT_HISTORY_DEFAULT_PAGE_SIZE = 20
 
 # 创建 'chat_bp' 蓝图
 chat_bp = Blueprint('chat_api', __name__, url_prefix='/api/chat')
@@ -27,6 +51,107 @@ def allowed_file(filename):
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 # --------------------------
 
+@chat_bp.before_app_request
+def _ensure_chat_job_workers():
+    """进程收到第一个请求时启动异步问答、病历生成 worker (并接手上次重启前未完成的任务) 和 FAQ 索引的刷新线程"""
+    app = current_app._get_current_object()
+    start_chat_job_workers(app)
+    start_medical_record_job_workers(app)
+    faq_index.start_refresher(app, app.config['FAQ_INDEX_REFRESH_SECONDS'])
+
+def wants_async():
+    """客户端通过 ?async=1 或 Prefer: respond-async 请求异步模式"""
+    if request.args.get('async', '').lower() in ('1', 'true'):
+        return True
+    return 'respond-async' in request.headers.get('Prefer', '')
+
+def cache_bypassed():
+    """客户端通过 {"noCache": true} 或 Cache-Control: no-cache 要求跳过回答缓存"""
+    if request.is_json and (request.get_json(silent=True) or {}).get('noCache'):
+        return True
+    return 'no-cache' in request.headers.get('Cache-Control', '')
+
+def client_disconnect_checker():
+    """
+    返回一个回调：客户端已断开连接时返回 True，用于在等待 AI 回答期间及时关闭上游会话。
+    依赖服务器在 environ 中暴露的连接 socket (gunicorn.socket / werkzeug.socket)，拿不到时返回 None。
+    """
+    sock = request.environ.get('gunicorn.socket') or request.environ.get('werkzeug.socket')
+    if sock is None:
+        return None
+
+    def disconnected():
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+            if not readable:
+                return False
+            # 可读却读不到数据说明对端已关闭；MSG_PEEK 不会消耗下一个请求的数据
+            return sock.recv(1, socket.MSG_PEEK) == b''
+        except ConnectionError:
+            return True
+        except (OSError, ValueError):
+            # 例如 TLS socket 不支持 MSG_PEEK，此时无法判断，按未断开处理
+            return False
+
+    return disconnected
+
+def _cancelled_response():
+    """客户端已断开，回答不再保存 (499 仅用于日志，客户端收不到)"""
+    return jsonify({"error_code": 499, "message": "客户端已断开连接"}), 499
+
+def _busy_response(error):
+    """上游容量已满 (429) 或熔断中 (503)：带上 Retry-After，提示客户端稍后重试"""
+    response = jsonify({"error_code": error.status_code, "message": str(error), "retryAfter": error.retry_after})
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, error.status_code
+
+def consultation_context(consultation_id):
+    """构建发给 AI 的问诊上下文 (见 context_service)；失败时不带上下文继续"""
+    try:
+        return build_context(consultation_id)
+    except Exception as e:
+        print(f"Error building context for consultation {consultation_id}: {e}")
+        db.session.rollback()
+        return None
+
+def _faq_response(match, fallback=False):
+    """直接返回 FAQ 索引中的回答；fallback 表示上游不可用时的兜底回答"""
+    return jsonify({
+        "answer": match.answer,
+        "partial": False,
+        "source": "faq",
+        "fallback": fallback,
+        "faq": {"question": match.question, "similarity": round(match.score, 3)}
+    }), 200
+
+def _faq_fallback(user_id, consultation_id, question):
+    """
+    上游熔断时放宽相似度要求，用 FAQ 兜底。没有足够相似的问题时返回 None；
+    兜底回答照常写入历史，写入失败只记录日志，不影响返回给用户。
+    """
+    faq_match = faq_index.lookup(question, fallback=True)
+    if faq_match is None:
+        return None
+    try:
+        add_chat_message_to_consultation(user_id, consultation_id, question, faq_match.answer)
+    except Exception as e:
+        print(f"Error saving FAQ fallback answer for consultation {consultation_id}: {e}")
+        db.session.rollback()
+    return faq_match
+
+def _accepted_job_response(job, status_url=None, retry_after=None):
+    """异步模式下返回 202 和任务查询地址 (retry_after 为建议的查询间隔)"""
+    status_url = status_url or f"/api/chat/jobs/{job.id}"
+    response = jsonify({
+        "jobId": str(job.id),
+        "status": job.status,
+        "statusUrl": status_url
+    })
+    response.headers['Location'] = status_url
+    if retry_after is not None:
+        response.headers['Retry-After'] = str(retry_after)
+    return response, 202
+
 #这个是按照分对话块的方式写的
 """
 @chat_bp.route('/history', methods=['GET'])
@@ -55,22 +180,64 @@ def get_chat_history_records():
 def get_chat_history_records():
     """
     获取当前用户所有的AI对话历史记录。
+    传入 ?limit=N (以及上一页返回的 ?before=nextCursor) 时按页返回，从最新的一页开始。
+    传入 ?since=syncCursor 时只返回该游标之后的新问答 (增量同步)。
+    已有问诊时响应带有 ETag (最新会话ID + 最新消息ID)，If-None-Match 命中时返回 304，不再读取历史记录。
+    分页和增量请求的 ETag 还带上 limit/before/since，不同页之间不会互相命中。
     """
     try:
         user_id = get_jwt_identity()
+        limit = request.args.get('limit')
+        before = request.args.get('before')
+        since = request.args.get('since')
+        # 格式不正确的参数直接返回 400，而不是悄悄忽略后返回完整历史
+        try:
+            limit = int(limit) if limit is not None else None
+            since = int(since) if since is not None else None
+            if (limit is not None and limit < 1) or (since is not None and since < 0):
+                raise ValueError(f"invalid history query: limit={limit}, since={since}")
+            if before is not None:
+                decode_history_cursor(before)
+        except ValueError:
+            return jsonify({"error_code": 400, "message": "无效的分页游标"}), 400
+
+        existing_consultation = get_latest_ai_consultation(user_id)
+        sync_cursor = latest_chat_message_id(user_id)
+        etag = None
+        if existing_consultation:
+            etag = f"{existing_consultation.id}-{sync_cursor}"
+            if since is not None:
+                etag += f"-since{since}"
+            elif limit or before:
+                etag += f"-limit{limit or CHAT_HISTORY_DEFAULT_PAGE_SIZE}-before{before or ''}"
+        if etag and request.if_none_match.contains(etag):
+            not_modified = current_app.response_class(status=304)
+            not_modified.set_etag(etag)
+            return not_modified
+
+        # 1. 调用新的service函数，获取全部历史记录 (或其中一页 / 增量)
+        next_cursor = None
+        if since is not None:
+            history, sync_cursor = get_chat_history_delta(user_id, since)
+        elif limit or before:
+            history, next_cursor = get_chat_history_page(user_id, limit or CHAT_HISTORY_DEFAULT_PAGE_SIZE, before)
+        else:
+            history = get_chat_history(user_id)
 
-        # 1. 调用新的service函数，获取全部历史记录
-        history = get_chat_history(user_id)
-        
         # 2. 为了兼容前端的“继续对话”功能，我们仍然需要一个默认的consultation_id。
         #    这里我们查找用户最新的一个会话ID。
         latest_consultation = find_or_create_main_ai_consultation(user_id) # 复用此函数查找或创建
-        
-        # 3. 返回所有历史记录和最新会话的ID
-        return jsonify({
+
+        # 3. 返回历史记录、最新会话的ID，以及下次增量同步使用的游标
+        response = jsonify({
             "consultation_id": latest_consultation.id,
-            "history": history
-        }), 200
+            "history": history,
+            "nextCursor": next_cursor,
+            "syncCursor": sync_cursor
+        })
+        if etag:
+            response.set_etag(etag)
+        return response, 200
 
     except Exception as e:
         print(f"Error in /api/chat/history: {e}")
@@ -99,16 +266,210 @@ def chat_medical(): # 2. 函数名修改
         latest_consultation = find_or_create_main_ai_consultation(user_id)
         consultation_id = latest_consultation.id
 
-        # 4. 后续逻辑保持不变：获取AI回答并存入数据库
-        ai_answer = llm_service.get_ai_response(question)
+        # 异步模式：入队后立即返回，由后台 worker 调用 LLM 并写回
+        if wants_async():
+            return _accepted_job_response(enqueue_chat_job(user_id, consultation_id, question, use_cache=not cache_bypassed()))
+
+        # 还没有问诊上下文时，与 FAQ 中的问题足够相似就直接返回，不占用上游 (要求跳过缓存时同样跳过 FAQ)；
+        # 有上下文时回答需要结合病人此前的问答，与回答缓存一样不使用通用回答
+        use_cache = not cache_bypassed()
+        context = consultation_context(consultation_id)
+        faq_match = faq_index.lookup(question) if use_cache and not context else None
+        if faq_match is not None:
+            add_chat_message_to_consultation(user_id, consultation_id, question, faq_match.answer)
+            return _faq_response(faq_match)
+
+        # 4. 获取AI回答 (带上问诊上下文) 并存入数据库
+        ai_answer = llm_service.get_ai_response(
+            question, use_cache=use_cache,
+            deadline_seconds=current_app.config['CHAT_DEADLINE_SECONDS'],
+            cancelled=client_disconnect_checker(),
+            priority=chat_priority(user_id),
+            context=context
+        )
         add_chat_message_to_consultation(user_id, consultation_id, question, ai_answer)
         
-        return jsonify({"answer": ai_answer}), 200
+        return jsonify({"answer": ai_answer, "partial": llm_service.is_partial_answer(ai_answer), "source": "ai"}), 200
 
+    except CircuitOpenError as e:
+        # 上游熔断中：用 FAQ 兜底
+        faq_match = _faq_fallback(user_id, consultation_id, question)
+        if faq_match is None:
+            return _busy_response(e)
+        return _faq_response(faq_match, fallback=True)
+    except UpstreamBusyError as e:
+        return _busy_response(e)
+    except RequestCancelled:
+        return _cancelled_response()
     except Exception as e:
         print(f"Error in /api/chat/medical: {e}")
         return jsonify({"error_code": 500, "message": "服务器内部错误"}), 500
 
+@chat_bp.route('/medical/batch', methods=['POST'])
+@jwt_required()
+def chat_medical_batch():
+    """
+    一次提交多个问题 (例如问诊问卷)，并发调用上游，按提交顺序返回全部回答。
+    请求体: {"questions": ["...", "..."]}，最多 CHAT_BATCH_MAX_QUESTIONS 个。
+    全部问答在同一个事务中写入当前问诊；任何一个问题拿不到上游名额时整批返回 429，不写入任何记录。
+    """
+    if not request.is_json:
+        return jsonify({"msg": "Missing JSON in request"}), 400
+
+    questions = request.json.get('questions')
+    if not isinstance(questions, list) or not questions:
+        return jsonify({"msg": "Missing questions parameter"}), 400
+    if not all(isinstance(question, str) and question.strip() for question in questions):
+        return jsonify({"msg": "Each question must be a non-empty string"}), 400
+    max_questions = current_app.config['CHAT_BATCH_MAX_QUESTIONS']
+    if len(questions) > max_questions:
+        return jsonify({"msg": f"At most {max_questions} questions per batch"}), 400
+
+    try:
+        user_id = get_jwt_identity()
+        consultation_id = find_or_create_main_ai_consultation(user_id).id
+
+        answers = llm_service.get_ai_responses(
+            questions, use_cache=not cache_bypassed(),
+            deadline_seconds=current_app.config['CHAT_DEADLINE_SECONDS'],
+            cancelled=client_disconnect_checker(),
+            priority=chat_priority(user_id),
+            context=consultation_context(consultation_id)
+        )
+        add_chat_messages_to_consultation(user_id, consultation_id, list(zip(questions, answers)))
+
+        return jsonify({
+            "consultation_id": consultation_id,
+            "answers": [
+                {"question": question, "answer": answer, "partial": llm_service.is_partial_answer(answer)}
+                for question, answer in zip(questions, answers)
+            ]
+        }), 200
+
+    except UpstreamBusyError as e:
+        return _busy_response(e)
+    except RequestCancelled:
+        return _cancelled_response()
+    except Exception as e:
+        print(f"Error in /api/chat/medical/batch: {e}")
+        return jsonify({"error_code": 500, "message": "服务器内部错误"}), 500
+
+def _sse_event(event, data):
+    """按 text/event-stream 格式编码一条事件"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@chat_bp.route('/medical/stream', methods=['POST'])
+@jwt_required()
+def chat_medical_stream():
+    """
+    /medical 的流式版本 (Server-Sent Events)。
+    每收到一条 agent 帧就立即推送给浏览器，会话结束后再保存最终问答。
+    事件顺序: start -> agent_message* -> (error) -> done
+    超过 CHAT_STREAM_DEADLINE_SECONDS 时以已收到的内容结束，done 事件带 partial: true。
+    等待期间定期写出心跳注释行；客户端断开时写入失败，生成器被关闭，上游会话随之关闭。
+    """
+    if not request.is_json:
+        return jsonify({"msg": "Missing JSON in request"}), 400
+
+    question = request.json.get('question')
+    if not question:
+        return jsonify({"msg": "Missing question parameter"}), 400
+
+    use_cache = not cache_bypassed()
+    frames, first_frames = None, []
+    try:
+        user_id = get_jwt_identity()
+        consultation_id = find_or_create_main_ai_consultation(user_id).id
+        # 带上下文时缓存键包含上下文，只命中同一问诊中相同上下文下的回答
+        context = consultation_context(consultation_id)
+
+        # 命中回答缓存时不再启动上游会话
+        cached_answer = answer_cache.lookup(question, context) if use_cache else None
+        if cached_answer is None:
+            if not use_cache:
+                answer_cache.record_bypass()
+            # 在返回响应头之前先取第一帧 (session_started)，上游繁忙时还能返回 429
+            frames = llm_service.iter_dynamic_response(
+                question,
+                deadline_seconds=current_app.config['CHAT_STREAM_DEADLINE_SECONDS'],
+                heartbeat=current_app.config['CHAT_STREAM_HEARTBEAT_SECONDS'],
+                priority=chat_priority(user_id),
+                context=context
+            )
+            # 排队期间的心跳 (None) 跳过，直到拿到名额或抛出 UpstreamBusyError
+            first_frames = list(itertools.islice((frame for frame in frames if frame is not None), 1))
+    except CircuitOpenError as e:
+        # 上游熔断中：与 /medical 相同，用 FAQ 兜底，直接推送 start 和 done 事件
+        faq_match = _faq_fallback(user_id, consultation_id, question)
+        if faq_match is None:
+            return _busy_response(e)
+        return Response(
+            _sse_event("start", {"consultation_id": consultation_id}) + _sse_event("done", {
+                "answer": faq_match.answer, "partial": False, "source": "faq", "fallback": True,
+                "faq": {"question": faq_match.question, "similarity": round(faq_match.score, 3)}
+            }),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+    except UpstreamBusyError as e:
+        return _busy_response(e)
+    except Exception as e:
+        print(f"Error in /api/chat/medical/stream: {e}")
+        if frames is not None:
+            frames.close()
+        return jsonify({"error_code": 500, "message": "服务器内部错误"}), 500
+
+    def generate():
+        start = {"consultation_id": consultation_id}
+        if first_frames and first_frames[0].get("type") == "session_started":
+            start["session_id"] = first_frames[0].get("session_id")
+        yield _sse_event("start", start)
+
+        if cached_answer is not None:
+            add_chat_message_to_consultation(user_id, consultation_id, question, cached_answer)
+            yield _sse_event("done", {"answer": cached_answer, "cached": True})
+            return
+
+        builder = llm_service.AgentAnswerBuilder()
+        try:
+            for message in itertools.chain(first_frames, frames):
+                if message is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                done = builder.feed(message)
+                if message.get("type") == "agent_message":
+                    yield _sse_event("agent_message", {
+                        "speaker": message.get("speaker", ""),
+                        "content": message.get("content", "")
+                    })
+                elif message.get("type") == "error":
+                    yield _sse_event("error", {"message": builder.result()})
+                if done:
+                    break
+        finally:
+            # 客户端断开或会话结束时都立即关闭上游会话
+            frames.close()
+
+        ai_answer = builder.result()
+        if use_cache and builder.succeeded:
+            answer_cache.store(question, ai_answer, context)
+        try:
+            add_chat_message_to_consultation(user_id, consultation_id, question, ai_answer)
+        except Exception as e:
+            print(f"Error saving streamed answer in /api/chat/medical/stream: {e}")
+        yield _sse_event("done", {"answer": ai_answer, "partial": builder.partial})
+
+    response = Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    if frames is not None:
+        # 上游会话在返回响应前就已启动；响应体还没开始迭代客户端就断开时，generate() 里的 finally 不会执行，
+        # 因此在响应关闭时再关闭一次 (重复关闭生成器没有副作用)
+        response.call_on_close(frames.close)
+    return response
+
 # --- 新增：API #11 ---
 # 路由：POST /api/chat/medical/upload (带文件的问答)
 @chat_bp.route('/medical/upload', methods=['POST'])
@@ -165,21 +526,67 @@ def chat_medical_upload():
         
         logging.info(f"Combined question for LLM: {combined_question}")
 
-        # 5. 调用 LLM 服务 (使用合并后的文本)
-        ai_answer = llm_service.get_ai_response(combined_question)
+        if wants_async():
+            latest_consultation = find_or_create_main_ai_consultation(user_id)
+            return _accepted_job_response(enqueue_chat_job(user_id, latest_consultation.id, combined_question, use_cache=False))
+
+        # 5. 调用 LLM 服务 (使用合并后的文本)；附件内容因人而异，不使用回答缓存
+        latest_consultation = find_or_create_main_ai_consultation(user_id)
+        ai_answer = llm_service.get_ai_response(
+            combined_question, use_cache=False,
+            deadline_seconds=current_app.config['CHAT_DEADLINE_SECONDS'],
+            cancelled=client_disconnect_checker(),
+            priority=chat_priority(user_id),
+            context=consultation_context(latest_consultation.id)
+        )
         
         # 6. 保存到历史记录 (保存合并后的问题)
-        latest_consultation = find_or_create_main_ai_consultation(user_id)
         add_chat_message_to_consultation(user_id, latest_consultation.id, combined_question, ai_answer)
         
         # 7. 返回成功响应 [cite: 1553]
-        return jsonify({"answer": ai_answer}), 200
+        return jsonify({"answer": ai_answer, "partial": llm_service.is_partial_answer(ai_answer)}), 200
 
+    except UpstreamBusyError as e:
+        return _busy_response(e)
+    except RequestCancelled:
+        return _cancelled_response()
     except Exception as e:
         logging.error(f"Error in /api/chat/medical/upload: {e}", exc_info=True)
-        return jsonify({"error_code": 500, "message": "服务器内部错误"}), 500 [cite: 1563]
+        return jsonify({"error_code": 500, "message": "服务器内部错误"}), 500
 # --- API #11 结束 ---
 
+@chat_bp.route('/jobs/<int:job_id>', methods=['GET'])
+@jwt_required()
+def get_chat_job_status(job_id):
+    """查询异步问答任务的状态，完成后包含 AI 回答"""
+    from ..schemas.chat_job_schema import ChatJobSchema
+    try:
+        user_id = get_jwt_identity()
+        job = get_chat_job(user_id, job_id)
+        if not job:
+            return jsonify({"error_code": 404, "message": f"未找到ID为{job_id}的任务"}), 404
+        return jsonify(ChatJobSchema().dump(job)), 200
+    except Exception as e:
+        print(f"Error in /api/chat/jobs/{job_id}: {e}")
+        return jsonify({"error_code": 500, "message": "服务器内部错误"}), 500
+
+@chat_bp.route('/jobs/<int:job_id>', methods=['DELETE'])
+@jwt_required()
+def cancel_chat_job_request(job_id):
+    """取消异步问答任务；正在执行的任务会关闭上游会话，不再写回回答"""
+    from ..schemas.chat_job_schema import ChatJobSchema
+    try:
+        user_id = get_jwt_identity()
+        job, cancelled = cancel_chat_job(user_id, job_id)
+        if not job:
+            return jsonify({"error_code": 404, "message": f"未找到ID为{job_id}的任务"}), 404
+        if not cancelled:
+            return jsonify({"error_code": 409, "message": "任务已结束，无法取消", "status": job.status}), 409
+        return jsonify(ChatJobSchema().dump(job)), 200
+    except Exception as e:
+        print(f"Error in DELETE /api/chat/jobs/{job_id}: {e}")
+        return jsonify({"error_code": 500, "message": "服务器内部错误"}), 500
+
 @chat_bp.route('/new', methods=['POST'])
 @jwt_required()
 def new_chat():
@@ -200,14 +607,38 @@ def new_chat():
 @chat_bp.route('/medical/record', methods=['POST'])
 @jwt_required()
 def generate_medical_record():
-    """根据用户的问诊历史记录生成结构化电子病历"""
+    """
+    根据用户的问诊历史记录生成结构化电子病历。
+    生成在后台任务中进行：立即返回 202 和任务查询地址，完成后通过 GET /medical/record/jobs/<id> 获取病历
+    """
     try:
         user_id = get_jwt_identity()
-        # 调用service层生成病历
-        medical_record = generate_medical_record_from_history(user_id)
-        if not medical_record:
-            return jsonify({"error_code": 404, "message": "无足够的问诊记录生成病历"}), 404
-        return jsonify(medical_record), 200
+        job = enqueue_medical_record_job(user_id)
+        return _accepted_job_response(
+            job, f"/api/chat/medical/record/jobs/{job.id}", current_app.config['MEDICAL_RECORD_JOB_POLL_SECONDS']
+        )
     except Exception as e:
+        db.session.rollback()
         print(f"Error in /api/chat/medical/record: {e}")
-    return jsonify({"error_code": 500, "message": "生成病历失败，请稍后重试"}), 500
\ No newline at end of file
+    return jsonify({"error_code": 500, "message": "生成病历失败，请稍后重试"}), 500
+
+@chat_bp.route('/medical/record/jobs/<int:job_id>', methods=['GET'])
+@jwt_required()
+def get_medical_record_job_status(job_id):
+    """
+    查询病历生成任务的状态，成功后包含生成的病历 (record)。
+    任务未结束时立即返回，并通过 Retry-After 告知客户端多久后再查询 (不在请求线程中等待，避免占住 WSGI worker)
+    """
+    from ..schemas.medical_record_schema import MedicalRecordJobSchema
+    try:
+        user_id = get_jwt_identity()
+        job = get_medical_record_job(user_id, job_id)
+        if not job:
+            return jsonify({"error_code": 404, "message": f"未找到ID为{job_id}的任务"}), 404
+        response = jsonify(MedicalRecordJobSchema().dump(job))
+        if job.status not in FINISHED_STATUSES:
+            response.headers['Retry-After'] = str(current_app.config['MEDICAL_RECORD_JOB_POLL_SECONDS'])
+        return response, 200
+    except Exception as e:
+        print(f"Error in /api/chat/medical/record/jobs/{job_id}: {e}")
+        return jsonify({"error_code": 500, "message": "服务器内部错误"}), 500
\ No newline at end of file
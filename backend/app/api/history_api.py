@@ -1,6 +1,6 @@
 from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from ..services.history_service import get_recent_consultation, get_all_consulations
+from ..services.history_service import get_recent_consultation, get_consultation_timeline
 # 导入需要检查类型的模型
 from ..models.consultation_model import AIConsultationModel, DoctorConsultationModel
 from ..services.history_service import create_ai_consultation_record
@@ -31,21 +31,39 @@ def get_recent_history():
     else:
         return jsonify({"error_code": 500, "message": "服务器内部错误"}), 500
     
+# 只传 before 不传 limit 时的每页问诊数
+CONSULTATION_TIMELINE_DEFAULT_PAGE_SIZE = 20
+
 @history_bp.route('/all',methods=['GET'])
 @jwt_required()
 def get_all_history():
+    """
+    获取当前用户的全部问诊记录 (AI 与医生问诊合并，按问诊时间倒序)。
+    传入 ?limit=N (以及上一页返回的 ?before=nextCursor) 时按页返回 {"records": [...], "nextCursor": ...}。
+    """
     from ..schemas.history_schema import AiConsultationSchema, DoctorConsultationSchema
-    ai_schema = AiConsultationSchema(many=True)
-    doctor_schema = DoctorConsultationSchema(many=True)
+    schemas = {'ai': AiConsultationSchema(), 'doctor': DoctorConsultationSchema()}
 
     current_user_id = get_jwt_identity()
-    ai_records,doctor_records=get_all_consulations(current_user_id)
-    ai_list = ai_schema.dump(ai_records)
-    doctor_list = doctor_schema.dump(doctor_records)
-    all_records=ai_list+doctor_list
+    limit = request.args.get('limit')
+    before = request.args.get('before')
+    paged = limit is not None or before is not None
+    try:
+        # 与 /api/chat/history 一致：limit 必须是正整数，格式不正确时返回 400，而不是退回完整列表
+        if limit is not None:
+            limit = int(limit)
+            if limit < 1:
+                raise ValueError(f"invalid limit: {limit}")
+        elif paged:
+            limit = CONSULTATION_TIMELINE_DEFAULT_PAGE_SIZE
+        entries, next_cursor = get_consultation_timeline(current_user_id, limit, before)
+    except ValueError:
+        return jsonify({"error_code": 400, "message": "无效的分页游标"}), 400
 
-    sorted_records=sorted(all_records,key=lambda r: (r.get('date',''),r.get('time','')),reverse=True)
-    return jsonify(sorted_records),200
+    records = [schemas[kind].dump(record) for kind, record in entries]
+    if not paged:
+        return jsonify(records),200
+    return jsonify({"records": records, "nextCursor": next_cursor}),200
 
 # -------------------------------------------------
 #注意：经过对前端文件await apiService.createMedicalRecord(messageContent, aiAnswer);改为注释
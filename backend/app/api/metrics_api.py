@@ -0,0 +1,30 @@
+# backend/app/api/metrics_api.py
+from flask import Blueprint, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from ..services import answer_cache, llm_service, faq_index
+from ..services.user_service import get_user_by_id
+
+# 运行指标 (供监控系统抓取)，数值为当前 worker 进程内的统计
+# 指标中包含上游地址、熔断错误信息等内部细节，只允许医生账号 (监控使用的服务账号) 访问
+metrics_bp = Blueprint('metrics_api', __name__, url_prefix='/api/metrics')
+
+METRICS_ALLOWED_ROLES = ('doctor',)
+
+@metrics_bp.route('/llm', methods=['GET'])
+@jwt_required()
+def get_llm_metrics():
+    """LLM 上游调用相关的运行指标"""
+    user = get_user_by_id(get_jwt_identity())
+    if user is None or user.role not in METRICS_ALLOWED_ROLES:
+        return jsonify({"error_code": 403, "message": "无权访问运行指标"}), 403
+
+    return jsonify({
+        "cache": answer_cache.cache_stats(),
+        "faq": faq_index.faq_stats(),
+        "single_flight": llm_service.single_flight_stats(),
+        "bulkhead": llm_service.bulkhead_stats(),
+        "breaker": llm_service.breaker_stats(),
+        "upstreams": llm_service.upstream_stats(),
+        "warm_pool": llm_service.warm_pool_stats(),
+        "sessions": llm_service.session_stats()
+    }), 200
@@ -10,6 +10,28 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'a-hard-to-guess-string'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(days=1)
+    # 异步问答任务：每个进程的后台 worker 线程数、执行租约时长(秒)、最大尝试次数
+    CHAT_JOB_WORKERS = int(os.environ.get('CHAT_JOB_WORKERS', 4))
+    CHAT_JOB_LEASE_SECONDS = int(os.environ.get('CHAT_JOB_LEASE_SECONDS', 300))
+    CHAT_JOB_MAX_ATTEMPTS = int(os.environ.get('CHAT_JOB_MAX_ATTEMPTS', 3))
+    # 异步病历生成任务：与问答任务分开配置并发 worker 数，病历生成耗时更长
+    MEDICAL_RECORD_JOB_WORKERS = int(os.environ.get('MEDICAL_RECORD_JOB_WORKERS', 2))
+    MEDICAL_RECORD_JOB_LEASE_SECONDS = int(os.environ.get('MEDICAL_RECORD_JOB_LEASE_SECONDS', 180))
+    MEDICAL_RECORD_JOB_MAX_ATTEMPTS = int(os.environ.get('MEDICAL_RECORD_JOB_MAX_ATTEMPTS', 3))
+    # 病历预生成：问诊中每新增多少轮问答自动在后台预生成一次病历 (0 表示关闭)，以及每个用户的最小间隔(秒)
+    MEDICAL_RECORD_PREGENERATE_TURNS = int(os.environ.get('MEDICAL_RECORD_PREGENERATE_TURNS', 0))
+    MEDICAL_RECORD_PREGENERATE_INTERVAL_SECONDS = int(os.environ.get('MEDICAL_RECORD_PREGENERATE_INTERVAL_SECONDS', 600))
+    # 病历生成任务未结束时建议客户端再次查询的间隔(秒)，通过 Retry-After 响应头返回
+    MEDICAL_RECORD_JOB_POLL_SECONDS = int(os.environ.get('MEDICAL_RECORD_JOB_POLL_SECONDS', 2))
+    # 同步问答接口的整体时限(秒)：到期时返回已生成的部分回答，而不是一直等到上游超时
+    CHAT_DEADLINE_SECONDS = float(os.environ.get('CHAT_DEADLINE_SECONDS', 90))
+    CHAT_STREAM_DEADLINE_SECONDS = float(os.environ.get('CHAT_STREAM_DEADLINE_SECONDS', 180))
+    # SSE 心跳间隔(秒)：定期写出注释行，以便及时发现已断开的客户端并关闭上游会话
+    CHAT_STREAM_HEARTBEAT_SECONDS = float(os.environ.get('CHAT_STREAM_HEARTBEAT_SECONDS', 15))
+    # 批量问答接口一次最多接受的问题数 (每个问题占用一个上游并发名额)
+    CHAT_BATCH_MAX_QUESTIONS = int(os.environ.get('CHAT_BATCH_MAX_QUESTIONS', 8))
+    # FAQ 检索索引的增量刷新间隔(秒)，0 表示不加载 FAQ 索引
+    FAQ_INDEX_REFRESH_SECONDS = float(os.environ.get('FAQ_INDEX_REFRESH_SECONDS', 300))
 
 class DevelopmentConfig(Config):
     """开发环境配置"""
@@ -29,6 +51,10 @@ class TestingConfig(Config):
     # --- 添加下面这一行，以明确禁用 Flask-WTF 的 CSRF 功能 ---
     # 这样可以防止任何隐式的 CSRF 启用
     WTF_CSRF_ENABLED = False
+    # 测试中不启动后台线程，由测试用例显式调用 process_next_chat_job() 执行任务
+    CHAT_JOB_WORKERS = 0
+    MEDICAL_RECORD_JOB_WORKERS = 0
+    FAQ_INDEX_REFRESH_SECONDS = 0
 
 class ProductionConfig(Config):
     """生产环境配置"""
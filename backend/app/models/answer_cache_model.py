@@ -0,0 +1,42 @@
+# backend/app/models/answer_cache_model.py
+
+from datetime import datetime
+from ..core.extensions import db # 导入 db 实例
+
+class AnswerCacheModel(db.Model):
+    """
+    AI 回答的共享缓存 (所有 gunicorn worker 共用)。
+    以归一化后问题的哈希为键。
+    """
+    __tablename__ = 'answer_cache'
+
+    id = db.Column(db.Integer, primary_key=True)
+    cache_key = db.Column(db.String(64), unique=True, nullable=False, comment='归一化问题的 SHA-256')
+    normalized_question = db.Column(db.Text, nullable=False, comment='归一化后的问题文本')
+    answer = db.Column(db.Text, nullable=False, comment='缓存的AI回答')
+    hit_count = db.Column(db.Integer, nullable=False, default=0, comment='命中次数')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, comment='写入时间')
+    expires_at = db.Column(db.DateTime, nullable=False, comment='过期时间')
+    last_used_at = db.Column(db.DateTime, default=datetime.utcnow, comment='最近一次命中或写入的时间 (用于 LRU 淘汰)')
+
+    def __repr__(self):
+        return f'<AnswerCache {self.cache_key[:8]}>'
+
+
+class LLMRequestLeaseModel(db.Model):
+    """
+    跨 worker 的请求合并租约：同一个归一化问题同时只有一个 worker 调用上游，
+    其他 worker 等待这一行变为 done 后直接读取 answer。
+    """
+    __tablename__ = 'llm_request_leases'
+
+    id = db.Column(db.Integer, primary_key=True)
+    request_key = db.Column(db.String(64), unique=True, nullable=False, comment='归一化问题的 SHA-256')
+    owner = db.Column(db.String(100), nullable=False, comment='持有租约的 worker (host:pid:thread)')
+    status = db.Column(db.String(20), nullable=False, default='running', comment="状态 ('running', 'done')")
+    answer = db.Column(db.Text, nullable=True, comment='上游返回的回答 (done 之后可读)')
+    expires_at = db.Column(db.DateTime, nullable=False, comment='租约/结果的过期时间')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, comment='创建时间')
+
+    def __repr__(self):
+        return f'<LLMRequestLease {self.request_key[:8]} {self.status}>'
@@ -5,6 +5,8 @@ from werkzeug.security import generate_password_hash, check_password_hash
 
 class AppointmentModel(db.Model):
     __tablename__ = 'appointments'
+    # 按病人和状态查询预约并按预约时间排序 (get_pending_appointments / has_urgent_appointment)
+    __table_args__ = (db.Index('ix_appointments_patient_id_status_appointment_time', 'patient_id', 'status', 'appointment_time'),)
     
     id = db.Column(db.Integer, primary_key=True)
     patient_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, comment='关联的病人ID')
@@ -5,6 +5,8 @@ from werkzeug.security import generate_password_hash, check_password_hash
 
 class AIConsultationModel(db.Model):
     __tablename__ = 'ai_consultations'
+    # 按病人查询最近的问诊 (get_consultation_timeline / find_or_create_main_ai_consultation)
+    __table_args__ = (db.Index('ix_ai_consultations_patient_id_created_at', 'patient_id', 'created_at'),)
     
     id = db.Column(db.Integer, primary_key=True)
     patient_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, comment='关联的病人ID')
@@ -15,6 +17,8 @@ class AIConsultationModel(db.Model):
     ai_confidence = db.Column(db.Float, comment='AI诊断的匹配度')
     ai_analysis = db.Column(db.Text, comment='AI给出的详细分析')
     created_at = db.Column(db.DateTime, default=datetime.utcnow, comment='问诊创建时间')
+    context_summary = db.Column(db.Text, nullable=True, comment='发给 AI 的滚动摘要 (较早的问答按轮增量压缩)')
+    summary_message_id = db.Column(db.Integer, nullable=True, comment='已并入滚动摘要的最后一条消息ID')
     
     # 关系定义：一次问诊包含多条聊天消息 (一对多)
     chat_messages = db.relationship('ChatMessageModel', backref='consultation', lazy=True, cascade="all, delete-orphan")
@@ -23,6 +27,8 @@ class AIConsultationModel(db.Model):
 
 class ChatMessageModel(db.Model):
     __tablename__ = 'chat_messages'
+    # 按问诊读取消息并按时间排序 (get_chat_history)
+    __table_args__ = (db.Index('ix_chat_messages_consultation_id_timestamp', 'consultation_id', 'timestamp'),)
     
     id = db.Column(db.Integer, primary_key=True)
     consultation_id = db.Column(db.Integer, db.ForeignKey('ai_consultations.id'), nullable=False, comment='关联的AI问诊ID')
@@ -32,6 +38,8 @@ class ChatMessageModel(db.Model):
 
 class DoctorConsultationModel(db.Model):
     __tablename__ = 'doctor_consultations'
+    # 问诊时间线按病人查询并按问诊时间排序 (get_consultation_timeline / get_recent_consultation)
+    __table_args__ = (db.Index('ix_doctor_consultations_patient_id_appointment_time', 'patient_id', 'appointment_time'),)
     
     id = db.Column(db.Integer, primary_key=True)
     
@@ -50,4 +58,25 @@ class DoctorConsultationModel(db.Model):
     # --- SQLAlchemy 关系定义 ---
     # 为了避免和 UserModel 中已有的 backref 冲突，可以为 patient 和 doctor 的 backref 指定不同的名字
     patient = db.relationship('UserModel', foreign_keys=[patient_id], backref='patient_consultations')
-    doctor = db.relationship('UserModel', foreign_keys=[doctor_id], backref='doctor_consultations')
\ No newline at end of file
+    doctor = db.relationship('UserModel', foreign_keys=[doctor_id], backref='doctor_consultations')
+
+class ChatJobModel(db.Model):
+    """
+    异步问答任务 (POST 入队，后台 worker 执行 LLM 调用后写回)。
+    持久化在数据库中，worker 重启后仍可被重新领取。
+    """
+    __tablename__ = 'chat_jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    patient_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, comment='关联的病人ID')
+    consultation_id = db.Column(db.Integer, db.ForeignKey('ai_consultations.id'), nullable=False, comment='答案写入的AI问诊ID')
+    question = db.Column(db.Text, nullable=False, comment='用户问题 (含附件链接)')
+    answer = db.Column(db.Text, nullable=True, comment='AI回答')
+    use_cache = db.Column(db.Boolean, nullable=False, default=True, server_default=db.true(), comment='是否允许使用回答缓存 (带附件的问题为 False)')
+    status = db.Column(db.String(20), nullable=False, default='queued', comment="状态 ('queued', 'running', 'succeeded', 'failed', 'cancelled')")
+    attempts = db.Column(db.Integer, nullable=False, default=0, comment='已被领取执行的次数')
+    error = db.Column(db.Text, nullable=True, comment='失败原因')
+    lease_expires_at = db.Column(db.DateTime, nullable=True, comment='执行租约到期时间，过期后可被其他worker重新领取')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, comment='任务创建时间')
+    started_at = db.Column(db.DateTime, nullable=True, comment='最近一次开始执行的时间')
+    finished_at = db.Column(db.DateTime, nullable=True, comment='任务结束时间')
@@ -5,6 +5,8 @@ from ..core.extensions import db # 导入 db 实例
 
 class MedicalRecordModel(db.Model):
     __tablename__ = 'medical_records' # 定义表名
+    # 按病人查询病历并按创建时间排序 (get_records_for_patient)
+    __table_args__ = (db.Index('ix_medical_records_patient_id_created_at', 'patient_id', 'created_at'),)
 
     # 根据文档 API #19 定义字段
     id = db.Column(db.Integer, primary_key=True) # 病历记录的唯一 ID
@@ -19,9 +21,37 @@ class MedicalRecordModel(db.Model):
     diagnosis = db.Column(db.Text, nullable=True, comment='诊断结果')
 
     created_at = db.Column(db.DateTime, default=datetime.utcnow, comment='病历创建时间')
+    # 生成病历时输入内容 (问诊消息ID + 病人档案中的病史字段) 的指纹，输入未变化时直接复用该病历
+    source_fingerprint = db.Column(db.String(64), nullable=True, index=True, comment='生成输入内容的指纹 (sha256)')
+    # 本病历已覆盖到的最后一条问诊消息，下次只把之后的新问答发给 AI 增量生成
+    last_message_id = db.Column(db.Integer, nullable=True, comment='已覆盖的最后一条 chat_messages.id')
 
     # 添加关系，方便从 User 模型访问病历 (可选，但推荐)
     patient = db.relationship('UserModel', backref=db.backref('medical_records', lazy=True))
 
     def __repr__(self):
-        return f'<MedicalRecord {self.id} for Patient {self.patient_id}>'
\ No newline at end of file
+        return f'<MedicalRecord {self.id} for Patient {self.patient_id}>'
+
+class MedicalRecordJobModel(db.Model):
+    """
+    异步病历生成任务 (POST 入队，后台 worker 调用 AI 生成病历后关联到 medical_records)。
+    与 chat_jobs 使用同一套任务队列 (见 services/job_queue.py)。
+    """
+    __tablename__ = 'medical_record_jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    patient_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, comment='关联的病人ID')
+    medical_record_id = db.Column(db.Integer, db.ForeignKey('medical_records.id'), nullable=True, comment='生成的病历ID (成功后写入)')
+    status = db.Column(db.String(20), nullable=False, default='queued', comment="状态 ('queued', 'running', 'succeeded', 'failed', 'cancelled')")
+    speculative = db.Column(db.Boolean, nullable=False, default=False, comment='是否为问诊过程中自动触发的预生成任务 (上游繁忙时直接放弃)')
+    attempts = db.Column(db.Integer, nullable=False, default=0, comment='已被领取执行的次数')
+    error = db.Column(db.Text, nullable=True, comment='失败原因')
+    lease_expires_at = db.Column(db.DateTime, nullable=True, comment='执行租约到期时间，过期后可被其他worker重新领取')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, comment='任务创建时间')
+    started_at = db.Column(db.DateTime, nullable=True, comment='最近一次开始执行的时间')
+    finished_at = db.Column(db.DateTime, nullable=True, comment='任务结束时间')
+
+    medical_record = db.relationship('MedicalRecordModel')
+
+    def __repr__(self):
+        return f'<MedicalRecordJob {self.id} {self.status}>'
@@ -0,0 +1,15 @@
+# backend/app/schemas/chat_job_schema.py
+from ..core.extensions import ma
+from marshmallow import fields
+
+class ChatJobSchema(ma.Schema):
+    """
+    序列化异步问答任务 (GET /api/chat/jobs/<id>)
+    """
+    jobId = fields.Str(attribute="id")
+    consultationId = fields.Int(attribute="consultation_id")
+    status = fields.Str()
+    answer = fields.Str(allow_none=True)
+    error = fields.Str(allow_none=True)
+    createdAt = fields.DateTime(attribute="created_at")
+    finishedAt = fields.DateTime(attribute="finished_at", allow_none=True)
@@ -36,4 +36,16 @@ class MedicalRecordDetailSchema(ma.Schema):
     #
     诊断 = fields.Str(attribute="diagnosis")
     #
-    createdAt = fields.DateTime(attribute="created_at")
\ No newline at end of file
+    createdAt = fields.DateTime(attribute="created_at")
+
+class MedicalRecordJobSchema(ma.Schema):
+    """
+    序列化异步病历生成任务 (GET /api/chat/medical/record/jobs/<id>)，成功后包含生成的病历详情
+    """
+    jobId = fields.Str(attribute="id")
+    status = fields.Str()
+    error = fields.Str(allow_none=True)
+    recordId = fields.Str(attribute="medical_record_id", allow_none=True)
+    record = fields.Nested(MedicalRecordDetailSchema, attribute="medical_record", allow_none=True)
+    createdAt = fields.DateTime(attribute="created_at")
+    finishedAt = fields.DateTime(attribute="finished_at", allow_none=True)
@@ -0,0 +1,287 @@
+# backend/app/services/answer_cache.py
+"""
+get_ai_response 前面的回答缓存。
+
+键是问题的归一化形式：去掉空白和标点、全角转半角、繁体转简体、统一小写，
+因此 "感冒发烧怎么办？" 和 "感冒 發燒 怎麼辦" 会命中同一条缓存。
+带问诊上下文的问题 (见 context_service) 在键中加入上下文 (摘要 + 最近轮次) 的摘要值，
+只有上下文完全相同时 (同一问诊中的重复提交、客户端重试) 才共用回答，不会把结合某人病情的回答给其他人。
+
+两种后端：
+    memory  进程内 LRU + TTL
+    db      answer_cache 表，所有 gunicorn worker 共享
+通过环境变量 LLM_CACHE_BACKEND 选择 ('memory' / 'db' / 'none')。
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.exc import IntegrityError
+
+# --- 配置 ---
+LLM_CACHE_BACKEND = os.environ.get("LLM_CACHE_BACKEND", "memory")
+LLM_CACHE_MAX_SIZE = int(os.environ.get("LLM_CACHE_MAX_SIZE", "1000"))
+LLM_CACHE_TTL_SECONDS = int(os.environ.get("LLM_CACHE_TTL_SECONDS", str(24 * 3600)))
+
+# 常见问诊用字的繁简对照 (只做单字映射，足以覆盖问题归一化的需要)
+_TRADITIONAL = "發燒頭嗎麼辦醫藥療診斷嚨腸臟腎腦癥狀過體溫熱風濕氣壓兒婦產懷經應該還會這個說話時間後覺難劑購買營養減運動暈噁惡嘔瀉傷膿腫瘡癢膚髮脫齒齦檢報結數據異們樣為與沒點喫飯開關門問題復複癒頸節腳膽臉紅燙鬱憂慮緊張陽陰嬰餵歲長處線鐘級嗽療衛動鼻塗貼針輸測驗"
+_SIMPLIFIED = "发烧头吗么办医药疗诊断咙肠脏肾脑症状过体温热风湿气压儿妇产怀经应该还会这个说话时间后觉难剂购买营养减运动晕恶恶呕泻伤脓肿疮痒肤发脱齿龈检报结数据异们样为与没点吃饭开关门问题复复愈颈节脚胆脸红烫郁忧虑紧张阳阴婴喂岁长处线钟级嗽疗卫动鼻涂贴针输测验"
+_T2S = str.maketrans(_TRADITIONAL, _SIMPLIFIED)
+
+
+def normalize_question(question: str) -> str:
+    """把问题归一化为缓存键使用的形式"""
+    # NFKC 会把全角字母、数字、标点转换为半角
+    text = unicodedata.normalize("NFKC", question or "")
+    text = text.translate(_T2S).lower()
+    # 去掉所有空白、标点和控制字符
+    return "".join(
+        ch for ch in text
+        if unicodedata.category(ch)[0] not in ("P", "Z", "C")
+    )
+
+
+def context_digest(context) -> str:
+    """问诊上下文中影响回答的部分 (摘要和最近轮次) 的摘要值"""
+    payload = json.dumps(
+        {"summary": context.get("summary", ""), "history": context.get("history", [])},
+        ensure_ascii=False, sort_keys=True
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def cache_key(question: str, context: dict = None) -> str:
+    normalized = normalize_question(question)
+    if context:
+        normalized = f"{normalized}\n{context_digest(context)}"
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+class CacheStats:
+    """命中/未命中计数 (进程内)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.bypassed = 0
+
+    def incr(self, field):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def snapshot(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "bypassed": self.bypassed,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+class MemoryAnswerCache:
+    """进程内 LRU 缓存，条目超过 ttl_seconds 后失效"""
+
+    name = "memory"
+
+    def __init__(self, max_size, ttl_seconds):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            answer, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return answer
+
+    def set(self, key, normalized_question, answer):
+        with self._lock:
+            self._entries[key] = (answer, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def size(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class DatabaseAnswerCache:
+    """
+    answer_cache 表作为共享缓存。
+    使用独立的连接和事务 (db.engine.begin())，不会提交调用方 db.session 中未完成的修改。
+    """
+
+    name = "db"
+
+    def __init__(self, max_size, ttl_seconds):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+
+    @property
+    def _table(self):
+        from ..models.answer_cache_model import AnswerCacheModel
+        return AnswerCacheModel.__table__
+
+    def _engine(self):
+        from ..core.extensions import db
+        return db.engine
+
+    def get(self, key):
+        table = self._table
+        now = datetime.utcnow()
+        with self._engine().begin() as conn:
+            row = conn.execute(
+                select(table.c.id, table.c.answer, table.c.expires_at).where(table.c.cache_key == key)
+            ).first()
+            if row is None:
+                return None
+            if row.expires_at < now:
+                conn.execute(delete(table).where(table.c.id == row.id))
+                return None
+            conn.execute(
+                update(table).where(table.c.id == row.id)
+                .values(hit_count=table.c.hit_count + 1, last_used_at=now)
+            )
+            return row.answer
+
+    def set(self, key, normalized_question, answer):
+        table = self._table
+        now = datetime.utcnow()
+        values = dict(
+            normalized_question=normalized_question,
+            answer=answer,
+            created_at=now,
+            expires_at=now + timedelta(seconds=self.ttl_seconds),
+            last_used_at=now,
+        )
+        try:
+            with self._engine().begin() as conn:
+                updated = conn.execute(update(table).where(table.c.cache_key == key).values(**values))
+                if updated.rowcount == 0:
+                    conn.execute(table.insert().values(cache_key=key, hit_count=0, **values))
+        except IntegrityError:
+            # 另一个 worker 同时写入了同一个键，保留对方的结果即可
+            return
+        self._evict()
+
+    def _evict(self):
+        """删除过期条目，并按 last_used_at 淘汰超出 max_size 的最久未使用条目"""
+        table = self._table
+        with self._engine().begin() as conn:
+            conn.execute(delete(table).where(table.c.expires_at < datetime.utcnow()))
+            stale_ids = conn.execute(
+                select(table.c.id).order_by(table.c.last_used_at.desc(), table.c.id.desc())
+                .offset(self.max_size)
+            ).scalars().all()
+            if stale_ids:
+                conn.execute(delete(table).where(table.c.id.in_(stale_ids)))
+
+    def clear(self):
+        with self._engine().begin() as conn:
+            conn.execute(delete(self._table))
+
+    def size(self):
+        with self._engine().begin() as conn:
+            return conn.execute(select(func.count()).select_from(self._table)).scalar()
+
+
+_BACKENDS = {
+    "memory": MemoryAnswerCache,
+    "db": DatabaseAnswerCache,
+}
+
+stats = CacheStats()
+_cache = None
+_configured = False
+_config_lock = threading.Lock()
+
+
+def configure_cache(backend=None, max_size=None, ttl_seconds=None):
+    """(重新)选择缓存后端并清零统计；backend 为 'none' 时关闭缓存"""
+    global _cache, _configured, stats
+    backend = backend or LLM_CACHE_BACKEND
+    with _config_lock:
+        if backend == "none":
+            _cache = None
+        elif backend in _BACKENDS:
+            _cache = _BACKENDS[backend](
+                max_size or LLM_CACHE_MAX_SIZE,
+                ttl_seconds or LLM_CACHE_TTL_SECONDS
+            )
+        else:
+            raise ValueError(f"Unknown LLM_CACHE_BACKEND: {backend}")
+        stats = CacheStats()
+        _configured = True
+    return _cache
+
+
+def get_cache():
+    if not _configured:
+        configure_cache()
+    return _cache
+
+
+def lookup(question, context=None):
+    """查询缓存，命中返回回答，未命中 (或缓存不可用) 返回 None"""
+    cache = get_cache()
+    if cache is None:
+        return None
+    try:
+        answer = cache.get(cache_key(question, context))
+    except Exception as e:
+        print(f"answer_cache: lookup failed ({cache.name}): {e}")
+        answer = None
+    stats.incr("hits" if answer is not None else "misses")
+    return answer
+
+
+def store(question, answer, context=None):
+    """把成功的回答写入缓存"""
+    cache = get_cache()
+    if cache is None:
+        return
+    try:
+        cache.set(cache_key(question, context), normalize_question(question), answer)
+        stats.incr("stores")
+    except Exception as e:
+        print(f"answer_cache: store failed ({cache.name}): {e}")
+
+
+def record_bypass():
+    stats.incr("bypassed")
+
+
+def cache_stats():
+    """供监控接口使用的缓存统计"""
+    cache = get_cache()
+    snapshot = stats.snapshot()
+    snapshot["backend"] = cache.name if cache is not None else "none"
+    try:
+        snapshot["size"] = cache.size() if cache is not None else 0
+    except Exception:
+        snapshot["size"] = None
+    return snapshot
@@ -69,4 +69,15 @@ def get_pending_appointments(patient_id):
         AppointmentModel.status == 'scheduled' # 'scheduled' 状态表示待确认
     ).order_by(AppointmentModel.appointment_time).all()
 
-    return pending_appointments
\ No newline at end of file
+    return pending_appointments
+
+
+def has_urgent_appointment(patient_id):
+    """患者是否有尚未完成的加急预约 (用于提高其 AI 问答的调度优先级)"""
+    return db.session.query(
+        AppointmentModel.query.filter(
+            AppointmentModel.patient_id == patient_id,
+            AppointmentModel.status == 'scheduled',
+            AppointmentModel.is_urgent.is_(True)
+        ).exists()
+    ).scalar()
@@ -0,0 +1,231 @@
+# backend/app/services/bulkhead.py
+"""
+FastAPI 上游的舱壁 (bulkhead)：限制同时进行的上游会话数，并提供一个有界的等待队列。
+
+队列已满时立即抛出 UpstreamBusyError (接口返回 429 + Retry-After)，
+而不是让请求堆积在上游直到 120 秒超时。
+所有 acquire/release 都发生在 llm_runtime 的事件循环线程上，因此不需要额外的锁。
+
+等待队列按优先级分类，名额空出时用加权公平排队 (WFQ) 决定下一个请求：
+    urgent       有加急预约的病人的问答
+    interactive  普通问答 (默认)
+    background   病历生成等后台任务
+每个请求按 "虚拟完成时间 = max(全局虚拟时间, 本类上一个完成时间) + 1/权重" 排序，
+高峰期各类按权重比例分到名额，后台任务也不会被完全饿死；
+后台任务另外最多只能占用 LLM_BACKGROUND_MAX_SHARE 比例的并发名额和队列，避免挤占交互请求。
+"""
+
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+# --- 配置 ---
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "16"))
+LLM_MAX_QUEUE = int(os.environ.get("LLM_MAX_QUEUE", "32"))
+LLM_QUEUE_TIMEOUT = float(os.environ.get("LLM_QUEUE_TIMEOUT", "30"))
+
+PRIORITY_URGENT = 'urgent'
+PRIORITY_INTERACTIVE = 'interactive'
+PRIORITY_BACKGROUND = 'background'
+
+
+def _parse_weights(value):
+    """解析 "urgent=8,interactive=4,background=1" 形式的权重配置"""
+    weights = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        if name.strip() and weight.strip():
+            weights[name.strip()] = float(weight)
+    return weights
+
+
+LLM_PRIORITY_WEIGHTS = _parse_weights(
+    os.environ.get("LLM_PRIORITY_WEIGHTS", "urgent=8,interactive=4,background=1")
+)
+LLM_BACKGROUND_MAX_SHARE = float(os.environ.get("LLM_BACKGROUND_MAX_SHARE", "0.5"))
+
+
+class UpstreamBusyError(RuntimeError):
+    """上游暂时无法接收请求 (容量已满)，调用方应在 retry_after 秒后重试"""
+
+    status_code = 429
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _ClassStats:
+    def __init__(self):
+        self.active = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.wait_samples = deque(maxlen=1000)
+
+
+def _wait_summary(samples):
+    waits = sorted(samples)
+    p95 = waits[math.ceil(len(waits) * 0.95) - 1] if waits else 0.0
+    return {
+        "wait_ms_avg": round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+        "wait_ms_p95": round(p95 * 1000, 1),
+        "wait_ms_max": round(waits[-1] * 1000, 1) if waits else 0.0,
+    }
+
+
+class Bulkhead:
+    def __init__(self, max_concurrent, max_queue, queue_timeout,
+                 weights=None, background_max_share=LLM_BACKGROUND_MAX_SHARE):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.weights = dict(weights or LLM_PRIORITY_WEIGHTS)
+        for priority in (PRIORITY_URGENT, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND):
+            self.weights.setdefault(priority, 1.0)
+        self.background_max_active = max(1, int(max_concurrent * background_max_share))
+        self.background_max_queue = max(1, int(max_queue * background_max_share))
+        self.active = 0
+        # 每个优先级一个等待队列，元素为 [虚拟完成时间, future]
+        self._waiters = {priority: deque() for priority in self.weights}
+        self._virtual_time = 0.0
+        self._last_finish = {priority: 0.0 for priority in self.weights}
+        # 统计
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._classes = {priority: _ClassStats() for priority in self.weights}
+        self._wait_samples = deque(maxlen=1000)
+        self._hold_samples = deque(maxlen=200)
+
+    @property
+    def queued(self):
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+    def retry_after(self):
+        """按平均会话耗时估算排到队尾所需的时间 (秒)"""
+        avg_hold = (sum(self._hold_samples) / len(self._hold_samples)) if self._hold_samples else 10.0
+        return max(1, math.ceil(avg_hold * (self.queued + 1) / max(self.max_concurrent, 1)))
+
+    def _priority(self, priority):
+        return priority if priority in self.weights else PRIORITY_INTERACTIVE
+
+    def _can_start(self, priority):
+        if self.active >= self.max_concurrent:
+            return False
+        if priority == PRIORITY_BACKGROUND:
+            return self._classes[priority].active < self.background_max_active
+        return True
+
+    async def acquire(self, timeout=None, priority=PRIORITY_INTERACTIVE):
+        """获取一个名额；timeout 为本次最长排队时间 (不超过 queue_timeout)"""
+        timeout = self.queue_timeout if timeout is None else min(timeout, self.queue_timeout)
+        priority = self._priority(priority)
+        started = time.monotonic()
+        # 同类中已有人排队时不能插队；名额空出时 _dispatch 已经放行了所有能放行的等待者
+        if self._can_start(priority) and not self._waiters[priority]:
+            self.active += 1
+            self._classes[priority].active += 1
+            self._admit(priority, started)
+            return
+        queue_full = self.queued >= self.max_queue or (
+            priority == PRIORITY_BACKGROUND and len(self._waiters[priority]) >= self.background_max_queue
+        )
+        if queue_full:
+            self.rejected += 1
+            self._classes[priority].rejected += 1
+            raise UpstreamBusyError("AI 服务繁忙，请稍后重试", self.retry_after())
+
+        finish = max(self._virtual_time, self._last_finish[priority]) + 1.0 / self.weights[priority]
+        self._last_finish[priority] = finish
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[priority].append([finish, waiter])
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            self._abandon(waiter, priority)
+            raise UpstreamBusyError("等待 AI 服务超时，请稍后重试", self.retry_after())
+        except BaseException:
+            self._abandon(waiter, priority)
+            raise
+        self._admit(priority, started)
+
+    def _abandon(self, waiter, priority):
+        """等待者放弃排队；如果名额恰好已经转交给它，则归还名额"""
+        waiters = self._waiters[priority]
+        for entry in waiters:
+            if entry[1] is waiter:
+                waiters.remove(entry)
+                return
+        if waiter.done() and not waiter.cancelled():
+            self.release(priority=priority)
+
+    def _admit(self, priority, started):
+        waited = time.monotonic() - started
+        self.admitted += 1
+        self._classes[priority].admitted += 1
+        self._classes[priority].wait_samples.append(waited)
+        self._wait_samples.append(waited)
+
+    def release(self, held_seconds=None, priority=PRIORITY_INTERACTIVE):
+        if held_seconds is not None:
+            self._hold_samples.append(held_seconds)
+        priority = self._priority(priority)
+        self.active -= 1
+        self._classes[priority].active -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        """把空出的名额交给虚拟完成时间最小、且所在类允许启动的等待者"""
+        while self.active < self.max_concurrent:
+            best = None
+            for priority, waiters in self._waiters.items():
+                if waiters and self._can_start(priority) and (best is None or waiters[0][0] < best[1][0]):
+                    best = (priority, waiters[0])
+            if best is None:
+                return
+            priority, (finish, waiter) = best
+            self._waiters[priority].popleft()
+            self._virtual_time = finish
+            self.active += 1
+            self._classes[priority].active += 1
+            waiter.set_result(True)
+
+    @asynccontextmanager
+    async def slot(self, timeout=None, priority=PRIORITY_INTERACTIVE):
+        await self.acquire(timeout, priority)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started, priority)
+
+    def snapshot(self):
+        snapshot = {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "queue_depth": self.queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
+        snapshot.update(_wait_summary(self._wait_samples))
+        snapshot["classes"] = {
+            priority: dict(
+                weight=self.weights[priority],
+                active=stats.active,
+                queue_depth=len(self._waiters[priority]),
+                admitted=stats.admitted,
+                rejected=stats.rejected,
+                **_wait_summary(stats.wait_samples)
+            )
+            for priority, stats in self._classes.items()
+        }
+        return snapshot
+
+
+upstream_bulkhead = Bulkhead(LLM_MAX_CONCURRENCY, LLM_MAX_QUEUE, LLM_QUEUE_TIMEOUT)
@@ -0,0 +1,146 @@
+# backend/app/services/chat_job_service.py
+"""
+异步问答任务：接口只负责入队并立即返回 202，
+由后台 worker 调用 llm_service.get_ai_response 并通过 add_chat_message_to_consultation 写回。
+任务被取消后，正在执行它的 worker 会关闭上游会话并放弃结果。
+"""
+
+import time
+
+from flask import current_app
+
+from ..core.extensions import db
+from ..models.consultation_model import ChatJobModel
+from ..services import llm_service
+from .history_service import add_chat_message_to_consultation, after_turns_added
+from .appointment_service import has_urgent_appointment
+from .context_service import build_context
+from .bulkhead import UpstreamBusyError, PRIORITY_URGENT, PRIORITY_INTERACTIVE
+from .llm_runtime import RequestCancelled
+from .job_queue import (
+    JobWorkerPool, RetryJobLater, finish_claimed_job, cancel_job, job_status,
+    JOB_SUCCEEDED, JOB_FAILED, JOB_CANCELLED
+)
+
+# 执行中的任务多久检查一次是否已被取消(秒)
+CANCEL_CHECK_INTERVAL = 2.0
+
+_pool = None
+
+
+def chat_priority(patient_id):
+    """问答的调度优先级：有加急预约的患者优先 (查询失败时按普通问答处理)"""
+    try:
+        return PRIORITY_URGENT if has_urgent_appointment(patient_id) else PRIORITY_INTERACTIVE
+    except Exception as e:
+        print(f"chat_priority: failed to check urgent appointments for {patient_id}: {e}")
+        db.session.rollback()
+        return PRIORITY_INTERACTIVE
+
+
+def _cancel_checker(job_id, interval=CANCEL_CHECK_INTERVAL):
+    """返回供 get_ai_response 使用的取消回调 (限制查询数据库的频率)"""
+    last_checked = [0.0]
+
+    def cancelled():
+        now = time.monotonic()
+        if now - last_checked[0] < interval:
+            return False
+        last_checked[0] = now
+        return job_status(ChatJobModel, job_id) == JOB_CANCELLED
+
+    return cancelled
+
+
+def _run_chat_job(job):
+    """
+    worker 中执行单个问答任务。
+    上游调用的整体时限短于租约；写回时再以领取时的 attempts 确认任务仍属于本 worker，
+    避免租约过期后被另一个 worker 重新执行时写入两份问答。
+    """
+    job_id, attempts = job.id, job.attempts
+    patient_id, consultation_id, question = job.patient_id, job.consultation_id, job.question
+    use_cache = job.use_cache
+    priority = chat_priority(patient_id)
+    context = build_context(consultation_id)
+    # 结束读取事务，避免在长时间的 LLM 调用期间占用数据库连接
+    db.session.commit()
+
+    try:
+        ai_answer = llm_service.get_ai_response(
+            question, use_cache=use_cache, deadline_seconds=_get_pool().deadline_seconds,
+            cancelled=_cancel_checker(job_id), priority=priority, context=context
+        )
+    except UpstreamBusyError as e:
+        raise RetryJobLater(e.retry_after)
+    except RequestCancelled:
+        print(f"chat-job: job {job_id} cancelled, upstream session closed")
+        return
+
+    if job_status(ChatJobModel, job_id) == JOB_CANCELLED:
+        return
+    consultation = add_chat_message_to_consultation(patient_id, consultation_id, question, ai_answer, commit=False)
+    if consultation is None:
+        finish_claimed_job(ChatJobModel, job_id, attempts, JOB_FAILED, error='问诊记录不存在或无权访问')
+    elif finish_claimed_job(ChatJobModel, job_id, attempts, JOB_SUCCEEDED, answer=ai_answer):
+        after_turns_added(patient_id)
+    else:
+        print(f"chat-job: job {job_id} was cancelled or re-claimed by another worker, answer discarded")
+
+
+def _get_pool(app=None):
+    global _pool
+    if _pool is None:
+        config = (app or current_app).config
+        _pool = JobWorkerPool(
+            'chat-job',
+            ChatJobModel,
+            _run_chat_job,
+            workers=config.get('CHAT_JOB_WORKERS', 0),
+            lease_seconds=config.get('CHAT_JOB_LEASE_SECONDS', 300),
+            max_attempts=config.get('CHAT_JOB_MAX_ATTEMPTS', 3)
+        )
+    return _pool
+
+
+def start_chat_job_workers(app):
+    """启动本进程的问答任务 worker (幂等)"""
+    _get_pool(app).start(app)
+
+
+def enqueue_chat_job(user_id, consultation_id, question, use_cache=True):
+    """创建一个排队中的问答任务并唤醒 worker"""
+    job = ChatJobModel(
+        patient_id=user_id,
+        consultation_id=consultation_id,
+        question=question,
+        use_cache=use_cache,
+        status='queued'
+    )
+    db.session.add(job)
+    db.session.commit()
+    _get_pool().notify()
+    return job
+
+
+def get_chat_job(user_id, job_id):
+    """获取任务，同时验证任务是否属于该用户"""
+    return ChatJobModel.query.filter_by(id=job_id, patient_id=user_id).first()
+
+
+def cancel_chat_job(user_id, job_id):
+    """
+    取消用户的任务。返回 (job, cancelled)：任务不存在时 job 为 None，
+    任务已经结束时 cancelled 为 False。
+    """
+    job = get_chat_job(user_id, job_id)
+    if job is None:
+        return None, False
+    cancelled = cancel_job(ChatJobModel, job_id)
+    db.session.refresh(job)
+    return job, cancelled
+
+
+def process_next_chat_job():
+    """在当前线程中领取并执行一条任务 (测试或运维脚本使用)，返回是否执行了任务"""
+    return _get_pool().process_next()
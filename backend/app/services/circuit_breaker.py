@@ -0,0 +1,110 @@
+# backend/app/services/circuit_breaker.py
+"""
+FastAPI 上游的熔断器 (每个副本一个，见 upstream_pool)。
+
+closed     正常放行，连续失败达到阈值后进入 open
+open       直接拒绝 (CircuitOpenError，毫秒级返回)，recovery_seconds 之后进入 half_open
+half_open  只放行一个探测请求：成功则回到 closed，失败则重新 open
+"""
+
+import os
+import threading
+import time
+
+from .bulkhead import UpstreamBusyError
+
+# --- 配置 ---
+LLM_BREAKER_FAILURE_THRESHOLD = int(os.environ.get("LLM_BREAKER_FAILURE_THRESHOLD", "5"))
+LLM_BREAKER_RECOVERY_SECONDS = float(os.environ.get("LLM_BREAKER_RECOVERY_SECONDS", "30"))
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(UpstreamBusyError):
+    """上游被判定为不可用，请求未发出即被拒绝 (接口返回 503 + Retry-After)"""
+
+    status_code = 503
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold, recovery_seconds):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probe_started_at = None
+        # 统计
+        self.rejected = 0
+        self.opened_count = 0
+        self.last_failure = None
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.recovery_seconds:
+            self._state = HALF_OPEN
+            self._probe_started_at = None
+        return self._state
+
+    def _retry_after(self):
+        return max(1, int(self.recovery_seconds - (time.monotonic() - self._opened_at)) + 1)
+
+    def before_call(self):
+        """发起上游调用之前调用；熔断中时抛出 CircuitOpenError"""
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return
+            if state == HALF_OPEN:
+                # 同一时间只允许一个探测请求；探测请求超过 recovery_seconds 仍无结果时允许新的探测
+                now = time.monotonic()
+                if self._probe_started_at is None or now - self._probe_started_at >= self.recovery_seconds:
+                    self._probe_started_at = now
+                    print(f"--- circuit breaker '{self.name}': half-open probe ---")
+                    return
+            self.rejected += 1
+            raise CircuitOpenError("AI 服务暂时不可用，请稍后重试", self._retry_after())
+
+    def record_success(self):
+        with self._lock:
+            if self._state != CLOSED:
+                print(f"--- circuit breaker '{self.name}': closed ---")
+            self._state = CLOSED
+            self._consecutive_failures = 0
+            self._probe_started_at = None
+
+    def record_failure(self, error=None):
+        with self._lock:
+            self.last_failure = str(error) if error is not None else None
+            self._consecutive_failures += 1
+            state = self._current_state()
+            if state == HALF_OPEN or (state == CLOSED and self._consecutive_failures >= self.failure_threshold):
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+                self._probe_started_at = None
+                self.opened_count += 1
+                print(f"--- circuit breaker '{self.name}': opened after {self._consecutive_failures} failures ---")
+
+    def snapshot(self):
+        with self._lock:
+            state = self._current_state()
+            return {
+                "name": self.name,
+                "state": state,
+                "consecutive_failures": self._consecutive_failures,
+                "failure_threshold": self.failure_threshold,
+                "recovery_seconds": self.recovery_seconds,
+                "retry_after": self._retry_after() if state == OPEN else 0,
+                "opened_count": self.opened_count,
+                "rejected": self.rejected,
+                "last_failure": self.last_failure,
+            }
+
@@ -0,0 +1,166 @@
+# backend/app/services/context_service.py
+"""
+组装发给 AI 的对话上下文：滚动摘要 + 最近几轮原文，总量控制在固定的 token 预算内。
+
+每个 AIConsultationModel 保存一份滚动摘要 (context_summary) 和已并入摘要的最后一条消息 ID (summary_message_id)。
+每次构建上下文只读取 summary_message_id 之后的消息：最近 LLM_CONTEXT_RECENT_TURNS 轮保留原文，
+更早的轮次压缩成一行 "问：...；答：..." 追加到摘要末尾，摘要从不根据完整历史重新计算。
+摘要超过 LLM_CONTEXT_SUMMARY_TOKENS 时保留第一行 (主诉) 并丢弃最早的行，
+因此无论问诊持续多久，每次请求携带的上下文大小基本恒定。
+
+token 数按字符粗略估算：中日韩字符每字约 1 个 token，其他字符每 4 个约 1 个 token。
+"""
+
+import math
+import os
+import re
+
+from sqlalchemy import update
+
+from ..core.extensions import db
+from ..models.consultation_model import AIConsultationModel, ChatMessageModel
+from .history_service import WELCOME_QUESTION
+
+# --- 配置 ---
+# 上下文 (摘要 + 最近轮次) 的总 token 预算，0 表示不发送上下文
+LLM_CONTEXT_TOKEN_BUDGET = int(os.environ.get("LLM_CONTEXT_TOKEN_BUDGET", "1200"))
+LLM_CONTEXT_SUMMARY_TOKENS = int(os.environ.get("LLM_CONTEXT_SUMMARY_TOKENS", "400"))
+LLM_CONTEXT_RECENT_TURNS = int(os.environ.get("LLM_CONTEXT_RECENT_TURNS", "4"))
+# 摘要行中问题、回答各保留的字符数
+SUMMARY_QUESTION_CHARS = 60
+SUMMARY_ANSWER_CHARS = 80
+# 预算剩余不足这么多 token 时不再截断塞入更早的消息
+MIN_PARTIAL_TOKENS = 30
+
+_CJK = re.compile(r"[⺀-鿿가-힯豈-﫿＀-￯]")
+_SENTENCE_END = re.compile(r"(?<=[。！？!?；;\n])")
+
+
+def estimate_tokens(text) -> int:
+    if not text:
+        return 0
+    cjk = len(_CJK.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def _clip(text, max_chars):
+    text = " ".join((text or "").split())
+    return text if len(text) <= max_chars else text[:max_chars - 1] + "…"
+
+
+def _clip_tokens(text, max_tokens):
+    """从头截取不超过 max_tokens 的部分"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid]) + 1 <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low] + "…"
+
+
+def _first_sentence(text):
+    parts = [part.strip() for part in _SENTENCE_END.split(text or "") if part.strip()]
+    return parts[0] if parts else ""
+
+
+def pair_turns(messages):
+    """把按 id 排序的消息配对成 [(question, answer, 最后一条消息 id), ...]，跳过欢迎消息和未配对的消息"""
+    turns = []
+    pending = None
+    for message in messages:
+        if message.sender_type == 'user':
+            pending = message
+        elif pending is not None:
+            if pending.content != WELCOME_QUESTION:
+                turns.append((pending.content, message.content, message.id))
+            pending = None
+    return turns
+
+
+def summary_line(question, answer):
+    return f"问：{_clip(question, SUMMARY_QUESTION_CHARS)}；答：{_clip(_first_sentence(answer), SUMMARY_ANSWER_CHARS)}"
+
+
+def fold_into_summary(summary, turns, max_tokens=None):
+    """把新的轮次追加到已有摘要，超出预算时保留主诉行并丢弃最早的行"""
+    max_tokens = LLM_CONTEXT_SUMMARY_TOKENS if max_tokens is None else max_tokens
+    lines = summary.split("\n") if summary else []
+    for question, answer, _ in turns:
+        if not lines:
+            lines.append(f"主诉：{_clip(question, SUMMARY_QUESTION_CHARS)}")
+        lines.append(summary_line(question, answer))
+    while len(lines) > 2 and estimate_tokens("\n".join(lines)) > max_tokens:
+        del lines[1]
+    return _clip_tokens("\n".join(lines), max_tokens)
+
+
+def _advance_summary(consultation, turns):
+    """
+    把 turns 并入摘要并前移 summary_message_id (带条件更新，并发请求只有一个生效)。
+    使用独立的连接和事务提交，不会顺带提交调用方 session 中尚未提交的修改。
+    """
+    summary = fold_into_summary(consultation.context_summary, turns)
+    watermark = consultation.summary_message_id
+    with db.engine.begin() as conn:
+        result = conn.execute(
+            update(AIConsultationModel).where(
+                AIConsultationModel.id == consultation.id,
+                AIConsultationModel.summary_message_id.is_(None) if watermark is None
+                else AIConsultationModel.summary_message_id == watermark
+            ).values(context_summary=summary, summary_message_id=turns[-1][2])
+        )
+    # session 中的问诊对象已过期，下次访问时重新读取
+    db.session.expire(consultation, ["context_summary", "summary_message_id"])
+    if result.rowcount != 1:
+        print(f"context_service: summary of consultation {consultation.id} was advanced concurrently")
+    return summary
+
+
+def build_context(consultation_id, budget=None):
+    """
+    返回发给 AI 的上下文 {"summary": ..., "history": [{"role", "content"}, ...], "tokens": ...}；
+    问诊不存在、还没有真实对话或关闭了上下文时返回 None。
+    history 按时间顺序排列，从最新的轮次开始装入，直到用完预算。
+    """
+    budget = LLM_CONTEXT_TOKEN_BUDGET if budget is None else budget
+    if budget <= 0:
+        return None
+    consultation = db.session.get(AIConsultationModel, consultation_id)
+    if consultation is None:
+        return None
+
+    query = ChatMessageModel.query.filter(ChatMessageModel.consultation_id == consultation_id)
+    if consultation.summary_message_id is not None:
+        query = query.filter(ChatMessageModel.id > consultation.summary_message_id)
+    turns = pair_turns(query.order_by(ChatMessageModel.id).all())
+
+    summary = consultation.context_summary or ""
+    recent_turns = max(LLM_CONTEXT_RECENT_TURNS, 0)
+    older, recent = (turns[:-recent_turns], turns[-recent_turns:]) if recent_turns else (turns, [])
+    if older:
+        summary = _advance_summary(consultation, older)
+
+    summary = _clip_tokens(summary, min(LLM_CONTEXT_SUMMARY_TOKENS, budget))
+    remaining = budget - estimate_tokens(summary)
+    history = []
+    for question, answer, _ in reversed(recent):
+        turn = [{"role": "user", "content": question}, {"role": "assistant", "content": answer}]
+        cost = estimate_tokens(question) + estimate_tokens(answer)
+        if cost > remaining:
+            # 放不下整轮时截断回答，剩余预算太少则停止
+            if remaining - estimate_tokens(question) < MIN_PARTIAL_TOKENS:
+                break
+            turn[1]["content"] = _clip_tokens(answer, remaining - estimate_tokens(question))
+            cost = remaining
+        history[:0] = turn
+        remaining -= cost
+        if remaining <= 0:
+            break
+
+    if not summary and not history:
+        return None
+    return {"summary": summary, "history": history, "tokens": budget - remaining}
@@ -0,0 +1,472 @@
+# backend/app/services/faq_index.py
+"""
+本地 FAQ 检索索引：与已有问题足够相似时直接返回已有回答，不再调用上游；上游熔断时作为兜底。
+
+语料 = 人工整理的 FAQ (app/data/faq_corpus.json) + 从 chat_messages 中挖掘的高可信问答
+(所在问诊已被医生审核确认 (is_approved)，回答发送于审核之前，且不是错误提示、超时或部分回答)。
+同一个 AI 问诊会在审核后继续追加问答，审核之后的回答医生没有看过，不会进入索引。
+
+向量化：对归一化后的问题 (见 answer_cache.normalize_question) 取 1~3 字的字符 n-gram，
+哈希到 2^FAQ_HASH_BITS 维，按 (1 + log tf) * idf 加权并做 L2 归一化，相似度为余弦相似度。
+索引以倒排表的形式保存为 .npy 文件 (ptr / doc / weight / idf)，加载时用 np.load(mmap_mode='r') 映射，
+多个 gunicorn worker 共享同一份页缓存；查询只读取问题中出现的 n-gram 对应的倒排段。
+
+增量更新：以审核时间为水位 (reviewed_until)，后台线程每 FAQ_INDEX_REFRESH_SECONDS 秒读取水位之后新完成的审核，
+把这些问诊中审核前的高可信问答按当前的 idf 加入内存中的增量段 (因此先有问答、后被审核的问诊也会被收录)；增量超过 FAQ_REBUILD_DELTA 条时全量重建，并原子替换磁盘上的索引
+(先写新版本的文件，再替换 manifest.json)。其他 worker 在下一次刷新时发现 manifest 更新后重新映射。
+"""
+
+import json
+import math
+import os
+import threading
+import time
+import zlib
+from collections import deque
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.orm import aliased
+
+from ..core.extensions import db
+from ..models.consultation_model import ChatMessageModel
+from ..models.review_model import DoctorReviewModel
+from .answer_cache import normalize_question
+from .history_service import WELCOME_QUESTION
+from .llm_service import DEFAULT_ANSWER, TIMEOUT_ANSWER, is_partial_answer
+
+# --- 配置 ---
+_BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+FAQ_CORPUS_PATH = os.environ.get("FAQ_CORPUS_PATH", os.path.join(_BACKEND_DIR, "app", "data", "faq_corpus.json"))
+FAQ_INDEX_DIR = os.environ.get("FAQ_INDEX_DIR", os.path.join(_BACKEND_DIR, "instance", "faq_index"))
+FAQ_HASH_BITS = int(os.environ.get("FAQ_HASH_BITS", "18"))
+# 直接返回 FAQ 回答所需的相似度；上游熔断时兜底可接受的最低相似度。
+# 字符 n-gram 相似度分不清只差几个字的不同问题 (如 "高血压患者平时需要吃什么药" 与 "…需要注意什么" 约 0.70，
+# "孕妇感冒发烧怎么办" 与 "感冒发烧怎么办" 约 0.76)，兜底也只接受接近原问题的改写
+FAQ_MATCH_THRESHOLD = float(os.environ.get("FAQ_MATCH_THRESHOLD", "0.85"))
+FAQ_FALLBACK_THRESHOLD = float(os.environ.get("FAQ_FALLBACK_THRESHOLD", "0.8"))
+FAQ_REBUILD_DELTA = int(os.environ.get("FAQ_REBUILD_DELTA", "200"))
+
+NGRAM_SIZES = (1, 2, 3)
+ARRAY_NAMES = ("ptr", "doc", "weight", "idf")
+MANIFEST_NAME = "manifest.json"
+# 旧版本的索引文件保留一段时间，其他 worker 可能仍在映射它们
+STALE_VERSION_SECONDS = 600
+# 水位只推进到这么多秒之前：审核时间在写入时生成，提交可能稍晚，留出余量避免漏掉
+REVIEW_SETTLE_SECONDS = 60
+MIN_ANSWER_LENGTH = 20
+# llm_service 在出错时返回的提示，不能作为 FAQ 回答
+_ERROR_PREFIXES = (
+    "调用 AI 服务时发生错误", "无法连接到 AI 服务", "无法建立与 AI 服务", "与 AI 服务连接中断",
+    "AI 服务返回数据错误", "配置的 AI 服务地址无效", "处理 AI 消息时出错", "发生意外错误",
+)
+
+SOURCE_CURATED = 'curated'
+SOURCE_MINED = 'mined'
+
+
+def _features(text, dims):
+    """返回问题的 (n-gram 哈希桶, 词频)，桶号升序且不重复"""
+    normalized = normalize_question(text)
+    grams = [normalized[i:i + n] for n in NGRAM_SIZES for i in range(len(normalized) - n + 1)]
+    if not grams:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    buckets = np.fromiter((zlib.crc32(gram.encode("utf-8")) for gram in grams), dtype=np.int64, count=len(grams))
+    return np.unique(buckets & (dims - 1), return_counts=True)
+
+
+def _weigh(buckets, counts, idf):
+    weights = (1.0 + np.log(counts)) * idf[buckets]
+    norm = np.linalg.norm(weights)
+    return (weights / norm if norm > 0 else weights).astype(np.float32)
+
+
+def build_arrays(questions, dims):
+    """为一组问题构建倒排表，返回 {ptr, doc, weight, idf}"""
+    features = [_features(question, dims) for question in questions]
+    all_buckets = np.concatenate([buckets for buckets, _ in features] or [np.empty(0, dtype=np.int64)])
+    # 每篇文档内桶号不重复，因此 bincount 即文档频率
+    df = np.bincount(all_buckets, minlength=dims)
+    idf = (np.log((1.0 + len(questions)) / (1.0 + df)) + 1.0).astype(np.float32)
+
+    doc = np.concatenate(
+        [np.full(len(buckets), i, dtype=np.int32) for i, (buckets, _) in enumerate(features)]
+        or [np.empty(0, dtype=np.int32)]
+    )
+    weight = np.concatenate(
+        [_weigh(buckets, counts, idf) for buckets, counts in features] or [np.empty(0, dtype=np.float32)]
+    )
+    order = np.argsort(all_buckets, kind="stable")
+    ptr = np.zeros(dims + 1, dtype=np.int64)
+    np.cumsum(df, out=ptr[1:])
+    return {"ptr": ptr, "doc": doc[order], "weight": weight[order], "idf": idf}
+
+
+def is_confident_answer(question, answer):
+    """过滤掉错误提示、超时、部分回答和带附件的问题"""
+    if not question or not answer or len(answer) < MIN_ANSWER_LENGTH:
+        return False
+    if answer in (DEFAULT_ANSWER, TIMEOUT_ANSWER) or is_partial_answer(answer):
+        return False
+    if answer.startswith(_ERROR_PREFIXES) or "附件文件 (Accessible URLs)" in question:
+        return False
+    return True
+
+
+def mine_qa_pairs(reviewed_after=None, reviewed_until=None):
+    """
+    从 chat_messages 中挖掘高可信问答：所在问诊的审核结果为确认，审核时间在 (reviewed_after, reviewed_until] 之间，
+    且 AI 回答发送于审核之前。每条 AI 回答与同一问诊中紧邻其前的用户消息配对，返回 [(question, answer), ...] (按 id 升序)。
+    只收录问诊中的第一个真实问题：之后的回答是带着该病人的问诊上下文生成的，不能提供给其他病人。
+    """
+    user_message = aliased(ChatMessageModel)
+    ai_message = aliased(ChatMessageModel)
+    previous_user_id = select(func.max(user_message.id)).where(
+        user_message.consultation_id == ai_message.consultation_id,
+        user_message.sender_type == 'user',
+        user_message.id < ai_message.id
+    ).correlate(ai_message).scalar_subquery()
+
+    question_message = aliased(ChatMessageModel)
+    earlier_message = aliased(ChatMessageModel)
+    earlier_question = select(earlier_message.id).where(
+        earlier_message.consultation_id == question_message.consultation_id,
+        earlier_message.sender_type == 'user',
+        earlier_message.content != WELCOME_QUESTION,
+        earlier_message.id < question_message.id
+    ).correlate(question_message).exists()
+    query = (
+        select(question_message.content, ai_message.content)
+        .join(question_message, question_message.id == previous_user_id)
+        .join(DoctorReviewModel, DoctorReviewModel.consultation_id == ai_message.consultation_id)
+        .where(
+            ai_message.sender_type == 'ai',
+            ai_message.timestamp <= DoctorReviewModel.reviewed_at,
+            DoctorReviewModel.is_approved.is_(True),
+            question_message.content != WELCOME_QUESTION,
+            ~earlier_question
+        )
+        .order_by(ai_message.id)
+    )
+    if reviewed_after is not None:
+        query = query.where(DoctorReviewModel.reviewed_at > reviewed_after)
+    if reviewed_until is not None:
+        query = query.where(DoctorReviewModel.reviewed_at <= reviewed_until)
+    return [(q, a) for q, a in db.session.execute(query).all() if is_confident_answer(q, a)]
+
+
+def _review_watermark():
+    """本次可以收录的审核时间上限"""
+    return datetime.utcnow() - timedelta(seconds=REVIEW_SETTLE_SECONDS)
+
+
+class FaqMatch:
+    def __init__(self, question, answer, source, score):
+        self.question = question
+        self.answer = answer
+        self.source = source
+        self.score = score
+
+
+class _Snapshot:
+    """一份不可变的索引：磁盘上的基础段 (mmap) + 内存中的增量段；更新时整体替换"""
+
+    def __init__(self, version, arrays, entries, reviewed_until, delta=None, delta_entries=()):
+        self.version = version
+        self.ptr, self.doc, self.weight, self.idf = (arrays[name] for name in ARRAY_NAMES)
+        self.dims = len(self.idf)
+        self.entries = entries
+        self.reviewed_until = reviewed_until
+        # 增量段：(桶号, 文档序号, 权重)，使用基础段的 idf
+        self.delta = delta or (np.empty(0, np.int64), np.empty(0, np.int32), np.empty(0, np.float32))
+        self.delta_entries = list(delta_entries)
+
+    def with_pairs(self, pairs, reviewed_until):
+        buckets, docs, weights = [self.delta[0]], [self.delta[1]], [self.delta[2]]
+        for offset, (question, _) in enumerate(pairs, start=len(self.delta_entries)):
+            q_buckets, q_counts = _features(question, self.dims)
+            buckets.append(q_buckets)
+            docs.append(np.full(len(q_buckets), offset, dtype=np.int32))
+            weights.append(_weigh(q_buckets, q_counts, self.idf))
+        delta = (np.concatenate(buckets), np.concatenate(docs), np.concatenate(weights))
+        delta_entries = self.delta_entries + [(q, a, SOURCE_MINED) for q, a in pairs]
+        return _Snapshot(
+            self.version, dict(zip(ARRAY_NAMES, (self.ptr, self.doc, self.weight, self.idf))),
+            self.entries, reviewed_until, delta, delta_entries
+        )
+
+    def search(self, question):
+        """返回 (条目, 相似度)；索引为空或问题没有可用字符时返回 (None, 0.0)"""
+        buckets, counts = _features(question, self.dims)
+        total_docs = len(self.entries) + len(self.delta_entries)
+        if not len(buckets) or not total_docs:
+            return None, 0.0
+        query = _weigh(buckets, counts, self.idf)
+
+        # 基础段：把各 n-gram 的倒排段拼成一次向量化累加
+        starts = np.asarray(self.ptr[buckets])
+        lengths = np.asarray(self.ptr[buckets + 1]) - starts
+        total = int(lengths.sum())
+        positions = np.arange(total) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        base_scores = np.bincount(
+            self.doc[positions], weights=self.weight[positions] * np.repeat(query, lengths),
+            minlength=len(self.entries)
+        )
+
+        # 增量段：规模很小 (最多 FAQ_REBUILD_DELTA 条)，直接按桶号匹配
+        delta_buckets, delta_docs, delta_weights = self.delta
+        mask = np.isin(delta_buckets, buckets)
+        delta_scores = np.bincount(
+            delta_docs[mask],
+            weights=delta_weights[mask] * query[np.searchsorted(buckets, delta_buckets[mask])],
+            minlength=len(self.delta_entries)
+        )
+
+        scores = np.concatenate([base_scores, delta_scores])
+        best = int(np.argmax(scores))
+        entries = self.entries if best < len(self.entries) else self.delta_entries
+        return entries[best if best < len(self.entries) else best - len(self.entries)], float(scores[best])
+
+
+class FaqIndex:
+    def __init__(self, index_dir, corpus_path, hash_bits=FAQ_HASH_BITS, rebuild_delta=FAQ_REBUILD_DELTA):
+        self.index_dir = index_dir
+        self.corpus_path = corpus_path
+        self.dims = 1 << hash_bits
+        self.rebuild_delta = rebuild_delta
+        self._snapshot = None
+        # 串行化本进程内的 refresh / rebuild
+        self._lock = threading.Lock()
+        self._thread = None
+        self._owner_pid = None
+        # 统计
+        self.hits = 0
+        self.fallback_hits = 0
+        self.misses = 0
+        self.rebuilds = 0
+        self._latency_samples = deque(maxlen=1000)
+
+    @property
+    def loaded(self):
+        return self._snapshot is not None
+
+    def _manifest_path(self):
+        return os.path.join(self.index_dir, MANIFEST_NAME)
+
+    def _read_manifest(self):
+        try:
+            with open(self._manifest_path(), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def load(self):
+        """映射磁盘上的最新索引，返回是否加载成功 (已是最新版本时不重复加载)"""
+        manifest = self._read_manifest()
+        if manifest is None:
+            return False
+        if self._snapshot is not None and self._snapshot.version == manifest["version"]:
+            return True
+        version = manifest["version"]
+        arrays = {}
+        for name in ARRAY_NAMES:
+            path = os.path.join(self.index_dir, f"{version}.{name}.npy")
+            try:
+                arrays[name] = np.load(path, mmap_mode="r")
+            except ValueError:
+                # 空数组无法 mmap (语料为空时)
+                arrays[name] = np.load(path)
+        with open(os.path.join(self.index_dir, f"{version}.entries.json"), encoding="utf-8") as f:
+            entries = [tuple(entry) for entry in json.load(f)]
+        # 旧格式的 manifest 没有审核水位 (None)，下一次 refresh 会全量重建
+        reviewed_until = manifest.get("reviewed_until")
+        reviewed_until = datetime.fromisoformat(reviewed_until) if reviewed_until else None
+        self._snapshot = _Snapshot(version, arrays, entries, reviewed_until)
+        print(f"--- faq_index: loaded version {version} ({len(entries)} entries) ---")
+        return True
+
+    def _load_corpus(self):
+        try:
+            with open(self.corpus_path, encoding="utf-8") as f:
+                return [(item["question"], item["answer"], SOURCE_CURATED) for item in json.load(f)]
+        except FileNotFoundError:
+            print(f"faq_index: corpus {self.corpus_path} not found, using mined Q/A only")
+            return []
+
+    def rebuild(self):
+        """全量重建：人工整理的 FAQ + 全部高可信问答 (需要在 app_context 中调用)"""
+        with self._lock:
+            self._rebuild()
+
+    def _rebuild(self):
+        started = time.monotonic()
+        reviewed_until = _review_watermark()
+        entries, seen = [], {}
+        for question, answer, source in self._load_corpus() + [
+            (q, a, SOURCE_MINED) for q, a in mine_qa_pairs(reviewed_until=reviewed_until)
+        ]:
+            key = normalize_question(question)
+            if key in seen:
+                # 人工整理的条目优先；同一问题的挖掘结果以最新的回答为准
+                if entries[seen[key]][2] == SOURCE_MINED:
+                    entries[seen[key]] = (question, answer, source)
+                continue
+            seen[key] = len(entries)
+            entries.append((question, answer, source))
+
+        arrays = build_arrays([question for question, _, _ in entries], self.dims)
+        self._save(arrays, entries, reviewed_until)
+        self.rebuilds += 1
+        self.load()
+        print(f"--- faq_index: rebuilt {len(entries)} entries in {time.monotonic() - started:.2f}s ---")
+
+    def _save(self, arrays, entries, reviewed_until):
+        os.makedirs(self.index_dir, exist_ok=True)
+        version = f"{int(time.time() * 1000)}-{os.getpid()}"
+        for name, array in arrays.items():
+            np.save(os.path.join(self.index_dir, f"{version}.{name}.npy"), array)
+        with open(os.path.join(self.index_dir, f"{version}.entries.json"), "w", encoding="utf-8") as f:
+            json.dump(entries, f, ensure_ascii=False)
+        manifest = {
+            "version": version,
+            "dims": self.dims,
+            "entries": len(entries),
+            "reviewed_until": reviewed_until.isoformat(),
+            "built_at": time.time(),
+        }
+        tmp_path = f"{self._manifest_path()}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self._manifest_path())
+        self._remove_stale_versions(version)
+
+    def _remove_stale_versions(self, current):
+        now = time.time()
+        for name in os.listdir(self.index_dir):
+            path = os.path.join(self.index_dir, name)
+            if name == MANIFEST_NAME or name.startswith(f"{current}."):
+                continue
+            try:
+                if now - os.path.getmtime(path) > STALE_VERSION_SECONDS:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def refresh(self):
+        """加入新的高可信问答 (需要在 app_context 中调用)；没有索引或增量过多时全量重建"""
+        with self._lock:
+            # 其他 worker 已经重建过时先切换到新版本
+            self.load()
+            if self._snapshot is None or self._snapshot.reviewed_until is None:
+                self._rebuild()
+                return
+            snapshot = self._snapshot
+            reviewed_until = _review_watermark()
+            if reviewed_until <= snapshot.reviewed_until:
+                return
+            pairs = mine_qa_pairs(reviewed_after=snapshot.reviewed_until, reviewed_until=reviewed_until)
+            if len(snapshot.delta_entries) + len(pairs) >= self.rebuild_delta:
+                self._rebuild()
+            else:
+                self._snapshot = snapshot.with_pairs(pairs, reviewed_until)
+
+    def search(self, question):
+        """返回最相似的 FaqMatch (不论相似度高低)；索引未加载时返回 None"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return None
+        entry, score = snapshot.search(question)
+        if entry is None:
+            return None
+        return FaqMatch(entry[0], entry[1], entry[2], score)
+
+    def lookup(self, question, threshold=None, fallback=False):
+        """相似度达到阈值时返回 FaqMatch，否则返回 None；fallback 表示上游不可用时的兜底查询"""
+        if threshold is None:
+            threshold = FAQ_FALLBACK_THRESHOLD if fallback else FAQ_MATCH_THRESHOLD
+        started = time.perf_counter()
+        match = self.search(question)
+        self._latency_samples.append(time.perf_counter() - started)
+        if match is None or match.score < threshold:
+            self.misses += 1
+            return None
+        if fallback:
+            self.fallback_hits += 1
+        else:
+            self.hits += 1
+        return match
+
+    def start_refresher(self, app, interval):
+        """加载索引并启动后台刷新线程 (同一进程内只启动一次，fork 之后会在子进程中重新启动)"""
+        if interval <= 0:
+            return
+        with self._lock:
+            if self._owner_pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._owner_pid = os.getpid()
+            try:
+                self.load()
+            except Exception as e:
+                print(f"faq_index: failed to load index from {self.index_dir}: {e}")
+            self._thread = threading.Thread(
+                target=self._run, args=(app, interval), name="faq-index-refresh", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self, app, interval):
+        while True:
+            with app.app_context():
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f"faq_index: refresh failed: {e}")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+            time.sleep(interval)
+
+    def snapshot(self):
+        snapshot = self._snapshot
+        samples = sorted(self._latency_samples)
+        p95 = samples[math.ceil(len(samples) * 0.95) - 1] if samples else 0.0
+        return {
+            "loaded": snapshot is not None,
+            "version": snapshot.version if snapshot else None,
+            "entries": len(snapshot.entries) if snapshot else 0,
+            "delta_entries": len(snapshot.delta_entries) if snapshot else 0,
+            "reviewed_until": snapshot.reviewed_until.isoformat() if snapshot and snapshot.reviewed_until else None,
+            "hits": self.hits,
+            "fallback_hits": self.fallback_hits,
+            "misses": self.misses,
+            "rebuilds": self.rebuilds,
+            "lookup_ms_avg": round(sum(samples) / len(samples) * 1000, 3) if samples else 0.0,
+            "lookup_ms_p95": round(p95 * 1000, 3),
+        }
+
+
+_index = FaqIndex(FAQ_INDEX_DIR, FAQ_CORPUS_PATH)
+
+
+def configure_index(index_dir=None, corpus_path=None, **kwargs):
+    """(重新)创建进程内的 FAQ 索引对象 (测试或切换目录时使用)"""
+    global _index
+    _index = FaqIndex(index_dir or FAQ_INDEX_DIR, corpus_path or FAQ_CORPUS_PATH, **kwargs)
+    return _index
+
+
+def get_index():
+    return _index
+
+
+def lookup(question, threshold=None, fallback=False):
+    return _index.lookup(question, threshold, fallback)
+
+
+def start_refresher(app, interval):
+    _index.start_refresher(app, interval)
+
+
+def faq_stats():
+    """供监控接口使用的 FAQ 索引统计"""
+    return _index.snapshot()
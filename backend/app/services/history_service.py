@@ -3,28 +3,115 @@ from ..models.consultation_model import AIConsultationModel, DoctorConsultationM
 from ..core.extensions import db
 from ..models.medical_record_model import MedicalRecordModel
 from ..services import llm_service
+from ..services.bulkhead import UpstreamBusyError
 from ..models.user_model import UserModel
 import json
+import base64
+import hashlib
 from datetime import datetime
-def get_recent_consultation(user_id):
-    recent_record_ai=AIConsultationModel.query.filter_by(patient_id=user_id).order_by(AIConsultationModel.created_at.desc()).first()
-    recent_record_doctor =DoctorConsultationModel.query.filter_by(patient_id=user_id).order_by(DoctorConsultationModel.created_at.desc()).first()
-    if recent_record_ai and recent_record_doctor:
-        if recent_record_ai.created_at > recent_record_doctor.created_at:
-            return recent_record_ai
+
+# 新建主问诊时写入的"欢迎消息"问答对 (不属于真实对话，构建上下文时会跳过)
+WELCOME_QUESTION = "开始新的问诊"
+WELCOME_ANSWER = "您好！我是AI问诊助手，很高兴为您服务。请描述您的症状..."
+# 聊天记录分页时每页最多的问答数
+CHAT_HISTORY_MAX_PAGE_SIZE = 100
+# 问诊时间线每页最多返回的问诊数
+CONSULTATION_TIMELINE_MAX_PAGE_SIZE = 100
+
+def _timeline_branch(kind, model, occurred_at, user_id, limit, before, until=None):
+    """
+    时间线中一类问诊的子查询：(kind, id, occurred_at)，按时间倒序。
+    分页时每个分支各自带上键集条件和 LIMIT，以便分别走 (patient_id, 时间) 索引。
+    """
+    query = db.select(
+        db.literal(kind).label("kind"), model.id.label("id"), occurred_at.label("occurred_at")
+    ).where(model.patient_id == user_id)
+    if until is not None:
+        query = query.where(occurred_at <= until)
+    if before is not None:
+        before_at, before_kind, before_id = before
+        # 排序为 (occurred_at, kind, id) 倒序，kind 在分支内是常量，因此可以化简为单列条件
+        if kind < before_kind:
+            query = query.where(occurred_at <= before_at)
+        elif kind == before_kind:
+            query = query.where(db.or_(occurred_at < before_at, db.and_(occurred_at == before_at, model.id < before_id)))
         else:
-            return recent_record_doctor
-    elif recent_record_ai:
-        return recent_record_ai
-    elif recent_record_doctor:
-        return recent_record_doctor
-    else:
-        return None
-    
-def get_all_consulations(user_id):
-    ai_records=AIConsultationModel.query.filter_by(patient_id=user_id).all()
-    doctor_records=DoctorConsultationModel.query.filter_by(patient_id=user_id).all()
-    return ai_records,doctor_records
+            query = query.where(occurred_at < before_at)
+    if limit is not None:
+        query = query.order_by(occurred_at.desc(), model.id.desc()).limit(limit)
+    # SQLite 不允许 UNION 的成员直接带 ORDER BY / LIMIT，包一层子查询
+    return db.select(query.subquery())
+
+
+def get_consultation_timeline(user_id, limit=None, before=None, until=None):
+    """
+    AI 问诊与医生问诊合并后的时间线，在数据库中用 UNION ALL 合并并按真实时间倒序排列
+    (AI 问诊按 created_at，医生问诊按 appointment_time，与列表中展示的日期一致)。
+    返回 ([(kind, 问诊对象), ...], next_cursor)；limit 为 None 时返回全部，
+    否则返回一页，next_cursor 传给 before 获取更早的一页，没有更多时为 None。
+    传入 until 时只包含该时间及之前的问诊 (排除尚未到来的预约)。
+    """
+    if limit is not None:
+        limit = max(1, min(limit, CONSULTATION_TIMELINE_MAX_PAGE_SIZE))
+    position = decode_timeline_cursor(before) if before is not None else None
+    fetch = limit + 1 if limit is not None else None
+    timeline = db.union_all(
+        _timeline_branch('ai', AIConsultationModel, AIConsultationModel.created_at, user_id, fetch, position, until),
+        _timeline_branch('doctor', DoctorConsultationModel, DoctorConsultationModel.appointment_time, user_id, fetch, position, until),
+    ).subquery()
+    query = db.select(timeline.c.kind, timeline.c.id, timeline.c.occurred_at).order_by(
+        timeline.c.occurred_at.desc(), timeline.c.kind.desc(), timeline.c.id.desc()
+    )
+    if fetch is not None:
+        query = query.limit(fetch)
+    rows = db.session.execute(query).all()
+    has_more = limit is not None and len(rows) > limit
+    if has_more:
+        rows = rows[:limit]
+
+    # 按 ID 批量加载这一页的问诊对象 (医生问诊一并加载医生信息)
+    ai_ids = [row.id for row in rows if row.kind == 'ai']
+    doctor_ids = [row.id for row in rows if row.kind == 'doctor']
+    records = {}
+    if ai_ids:
+        records.update({('ai', r.id): r for r in AIConsultationModel.query.filter(AIConsultationModel.id.in_(ai_ids))})
+    if doctor_ids:
+        records.update({('doctor', r.id): r for r in DoctorConsultationModel.query.options(
+            db.joinedload(DoctorConsultationModel.doctor)
+        ).filter(DoctorConsultationModel.id.in_(doctor_ids))})
+    entries = [(row.kind, records[(row.kind, row.id)]) for row in rows]
+    next_cursor = encode_timeline_cursor(rows[-1]) if has_more else None
+    return entries, next_cursor
+
+
+def encode_timeline_cursor(row):
+    raw = f"{row.occurred_at.isoformat()}|{row.kind}|{row.id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_timeline_cursor(cursor):
+    """解析时间线分页游标，格式不正确时抛出 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        occurred_at, kind, record_id = raw.split("|")
+        if kind not in ('ai', 'doctor'):
+            raise ValueError(kind)
+        return datetime.fromisoformat(occurred_at), kind, int(record_id)
+    except Exception:
+        raise ValueError(f"invalid timeline cursor: {cursor}")
+
+
+def get_recent_consultation(user_id):
+    """
+    最近的一次问诊 (AI 或医生)，即时间线中不晚于当前时间的第一条；没有问诊时返回 None。
+    预约在将来的医生问诊还没有发生，不能排在刚结束的问诊前面。
+    """
+    entries, _ = get_consultation_timeline(user_id, limit=1, until=datetime.utcnow())
+    return entries[0][1] if entries else None
+
+def get_latest_ai_consultation(user_id):
+    """用户最新的AI问诊记录 (不存在时返回 None，不会创建)"""
+    return AIConsultationModel.query.filter_by(patient_id=user_id).order_by(AIConsultationModel.created_at.desc()).first()
 
 def find_or_create_main_ai_consultation(user_id):
     """
@@ -32,7 +119,7 @@ def find_or_create_main_ai_consultation(user_id):
     返回主问诊记录对象。
     """
     # 1. 尝试根据 patient_id 查找已存在的AI问诊记录
-    main_consultation = AIConsultationModel.query.filter_by(patient_id=user_id).order_by(AIConsultationModel.created_at.desc()).first()
+    main_consultation = get_latest_ai_consultation(user_id)
     
     # 2. 如果找到了，直接返回
     if main_consultation:
@@ -41,29 +128,29 @@ def find_or_create_main_ai_consultation(user_id):
     # 3. 如果没找到，为该用户创建一个全新的主问诊记录
     else:
         # 准备一条初始的、虚拟的问答对，作为“欢迎消息”
-        initial_question = "开始新的问诊"
-        initial_answer = "您好！我是AI问诊助手，很高兴为您服务。请描述您的症状..."
+        initial_question = WELCOME_QUESTION
+        initial_answer = WELCOME_ANSWER
 
         # 调用您指定的、更完整的创建函数
         new_consultation = create_ai_consultation_record(user_id, initial_question, initial_answer)
         
         return new_consultation
 
-def get_chat_history(user_id):
-    """
-    获取指定用户所有AI问诊的聊天记录，并按文档要求配对成问答形式。
-    不同会话之间会用一个特殊标记隔开。
-    """
-    # 1. 关联查询，获取该用户所有的聊天记录
-    messages = db.session.query(ChatMessageModel).join(
+def _patient_chat_messages_query(user_id):
+    return db.session.query(ChatMessageModel).join(
         AIConsultationModel, AIConsultationModel.id == ChatMessageModel.consultation_id
     ).filter(
         AIConsultationModel.patient_id == user_id
-    ).order_by(ChatMessageModel.timestamp).all() # 按时间排序
+    )
+
 
+def _pair_chat_messages(messages, last_consultation_id=None):
+    """
+    把按时间排序的消息配对成问答形式，不同会话之间插入分隔标记。
+    last_consultation_id 为这批消息之前紧邻的那条消息所属的会话 (分页时用于在页首补上分隔标记)。
+    """
     chat_pairs = []
     i = 0
-    last_consultation_id = None
 
     # 2. 遍历所有消息
     while i < len(messages):
@@ -96,6 +183,107 @@ def get_chat_history(user_id):
         
     return chat_pairs
 
+
+def get_chat_history(user_id):
+    """
+    获取指定用户所有AI问诊的聊天记录，并按文档要求配对成问答形式。
+    不同会话之间会用一个特殊标记隔开。
+    """
+    # 1. 关联查询，获取该用户所有的聊天记录
+    messages = _patient_chat_messages_query(user_id).order_by(
+        ChatMessageModel.timestamp, ChatMessageModel.id
+    ).all() # 按时间排序
+
+    return _pair_chat_messages(messages)
+
+
+def latest_chat_message_id(user_id):
+    """用户最新一条聊天消息的 ID (没有消息时为 0)，作为增量同步的游标"""
+    return _patient_chat_messages_query(user_id).with_entities(db.func.max(ChatMessageModel.id)).scalar() or 0
+
+
+def get_chat_history_delta(user_id, since):
+    """
+    增量同步：返回 ID 大于 since 的新消息配对成的问答 (以及必要的会话分隔标记) 和新的同步游标。
+    问答两条消息总是在同一个事务中写入，因此新消息不会以上一次同步时缺失的回答开头。
+    """
+    query = _patient_chat_messages_query(user_id)
+    messages = query.filter(ChatMessageModel.id > since).order_by(
+        ChatMessageModel.timestamp, ChatMessageModel.id
+    ).all()
+    if not messages:
+        return [], since
+    previous = query.filter(ChatMessageModel.id <= since).order_by(ChatMessageModel.id.desc()).first()
+    chat_pairs = _pair_chat_messages(messages, previous.consultation_id if previous else None)
+    return chat_pairs, max(message.id for message in messages)
+
+
+def encode_history_cursor(message):
+    """分页游标：页中最早一条用户提问的 (timestamp, id)"""
+    raw = f"{message.timestamp.isoformat()}|{message.id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_history_cursor(cursor):
+    """解析分页游标，格式不正确时抛出 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        timestamp, message_id = raw.split("|")
+        return datetime.fromisoformat(timestamp), int(message_id)
+    except Exception:
+        raise ValueError(f"invalid history cursor: {cursor}")
+
+
+def get_chat_history_page(user_id, limit, before=None):
+    """
+    按 (timestamp, id) 键集分页获取聊天记录，从最新的一页开始。
+    每页包含最多 limit 个问答 (页内按时间正序，与 get_chat_history 相同)，返回 (chat_pairs, next_cursor)；
+    next_cursor 传给 before 获取更早的一页，没有更早的问答时为 None。
+    分页边界总是落在用户提问之前，问答对不会被拆开；
+    页中最早的消息与更早一条消息属于不同会话时，在页首补上分隔标记，因此把各页依次拼接与完整历史一致。
+    """
+    limit = max(1, min(limit, CHAT_HISTORY_MAX_PAGE_SIZE))
+    chunk_size = 2 * limit + 1
+    position = decode_history_cursor(before) if before is not None else None
+
+    # 1. 从新到旧读取消息，直到多读到一条用户提问 (说明还有更早的一页) 或没有更多消息
+    newest_first = []
+    questions = 0
+    while True:
+        query = _patient_chat_messages_query(user_id)
+        if position is not None:
+            timestamp, message_id = position
+            query = query.filter(db.or_(
+                ChatMessageModel.timestamp < timestamp,
+                db.and_(ChatMessageModel.timestamp == timestamp, ChatMessageModel.id < message_id)
+            ))
+        chunk = query.order_by(
+            ChatMessageModel.timestamp.desc(), ChatMessageModel.id.desc()
+        ).limit(chunk_size).all()
+        if chunk:
+            position = (chunk[-1].timestamp, chunk[-1].id)
+        newest_first.extend(chunk)
+        questions += sum(1 for message in chunk if message.sender_type == 'user')
+        if questions > limit or len(chunk) < chunk_size:
+            break
+
+    # 2. 在第 limit 条用户提问处截断
+    cut = len(newest_first)
+    seen = 0
+    for index, message in enumerate(newest_first):
+        if message.sender_type == 'user':
+            seen += 1
+            if seen == limit:
+                cut = index + 1
+                break
+    has_more = questions > limit
+    page = newest_first[:cut] if has_more else newest_first
+    older = newest_first[cut] if has_more else None
+
+    chat_pairs = _pair_chat_messages(list(reversed(page)), older.consultation_id if older else None)
+    next_cursor = encode_history_cursor(page[-1]) if has_more else None
+    return chat_pairs, next_cursor
+
 #1.用户首次使用或无记录时被调用 2.通过特定 API 直接调用时: POST /api/history/create
 def create_ai_consultation_record(user_id, question, answer):
     """
@@ -131,9 +319,10 @@ def create_ai_consultation_record(user_id, question, answer):
     # 返回创建好的主问诊对象，方便API层使用
     return new_consultation
 
-def add_chat_message_to_consultation(user_id, consultation_id, question, answer):
+def add_chat_message_to_consultation(user_id, consultation_id, question, answer, commit=True):
     """
     向一个已存在的AI问诊中追加一条问答记录。
+    commit=False 时只加入当前 session，由调用方统一提交 (见 add_chat_messages_to_consultation)。
     """
     # 1. 验证这次问诊是否真实存在且属于当前登录的用户
     consultation = AIConsultationModel.query.filter_by(id=consultation_id, patient_id=user_id).first()
@@ -174,11 +363,38 @@ def add_chat_message_to_consultation(user_id, consultation_id, question, answer)
     #-----------------------------------------------
     # 3. 将新记录添加到数据库并提交
     db.session.add_all([user_message, ai_message])
-    db.session.commit()
+    if commit:
+        db.session.commit()
+        after_turns_added(user_id)
     
     # 返回主问诊对象，表示追加成功
     return consultation
 
+
+def after_turns_added(user_id):
+    """新问答写入后，按配置在后台预生成病历 (medical_record_job_service 依赖本模块，因此在函数内导入)"""
+    from .medical_record_job_service import maybe_pregenerate_medical_record
+    maybe_pregenerate_medical_record(user_id)
+
+def add_chat_messages_to_consultation(user_id, consultation_id, turns):
+    """
+    按顺序追加多条问答记录 [(question, answer), ...]，全部在同一个事务中提交：
+    要么全部写入，要么 (出错时) 全部回滚。
+    """
+    try:
+        consultation = None
+        for question, answer in turns:
+            consultation = add_chat_message_to_consultation(user_id, consultation_id, question, answer, commit=False)
+            if consultation is None:
+                db.session.rollback()
+                return None
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    after_turns_added(user_id)
+    return consultation
+
 def start_new_chat_session(user_id):
     """
     为用户开启一个新的对话会话。
@@ -196,10 +412,108 @@ def start_new_chat_session(user_id):
     return f"chat_{new_consultation.id}"
 
 
-def generate_medical_record_from_history(user_id):
+def medical_record_to_dict(record):
+    """把病历转换为 API 文档要求的中文键字典"""
+    # [cite_start]你的Flask API (大创文档xin.docx) 需要返回中文键 [cite: 532]
+    return {
+        "id": str(record.id),
+        "主诉": record.chief_complaint,
+        "现病史": record.history_present_illness,
+        "既往史": record.past_medical_history,
+        "个人史": record.personal_history,
+        "家族史": record.family_history,
+        "诊断": record.diagnosis,
+        "createdAt": record.created_at.strftime("%Y-%m-%d %H:%M:%S")
+    }
+
+
+def _patient_messages(user_id):
+    """用户所有 AI 问诊的消息查询"""
+    return ChatMessageModel.query.join(
+        AIConsultationModel, ChatMessageModel.consultation_id == AIConsultationModel.id
+    ).filter(AIConsultationModel.patient_id == user_id)
+
+
+def turns_since_last_medical_record(user_id):
+    """用户在最近一份 (可增量生成的) 病历之后新增的问答轮数 (按 AI 回答计数，不含欢迎消息)"""
+    last_message_id = db.session.query(db.func.max(MedicalRecordModel.last_message_id)).filter(
+        MedicalRecordModel.patient_id == user_id
+    ).scalar()
+    query = _patient_messages(user_id).filter(
+        ChatMessageModel.sender_type == 'ai', ChatMessageModel.content != WELCOME_ANSWER
+    )
+    if last_message_id is not None:
+        query = query.filter(ChatMessageModel.id > last_message_id)
+    return query.count()
+
+
+def medical_record_fingerprint(user):
+    """
+    生成病历所用输入内容的指纹：用户 AI 问诊消息的 (条数, 最大 ID) 加上姓名和档案中的病史字段。
+    消息只追加不修改，(条数, 最大 ID) 与完整的消息 ID 列表等价，且只需一次聚合查询 (不随历史长度增长)；
+    没有新消息、档案也未修改时指纹不变。
+    """
+    message_count, last_message_id = _patient_messages(user.id).with_entities(
+        db.func.count(ChatMessageModel.id), db.func.max(ChatMessageModel.id)
+    ).one()
+    source = {
+        "message_count": message_count,
+        "last_message_id": last_message_id,
+        "full_name": user.full_name,
+        "basic_medical_history": user.basic_medical_history,
+        "personal_history": user.personal_history,
+        "family_history": user.family_history,
+    }
+    return hashlib.sha256(json.dumps(source, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def stored_encounters(record):
+    """解析病历 history_present_illness 中以 JSON 保存的 encounters (不是 JSON 列表时返回空列表)"""
+    try:
+        encounters = json.loads(record.history_present_illness or "")
+    except ValueError:
+        return []
+    return encounters if isinstance(encounters, list) else []
+
+
+def merge_encounters(previous, new):
+    """把新生成的 encounters 追加到已有列表之后，跳过完全相同的条目 (上游未按增量返回时不会重复)"""
+    merged = list(previous)
+    for encounter in new:
+        if encounter not in merged:
+            merged.append(encounter)
+    return merged
+
+
+def _call_record_generator(user_id, patient_name, context=None, incremental=None):
+    """调用 llm_service 生成结构化病历；失败或返回无效内容时返回 None，上游繁忙时抛出 UpstreamBusyError"""
+    try:
+        # 调用 llm_service.py (llm_service.py) 中你写好的函数
+        print(f"--- Calling llm_service.generate_structured_medical_record for {patient_name} ---")
+        generated_record_dict = llm_service.generate_structured_medical_record(patient_name, context, incremental)
+    
+    except UpstreamBusyError:
+        # 上游容量已满，交给 API 层返回 429，让客户端稍后重试
+        raise
+    except Exception as e:
+        # 捕获 llm_service (llm_service.py) 抛出的异常 (例如连接失败或FastAPI返回错误)
+        print(f"Error calling llm_service for user {user_id} ({patient_name}): {e}")
+        return None # 返回 None 表示生成失败
+
+    if not generated_record_dict or "patient_name" not in generated_record_dict:
+        print(f"Error: llm_service did not return a valid record dictionary.")
+        return None
+    return generated_record_dict
+
+
+def generate_medical_record_from_history(user_id, commit=True):
     """
     根据用户的 patient_name 调用 LLM 服务生成结构化电子病历。
     (已修改为调用 llm_service.py)
+    commit=False 时只 flush 不提交，由调用方 (病历生成任务) 与任务状态在同一事务中提交。
+    问诊消息和病史档案自上次生成后都没有变化时，直接返回上次生成的病历，不再调用 LLM。
+    已有病历时增量生成：只把上一份病历之后的新问答和上一份病历发给 AI，
+    并把返回的 encounters 合并进上一份病历的 encounters，开销只与新增的问诊量有关。
     """
     
     # --- 1. (新增) 获取 patient_name ---
@@ -215,35 +529,69 @@ def generate_medical_record_from_history(user_id):
         # FastAPI (Fastapi.txt) 明确要求 patient_name
         return None
 
-    # --- 2. (修改) 调用 llm_service ---
-    try:
-        # 调用 llm_service.py (llm_service.py) 中你写好的函数
-        print(f"--- Calling llm_service.generate_structured_medical_record for {patient_name} ---")
-        generated_record_dict = llm_service.generate_structured_medical_record(patient_name)
-    
-    except Exception as e:
-        # 捕获 llm_service (llm_service.py) 抛出的异常 (例如连接失败或FastAPI返回错误)
-        print(f"Error calling llm_service for user {user_id} ({patient_name}): {e}")
-        return None # 返回 None 表示生成失败
+    fingerprint = medical_record_fingerprint(user)
+    existing_record = MedicalRecordModel.query.filter_by(
+        patient_id=user_id, source_fingerprint=fingerprint
+    ).order_by(MedicalRecordModel.id.desc()).first()
+    if existing_record:
+        print(f"--- Medical record {existing_record.id} is up to date for user {user_id}, skipping generation ---")
+        return medical_record_to_dict(existing_record)
 
-    if not generated_record_dict or "patient_name" not in generated_record_dict:
-        print(f"Error: llm_service did not return a valid record dictionary.")
-        return None
+    # context_service 依赖本模块的常量，因此在函数内导入
+    from .context_service import build_context, pair_turns
+    previous_record = MedicalRecordModel.query.filter(
+        MedicalRecordModel.patient_id == user_id, MedicalRecordModel.last_message_id.isnot(None)
+    ).order_by(MedicalRecordModel.id.desc()).first()
 
-    # --- 3. (关键修改) 组合数据并保存到 Flask 数据库 ---
-    try:
-        # 从 AI (FastAPI) (Fastapi.txt) 获取动态信息
+    if previous_record is None:
+        # --- 2. (修改) 首次生成：调用 llm_service，并带上最近一次AI问诊的上下文 (滚动摘要 + 最近几轮) ---
+        latest_consultation = AIConsultationModel.query.filter_by(patient_id=user_id).order_by(AIConsultationModel.created_at.desc()).first()
+        context = build_context(latest_consultation.id) if latest_consultation else None
+        # 只记到最后一条 AI 回答，尚未得到回答的问题留给下次增量生成
+        last_message_id = _patient_messages(user_id).filter(
+            ChatMessageModel.sender_type == 'ai'
+        ).with_entities(db.func.max(ChatMessageModel.id)).scalar()
+        generated_record_dict = _call_record_generator(user_id, patient_name, context=context)
+        if generated_record_dict is None:
+            return None
         ai_summary = generated_record_dict.get("summary", "暂无主诉")
         ai_encounters = generated_record_dict.get("encounters", [])
-        
-        # 从 encounters 提取简单的诊断
-        primary_diagnosis = "暂无诊断"
-        history_present_illness = "暂无现病史"
-        
-        if ai_encounters:
-            first_encounter = ai_encounters[0]
-            primary_diagnosis = first_encounter.get("diagnosis", "暂无诊断")
-            history_present_illness = json.dumps(ai_encounters, ensure_ascii=False)
+        primary_diagnosis = ai_encounters[0].get("diagnosis", "暂无诊断") if ai_encounters else "暂无诊断"
+    else:
+        # --- 2. 增量生成：只发送上一份病历之后的新问答 ---
+        new_turns = pair_turns(
+            _patient_messages(user_id).filter(ChatMessageModel.id > previous_record.last_message_id)
+            .order_by(ChatMessageModel.id).all()
+        )
+        previous_encounters = stored_encounters(previous_record)
+        ai_summary = previous_record.chief_complaint
+        ai_encounters = previous_encounters
+        primary_diagnosis = previous_record.diagnosis
+        last_message_id = previous_record.last_message_id
+        if new_turns:
+            incremental = {
+                "previous_record": {
+                    "summary": previous_record.chief_complaint,
+                    "diagnosis": previous_record.diagnosis,
+                    "encounters": previous_encounters,
+                },
+                "new_turns": [{"question": question, "answer": answer} for question, answer, _ in new_turns],
+            }
+            generated_record_dict = _call_record_generator(user_id, patient_name, incremental=incremental)
+            if generated_record_dict is None:
+                return None
+            new_encounters = generated_record_dict.get("encounters", [])
+            ai_summary = generated_record_dict.get("summary") or ai_summary
+            ai_encounters = merge_encounters(previous_encounters, new_encounters)
+            if new_encounters:
+                primary_diagnosis = new_encounters[0].get("diagnosis", primary_diagnosis)
+            last_message_id = new_turns[-1][2]
+        # 没有新问答时只有病史档案变化，沿用上一份病历中 AI 生成的内容，不调用 LLM
+
+    # --- 3. (关键修改) 组合数据并保存到 Flask 数据库 ---
+    try:
+        # encounters 详情以 JSON 保存在现病史中
+        history_present_illness = json.dumps(ai_encounters, ensure_ascii=False) if ai_encounters else "暂无现病史"
 
         # --- 替换占位符 ---
         new_medical_record = MedicalRecordModel(
@@ -252,30 +600,24 @@ def generate_medical_record_from_history(user_id):
             # 1. AI 生成的动态信息
             chief_complaint=ai_summary, # 使用FastAPI的summary
             history_present_illness=history_present_illness, # 存储 encounters 详情
-            diagnosis=primary_diagnosis, # 使用第一个 encounter 的诊断
+            diagnosis=primary_diagnosis, # 使用 (新) encounter 中第一个的诊断
             
             # 2. 从 UserModel 提取的静态信息
             past_medical_history=user.basic_medical_history or "患者未提供", 
             personal_history=user.personal_history or "患者未提供", 
-            family_history=user.family_history or "患者未提供"
+            family_history=user.family_history or "患者未提供",
+            source_fingerprint=fingerprint,
+            last_message_id=last_message_id
         )
         
         db.session.add(new_medical_record)
-        db.session.commit()
+        if commit:
+            db.session.commit()
+        else:
+            db.session.flush()
         
         # --- 4. (修改) 返回符合 API 文档 (大创文档xin.docx) 的字典 ---
-        # [cite_start]你的Flask API (大创文档xin.docx) 需要返回中文键 [cite: 532]
-        final_record_dict = {
-            "id": str(new_medical_record.id),
-            "主诉": new_medical_record.chief_complaint,
-            "现病史": new_medical_record.history_present_illness,
-            "既往史": new_medical_record.past_medical_history,
-            "个人史": new_medical_record.personal_history,
-            "家族史": new_medical_record.family_history,
-            "诊断": new_medical_record.diagnosis,
-            "createdAt": new_medical_record.created_at.strftime("%Y-%m-%d %H:%M:%S")
-        }
-        return final_record_dict
+        return medical_record_to_dict(new_medical_record)
 
     except Exception as e:
         db.session.rollback() # 保存失败时回滚
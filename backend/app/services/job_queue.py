@@ -0,0 +1,214 @@
+# backend/app/services/job_queue.py
+"""
+基于数据库表的轻量任务队列。
+
+任务表需要包含以下字段 (参见 ChatJobModel)：
+    status, attempts, error, lease_expires_at, created_at, started_at, finished_at
+
+领取任务使用带条件的 UPDATE (compare-and-set)，因此多个线程、多个 gunicorn worker
+同时领取也不会重复执行；执行中的任务带有租约，worker 崩溃或重启后，
+租约过期的任务会被重新领取，直到达到最大尝试次数。
+"""
+
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, or_, select, update
+
+from ..core.extensions import db
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_SUCCEEDED = 'succeeded'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+
+FINISHED_STATUSES = (JOB_SUCCEEDED, JOB_FAILED, JOB_CANCELLED)
+
+# handler 的整体时限比租约短的秒数 (写回结果也需要时间)
+LEASE_SAFETY_SECONDS = 30
+
+
+class RetryJobLater(Exception):
+    """handler 抛出此异常表示暂时无法执行 (例如上游繁忙)，任务重新排队，delay 秒后再领取"""
+
+    def __init__(self, delay=1):
+        super().__init__(f"retry in {delay}s")
+        self.delay = delay
+
+
+def _claimable(model, now):
+    return or_(
+        model.status == JOB_QUEUED,
+        and_(model.status == JOB_RUNNING, model.lease_expires_at < now)
+    )
+
+
+def claim_next_job(model, lease_seconds, max_attempts):
+    """
+    领取一条可执行的任务 (排队中，或租约已过期的执行中任务)。
+    返回领取到的任务对象，没有可领取的任务时返回 None。
+    """
+    now = datetime.utcnow()
+
+    # 租约过期且已达到最大尝试次数的任务直接判定为失败，避免反复崩溃的任务无限重试
+    db.session.execute(
+        update(model).where(
+            model.status == JOB_RUNNING,
+            model.lease_expires_at < now,
+            model.attempts >= max_attempts
+        ).values(status=JOB_FAILED, error='任务多次执行中断，已放弃', finished_at=now)
+    )
+    db.session.commit()
+
+    candidates = db.session.query(model.id).filter(_claimable(model, now)).order_by(model.id).limit(5).all()
+    for (job_id,) in candidates:
+        result = db.session.execute(
+            update(model).where(
+                model.id == job_id,
+                _claimable(model, now)
+            ).values(
+                status=JOB_RUNNING,
+                attempts=model.attempts + 1,
+                started_at=now,
+                lease_expires_at=now + timedelta(seconds=lease_seconds)
+            )
+        )
+        db.session.commit()
+        if result.rowcount == 1:
+            return db.session.get(model, job_id)
+    return None
+
+
+def requeue_job(model, job_id, attempts=None):
+    """
+    把执行中的任务放回队列 (不计为失败)：退回本次领取增加的 attempts，
+    上游持续繁忙时任务不会在一次真正的执行都没有的情况下用完尝试次数。
+    传入领取时的 attempts 时，任务已被其他 worker 重新领取则不做改动。
+    """
+    condition = [model.id == job_id, model.status == JOB_RUNNING]
+    if attempts is not None:
+        condition.append(model.attempts == attempts)
+    db.session.execute(
+        update(model).where(*condition)
+        .values(status=JOB_QUEUED, lease_expires_at=None, attempts=model.attempts - 1)
+    )
+    db.session.commit()
+
+
+def cancel_job(model, job_id):
+    """把排队中或执行中的任务标记为已取消，返回是否取消成功 (已结束的任务不受影响)"""
+    result = db.session.execute(
+        update(model).where(model.id == job_id, model.status.in_((JOB_QUEUED, JOB_RUNNING)))
+        .values(status=JOB_CANCELLED, finished_at=datetime.utcnow(), lease_expires_at=None)
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def job_status(model, job_id):
+    """用独立连接读取任务的最新状态，不受当前 session 中事务快照的影响"""
+    with db.engine.connect() as conn:
+        return conn.execute(select(model.status).where(model.id == job_id)).scalar()
+
+
+def finish_claimed_job(model, job_id, attempts, status, **fields):
+    """
+    以领取时的 attempts 作为令牌结束任务：只有任务仍在执行、且没有因租约过期被其他 worker 重新领取时才写入，
+    并与调用方在当前 session 中的其他修改 (例如问答记录) 在同一事务中提交。
+    任务已被重新领取或取消时回滚这些修改并返回 False。
+    """
+    result = db.session.execute(
+        update(model).where(model.id == job_id, model.status == JOB_RUNNING, model.attempts == attempts)
+        .values(status=status, finished_at=datetime.utcnow(), lease_expires_at=None, **fields)
+    )
+    if result.rowcount != 1:
+        db.session.rollback()
+        return False
+    db.session.commit()
+    return True
+
+
+class JobWorkerPool:
+    """
+    每个进程一组后台线程，循环领取并执行某张任务表中的任务。
+    handler(job) 负责执行任务并以领取时的 attempts 调用 finish_claimed_job；抛出的异常会被记录为任务失败。
+    """
+
+    def __init__(self, name, model, handler, workers, lease_seconds, max_attempts, poll_interval=2.0):
+        self.name = name
+        self.model = model
+        self.handler = handler
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._owner_pid = None
+
+    @property
+    def deadline_seconds(self):
+        """handler 调用上游时使用的整体时限，留出余量保证在租约过期 (任务被重新领取) 之前结束"""
+        return max(self.lease_seconds - LEASE_SAFETY_SECONDS, self.lease_seconds / 2)
+
+    def process_next(self):
+        """领取并执行一条任务，返回是否执行了任务 (需要在 app_context 中调用)"""
+        job = claim_next_job(self.model, self.lease_seconds, self.max_attempts)
+        if job is None:
+            return False
+        print(f"--- {self.name}: running job {job.id} (attempt {job.attempts}) ---")
+        job_id, attempts = job.id, job.attempts
+        try:
+            self.handler(job)
+        except RetryJobLater as e:
+            db.session.rollback()
+            requeue_job(self.model, job_id, attempts)
+            print(f"{self.name}: job {job_id} requeued, retry in {e.delay}s")
+            time.sleep(min(e.delay, self.poll_interval * 5))
+        except Exception as e:
+            db.session.rollback()
+            print(f"{self.name}: job {job_id} failed: {e}")
+            # 任务已被其他 worker 重新领取时不覆盖它的状态
+            finish_claimed_job(self.model, job_id, attempts, JOB_FAILED, error=str(e))
+        return True
+
+    def notify(self):
+        """有新任务入队时唤醒空闲的 worker"""
+        self._wake.set()
+
+    def start(self, app):
+        """启动后台线程 (同一进程内只启动一次，fork 之后会在子进程中重新启动)"""
+        if self.workers <= 0:
+            return
+        with self._lock:
+            if self._owner_pid == os.getpid() and any(t.is_alive() for t in self._threads):
+                return
+            self._owner_pid = os.getpid()
+            self._threads = []
+            for i in range(self.workers):
+                thread = threading.Thread(
+                    target=self._run, args=(app,), name=f"{self.name}-{i}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+        print(f"--- {self.name}: started {self.workers} worker threads ---")
+
+    def _run(self, app):
+        while True:
+            worked = False
+            with app.app_context():
+                try:
+                    worked = self.process_next()
+                except Exception as e:
+                    print(f"{self.name}: worker loop error: {e}")
+                    db.session.rollback()
+                    time.sleep(self.poll_interval)
+                finally:
+                    db.session.remove()
+            if not worked:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
@@ -0,0 +1,174 @@
+# backend/app/services/llm_runtime.py
+"""
+每个 worker 进程共享的 LLM 运行时：
+一个常驻的后台事件循环线程 + 一个 keep-alive 的 HTTP 连接池。
+
+Flask 的同步代码通过 run() / iterate() 把协程提交到这个循环上执行，
+不再为每个请求创建新的事件循环、新的 TCP 连接。
+"""
+
+import asyncio
+import concurrent.futures
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# --- 配置 ---
+LLM_HTTP_POOL_SIZE = int(os.environ.get("LLM_HTTP_POOL_SIZE", "20"))
+# run() 带 cancelled 回调时检查取消状态的间隔(秒)
+CANCEL_POLL_INTERVAL = float(os.environ.get("LLM_CANCEL_POLL_INTERVAL", "0.5"))
+
+
+class RequestCancelled(Exception):
+    """调用方已放弃 (客户端断开、任务被取消)，协程已在事件循环上被取消"""
+
+_lock = threading.Lock()
+_loop = None
+_loop_thread = None
+_http_session = None
+_executor = None
+_owner_pid = None
+
+
+def _reset_if_forked():
+    """gunicorn 以 preload 方式 fork 时，子进程不会继承父进程的线程，需要重新创建"""
+    global _loop, _loop_thread, _http_session, _executor, _owner_pid
+    if _owner_pid is not None and _owner_pid != os.getpid():
+        _loop = None
+        _loop_thread = None
+        _http_session = None
+        _executor = None
+        _owner_pid = None
+
+
+def get_loop():
+    """返回(必要时启动)后台事件循环"""
+    global _loop, _loop_thread, _owner_pid
+    with _lock:
+        _reset_if_forked()
+        if _loop is None or _loop_thread is None or not _loop_thread.is_alive():
+            _loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def _run():
+                asyncio.set_event_loop(_loop)
+                _loop.call_soon(ready.set)
+                _loop.run_forever()
+
+            _loop_thread = threading.Thread(target=_run, name="llm-event-loop", daemon=True)
+            _loop_thread.start()
+            ready.wait()
+            _owner_pid = os.getpid()
+            print(f"--- llm_runtime: background event loop started (pid={_owner_pid}) ---")
+        return _loop
+
+
+def http_session():
+    """返回进程内共享的 requests.Session (带 keep-alive 连接池)"""
+    global _http_session, _owner_pid
+    with _lock:
+        _reset_if_forked()
+        if _http_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=LLM_HTTP_POOL_SIZE, pool_maxsize=LLM_HTTP_POOL_SIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _http_session = session
+            _owner_pid = _owner_pid or os.getpid()
+        return _http_session
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=LLM_HTTP_POOL_SIZE, thread_name_prefix="llm-http")
+        return _executor
+
+
+async def http_post(url, **kwargs):
+    """
+    在事件循环中发起 POST 请求。
+    requests 是阻塞的，因此放到专用线程池中执行，避免卡住共享循环上的其他会话。
+    """
+    loop = asyncio.get_running_loop()
+    session = http_session()
+    return await loop.run_in_executor(_get_executor(), lambda: session.post(url, **kwargs))
+
+
+async def http_get(url, **kwargs):
+    """在事件循环中发起 GET 请求 (同 http_post)"""
+    loop = asyncio.get_running_loop()
+    session = http_session()
+    return await loop.run_in_executor(_get_executor(), lambda: session.get(url, **kwargs))
+
+
+def run(coro, timeout=None, cancelled=None):
+    """
+    同步调用方：把协程提交到后台循环并等待结果。
+    传入 cancelled 回调时，等待期间每 CANCEL_POLL_INTERVAL 秒检查一次；
+    返回 True 则取消协程 (关闭 WebSocket、释放并发名额) 并抛出 RequestCancelled。
+    """
+    loop = get_loop()
+    if threading.current_thread() is _loop_thread:
+        raise RuntimeError("llm_runtime.run() cannot be called from the event loop thread")
+    future = asyncio.run_coroutine_threadsafe(coro, loop)
+    if cancelled is None:
+        return future.result(timeout)
+
+    waited = 0.0
+    while not concurrent.futures.wait([future], CANCEL_POLL_INTERVAL).done:
+        waited += CANCEL_POLL_INTERVAL
+        if cancelled():
+            future.cancel()
+            raise RequestCancelled()
+        if timeout is not None and waited >= timeout:
+            future.cancel()
+            raise concurrent.futures.TimeoutError()
+    return future.result()
+
+
+async def _cancel_and_close(agen, current):
+    """先取消仍在等待下一帧的任务，再关闭异步生成器 (两者不能同时运行)"""
+    pending = current.get("task")
+    if pending is not None and not pending.done():
+        pending.cancel()
+        await asyncio.wait({pending})
+    await agen.aclose()
+
+
+def iterate(agen, heartbeat=None):
+    """
+    同步调用方：逐个取出异步生成器的元素。
+    调用方提前关闭生成器 (例如 SSE 客户端断开) 时，会在循环上取消正在进行的等待并 aclose() 异步生成器，
+    从而关闭底层的 WebSocket。
+    heartbeat 不为 None 时，超过 heartbeat 秒没有新元素就产出一个 None，
+    调用方借此写出心跳，及时发现已经断开的客户端。
+    """
+    loop = get_loop()
+    current = {}
+
+    async def _anext():
+        current["task"] = asyncio.current_task()
+        return await agen.__anext__()
+
+    try:
+        while True:
+            future = asyncio.run_coroutine_threadsafe(_anext(), loop)
+            while heartbeat is not None and not concurrent.futures.wait([future], heartbeat).done:
+                yield None
+            try:
+                item = future.result()
+            except StopAsyncIteration:
+                return
+            yield item
+    finally:
+        try:
+            asyncio.run_coroutine_threadsafe(
+                _cancel_and_close(agen, current), loop
+            ).result(timeout=10)
+        except Exception as e:
+            print(f"llm_runtime: error closing async generator: {e}")
@@ -5,181 +5,726 @@ import asyncio
 import websockets
 import json
 import os
+import random
+import time
 import threading # 导入 threading
+from . import llm_runtime
+from . import answer_cache
+from . import single_flight
+from .bulkhead import upstream_bulkhead, UpstreamBusyError, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+from .upstream_pool import upstream_pool
+from .warm_pool import warm_pool
 
 # --- 配置 ---
-FASTAPI_BASE_URL = os.environ.get("FASTAPI_BASE_URL", "http://localhost:8000")
+# 上游副本列表见 upstream_pool.FASTAPI_BASE_URLS (逗号分隔)；这里保留第一个地址供兼容
+FASTAPI_BASE_URL = upstream_pool.replicas[0].base_url
+# /chat/start 的重试：最多重试次数、单个请求的重试时间预算(秒)、退避基数(秒)
+LLM_START_MAX_RETRIES = int(os.environ.get("LLM_START_MAX_RETRIES", "2"))
+LLM_START_RETRY_BUDGET_SECONDS = float(os.environ.get("LLM_START_RETRY_BUDGET_SECONDS", "3"))
+LLM_START_RETRY_BASE_DELAY = float(os.environ.get("LLM_START_RETRY_BASE_DELAY", "0.2"))
+# 调用方放弃会话时通知 FastAPI 停止该会话的接口；置空则只关闭 WebSocket
+LLM_STOP_PATH = os.environ.get("LLM_STOP_PATH", "/api/v1/chat/stop/{session_id}")
+# WebSocket 异常断开后按 session_id 重连的最多次数、退避基数(秒)
+LLM_WS_MAX_RECONNECTS = int(os.environ.get("LLM_WS_MAX_RECONNECTS", "3"))
+LLM_WS_RECONNECT_BASE_DELAY = float(os.environ.get("LLM_WS_RECONNECT_BASE_DELAY", "0.5"))
+
+retry_stats = {"retries": 0, "budget_exhausted": 0}
+session_counters = {
+    "abandoned_sessions": 0, "stop_requests": 0, "stop_failed": 0,
+    "reconnects": 0, "resumed": 0, "duplicate_frames": 0,
+}
+# 后台通知任务的引用，防止任务在完成前被垃圾回收
+_background_tasks = set()
+
+# 单次调用各阶段的超时上限 (秒)；调用方传入的整体截止时间更早时以截止时间为准
+START_TIMEOUT = 10
+CONNECT_TIMEOUT = 60
+RECV_TIMEOUT = 120
+
+
+class DeadlineExceeded(Exception):
+    """调用方给定的整体截止时间已到"""
+
+
+def deadline_after(seconds):
+    """把"还剩多少秒"换算成 time.monotonic() 上的绝对截止时间；None 表示不限时"""
+    return time.monotonic() + seconds if seconds else None
+
+
+def _time_left(deadline, cap):
+    """本阶段可用的超时时间：min(阶段上限, 距截止时间的剩余秒数)；已到截止时间时抛出 DeadlineExceeded"""
+    if deadline is None:
+        return cap
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise DeadlineExceeded()
+    return min(cap, left)
+
+
+def _deadline_passed(deadline) -> bool:
+    return deadline is not None and time.monotonic() >= deadline
+
+
+def _is_upstream_fault(error) -> bool:
+    """连接失败、超时和 5xx/429 说明上游本身有问题 (计入熔断，允许重试)；其他 4xx 不算"""
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        return error.response.status_code >= 500 or error.response.status_code == 429
+    return isinstance(error, requests.exceptions.RequestException)
+
+
+async def _post_with_retries(url, timeout, deadline=None, breaker=None, **kwargs):
+    """
+    幂等的 POST：失败时按 full-jitter 指数退避重试。
+    重试次数和累计等待时间都受单个请求的预算限制 (且不超过 deadline)，breaker 打开后不再重试。
+    """
+    budget_ends_at = time.monotonic() + LLM_START_RETRY_BUDGET_SECONDS
+    if deadline is not None:
+        budget_ends_at = min(budget_ends_at, deadline)
+    attempt = 0
+    while True:
+        try:
+            response = await llm_runtime.http_post(url, timeout=_time_left(deadline, timeout), **kwargs)
+            response.raise_for_status()
+            return response
+        except requests.exceptions.RequestException as e:
+            if not _is_upstream_fault(e) or attempt >= LLM_START_MAX_RETRIES:
+                raise
+            delay = random.uniform(0, LLM_START_RETRY_BASE_DELAY * (2 ** attempt))
+            if time.monotonic() + delay > budget_ends_at or (breaker is not None and breaker.state != 'closed'):
+                retry_stats["budget_exhausted"] += 1
+                raise
+            attempt += 1
+            retry_stats["retries"] += 1
+            print(f"--- Retrying {url} in {delay:.2f}s (attempt {attempt}/{LLM_START_MAX_RETRIES}): {e} ---")
+            await asyncio.sleep(delay)
 
 # --- 结构化服务 API 调用 ---
-def generate_structured_medical_record(patient_name: str) -> dict:
-    # ... (此函数保持不变) ...
-    api_url = f"{FASTAPI_BASE_URL}/api/v1/medical_record/generate"
+async def generate_structured_medical_record_async(patient_name: str, context: dict = None, incremental: dict = None) -> dict:
+    """
+    调用 FastAPI 生成结构化病历 (按后台优先级占用一个上游并发名额)；context 为问诊上下文 (见 context_service)。
+    incremental 为增量生成的输入 {"previous_record": {...}, "new_turns": [...]}，上游只需为新问答生成 encounters。
+    """
     payload = {"patient_name": patient_name}
+    if context:
+        payload["context"] = context
+    if incremental:
+        payload.update(incremental)
     headers = {"Content-Type": "application/json"}
+    upstream_pool.check_available()
+    async with upstream_bulkhead.slot(priority=PRIORITY_BACKGROUND):
+        replica = upstream_pool.pick()
+        api_url = f"{replica.base_url}/api/v1/medical_record/generate"
+        upstream_pool.acquire(replica)
+        try:
+            print(f"--- 正在调用FastAPI：为 {patient_name} 生成病历 ---")
+            response = await llm_runtime.http_post(api_url, headers=headers, json=payload, timeout=60)
+            response.raise_for_status()
+            replica.breaker.record_success()
+            response_data = response.json()
+
+            print(f"--- 收到FastAPI响应 (生成病历) ---")
+
+            if "error" in response_data:
+                print(f"FastAPI返回错误: {response_data.get('error')}")
+                raise ValueError(f"FastAPI 错误: {response_data.get('error')}. 原始输出: {response_data.get('raw_output')}")
+
+            if "patient_name" in response_data and "summary" in response_data and "encounters" in response_data:
+                return response_data
+            else:
+                print("错误：FastAPI 为病历返回了意外的JSON结构。")
+                raise ValueError("FastAPI 为病历返回了意外的JSON结构。")
+
+        except requests.exceptions.RequestException as e:
+            print(f"调用FastAPI generate_medical_record API时出错: {e}")
+            if _is_upstream_fault(e):
+                replica.breaker.record_failure(e)
+            raise ConnectionError(f"无法连接到FastAPI服务 {api_url}: {e}")
+        except ValueError as e:
+            print(f"处理FastAPI响应时出错: {e}")
+            raise e
+        except Exception as e:
+            print(f"generate_structured_medical_record 中发生意外错误: {e}")
+            raise RuntimeError(f"意外错误: {e}")
+        finally:
+            upstream_pool.release(replica)
+
+
+def generate_structured_medical_record(patient_name: str, context: dict = None, incremental: dict = None) -> dict:
+    """同步调用方使用的包装器；上游容量已满或熔断中时抛出 UpstreamBusyError (CircuitOpenError)"""
+    return llm_runtime.run(generate_structured_medical_record_async(patient_name, context, incremental))
+
+
+# --- 动态代理 API 调用 (WebSocket) ---
+DEFAULT_ANSWER = "未能获取到有效的 AI 回答。"
+TIMEOUT_ANSWER = "等待 AI 响应超时。"
+# 截止时间到达时返回的部分回答带有此前缀
+PARTIAL_ANSWER_NOTICE = "（AI 未能在限定时间内完成全部分析，以下为已生成的部分内容）\n"
+
+
+def _local_error(content: str) -> dict:
+    """构造一个由 Flask 端产生的 error 帧 (content 已是最终展示给用户的文本)"""
+    return {"type": "error", "content": content, "local": True}
+
+
+def _deadline_frame() -> dict:
+    """截止时间已到：由 Flask 端产生的结束帧，调用方据此返回部分回答"""
+    return {"type": "deadline_exceeded", "local": True}
+
+
+def is_partial_answer(answer: str) -> bool:
+    return bool(answer) and answer.startswith(PARTIAL_ANSWER_NOTICE)
+
+
+def _build_ws_url(session_id: str, base_url: str = None) -> str:
+    """根据副本的 base_url (默认 FASTAPI_BASE_URL) 构造 WebSocket URL (处理 https/wss)"""
+    base_url = base_url or FASTAPI_BASE_URL
+    if base_url.startswith("https://"):
+        domain_part = base_url.replace("https://", "", 1)
+        ws_protocol = "wss"
+    else:
+        domain_part = base_url.replace("http://", "", 1)
+        ws_protocol = "ws"
+    return f"{ws_protocol}://{domain_part}/api/v1/chat/ws/{session_id}"
+
+
+class AgentAnswerBuilder:
+    """
+    把 WebSocket 推送的帧逐条累积成最终回答。
+    非流式接口和 SSE 流式接口共用同一套规则：
+    Summarizer_Agent 的发言即最终答案；没有 Summarizer 时拼接所有 agent 发言。
+    截止时间先到时 (deadline_exceeded 帧)，用已收到的 agent 发言拼出部分回答并标记 partial。
+    """
+
+    def __init__(self):
+        self.final_answer = None
+        self.all_messages = []
+        self.failed = False
+        self.ended = False
+        self.partial = False
+
+    def feed(self, message: dict) -> bool:
+        """处理一帧，返回 True 表示会话已结束"""
+        message_type = message.get("type")
+        if message_type == "agent_message":
+            content = message.get("content", "")
+            speaker = message.get("speaker", "")
+            self.all_messages.append(f"{speaker}: {content}")
+            if speaker == "Summarizer_Agent":
+                self.final_answer = content
+                print("--- Final answer identified from Summarizer_Agent ---")
+            return False
+        if message_type == "error":
+            error_content = message.get("content", "Unknown error")
+            self.failed = True
+            if message.get("local"):
+                self.final_answer = error_content
+            else:
+                self.final_answer = f"处理过程中发生错误: {error_content}"
+            return True
+        if message_type == "session_end":
+            self.ended = True
+            return True
+        if message_type == "deadline_exceeded":
+            # Summarizer 已经给出最终答案时，回答是完整的，只是没等到 session_end
+            if self.final_answer is None:
+                self.partial = True
+                self.failed = not self.all_messages
+            return True
+        return False
+
+    @property
+    def succeeded(self) -> bool:
+        """会话正常结束且没有出错 (只有这样的回答才允许被缓存)"""
+        return not self.failed and not self.partial and (self.ended or self.final_answer is not None)
+
+    def result(self) -> str:
+        if self.partial:
+            if self.all_messages:
+                return PARTIAL_ANSWER_NOTICE + "\n".join(self.all_messages)
+            return TIMEOUT_ANSWER
+        if self.final_answer:
+            return self.final_answer
+        if self.all_messages:
+            return "\n".join(self.all_messages)
+        return DEFAULT_ANSWER
+
+
+async def stream_dynamic_response_async(question: str, deadline: float = None, priority: str = PRIORITY_INTERACTIVE,
+                                        context: dict = None):
+    """
+    异步生成器：启动 FastAPI 多代理会话，并在每一帧到达时立即产出。
+    产出的帧保持 FastAPI 的原始结构 (agent_message / error / session_end)；
+    Flask 端的连接错误、超时等会被转换成一条 local 的 error 帧，保证调用方只需处理帧。
+
+    deadline 是 time.monotonic() 上的整体截止时间 (见 deadline_after)，对排队、/chat/start、
+    WebSocket 连接和每一次 recv 都生效；到期时产出一条 deadline_exceeded 帧后结束。
+    WebSocket 异常断开时按 session_id 退避重连 (最多 LLM_WS_MAX_RECONNECTS 次)，已收到的帧不会重复产出。
+
+    会话期间按 priority (urgent / interactive / background，见 bulkhead) 占用一个上游并发名额；
+    名额和等待队列都已满时，在产出任何帧之前抛出 UpstreamBusyError，
+    所有副本都在熔断中时抛出 CircuitOpenError (不会发起任何网络请求)。
+    拿到名额后按负载选择一个副本 (见 upstream_pool)，整个会话固定使用该副本；
+    启用了预热池 (见 warm_pool) 时优先使用预先创建好的会话，省掉 /chat/start 和 WebSocket 握手。
+    成功创建会话后，先产出一条 session_started 帧 (携带 session_id)。
+    context 为问诊上下文 (滚动摘要 + 最近几轮，见 context_service)，随问题一起发给上游。
+    """
+    upstream_pool.check_available()
+    if _deadline_passed(deadline):
+        yield _deadline_frame()
+        return
+    async with upstream_bulkhead.slot(timeout=_time_left(deadline, upstream_bulkhead.queue_timeout), priority=priority):
+        warm = await warm_pool.take(question, context)
+        replica = warm.replica if warm is not None else upstream_pool.pick()
+        upstream_pool.acquire(replica, new_session=warm is None)
+        try:
+            async for message in _stream_agent_session(question, replica, deadline, warm, context):
+                yield message
+        finally:
+            upstream_pool.release(replica)
+
+
+class FrameDeduper:
+    """
+    断线重连后去掉已经收到过的帧。
+    帧带有 seq / message_id / id 时按编号去重；否则按 (type, speaker, content) 与已收到的帧逐条比对：
+    服务端重放历史时，重放部分与已收到的前缀一致，一旦出现不同的帧就视为新内容、停止比对。
+    """
+
+    ID_FIELDS = ("seq", "message_id", "id")
+
+    def __init__(self):
+        self._ids = set()
+        self._keys = []
+        self._replay_pos = None
+
+    def start_replay(self):
+        """新连接建立时调用"""
+        self._replay_pos = 0
+
+    def is_duplicate(self, message: dict) -> bool:
+        frame_id = next((message[field] for field in self.ID_FIELDS if message.get(field) is not None), None)
+        if frame_id is not None:
+            if frame_id in self._ids:
+                return True
+            self._ids.add(frame_id)
+            return False
+
+        key = (message.get("type"), message.get("speaker"), message.get("content"))
+        if self._replay_pos is not None:
+            if self._replay_pos < len(self._keys) and self._keys[self._replay_pos] == key:
+                self._replay_pos += 1
+                return True
+            self._replay_pos = None
+        self._keys.append(key)
+        return False
+
+
+async def _stop_upstream_session(session_id: str, base_url: str):
+    """尽力通知签发该会话的副本停止会话 (失败只记录日志，WebSocket 已经关闭)"""
+    session_counters["stop_requests"] += 1
     try:
-        print(f"--- 正在调用FastAPI：为 {patient_name} 生成病历 ---")
-        response = requests.post(api_url, headers=headers, json=payload, timeout=60)
+        response = await llm_runtime.http_post(
+            base_url + LLM_STOP_PATH.format(session_id=session_id), timeout=5
+        )
         response.raise_for_status()
-        response_data = response.json()
-        
-        print(f"--- 收到FastAPI响应 (生成病历) ---")
-        
-        if "error" in response_data:
-            print(f"FastAPI返回错误: {response_data.get('error')}")
-            raise ValueError(f"FastAPI 错误: {response_data.get('error')}. 原始输出: {response_data.get('raw_output')}")
-        
-        if "patient_name" in response_data and "summary" in response_data and "encounters" in response_data:
-             return response_data
-        else:
-             print("错误：FastAPI 为病历返回了意外的JSON结构。")
-             raise ValueError("FastAPI 为病历返回了意外的JSON结构。")
-             
-    except requests.exceptions.RequestException as e:
-        print(f"调用FastAPI generate_medical_record API时出错: {e}")
-        raise ConnectionError(f"无法连接到FastAPI服务 {api_url}: {e}")
-    except ValueError as e:
-         print(f"处理FastAPI响应时出错: {e}")
-         raise e
+        print(f"--- Upstream session {session_id} stopped ---")
     except Exception as e:
-         print(f"generate_structured_medical_record 中发生意外错误: {e}")
-         raise RuntimeError(f"意外错误: {e}")
+        session_counters["stop_failed"] += 1
+        print(f"Failed to stop upstream session {session_id}: {e}")
 
 
-# --- 动态代理 API 调用 (WebSocket) ---
-async def get_dynamic_response_async(question: str) -> str:
-    # ... (此异步函数保持不变) ...
-    start_api_url = f"{FASTAPI_BASE_URL}/api/v1/chat/start"
+def _abandon_session(session_id: str, base_url: str):
+    """会话在结束前被放弃 (客户端断开、任务取消、截止时间到达)"""
+    session_counters["abandoned_sessions"] += 1
+    print(f"--- Agent session {session_id} abandoned before session_end ---")
+    if not LLM_STOP_PATH:
+        return
+    task = asyncio.get_running_loop().create_task(_stop_upstream_session(session_id, base_url))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+async def _stream_agent_session(question: str, replica, deadline: float = None, warm=None, context: dict = None):
+    breaker = replica.breaker
+    start_api_url = f"{replica.base_url}/api/v1/chat/start"
     payload = {"question": question}
+    if context:
+        payload["context"] = context
     headers = {"Content-Type": "application/json"}
-    session_id = None
-    final_answer = "未能获取到有效的 AI 回答。"
-    all_messages = []
     ws_url = "" # 初始化 ws_url
+    session_id = None
+    session_finished = False
 
     try:
-        print(f"--- Calling FastAPI: Starting chat session for question: {question[:50]}... ---")
-        response = requests.post(start_api_url, headers=headers, json=payload, timeout=10)
-        response.raise_for_status()
-        session_id = response.json().get("session_id")
-        print(f"--- FastAPI Session Started: {session_id} ---")
-        if not session_id:
-            raise ValueError("Failed to get session_id from FastAPI")
-
-        # --- 构造 WebSocket URL (处理 https/wss) ---
-        if FASTAPI_BASE_URL.startswith("https://"):
-            domain_part = FASTAPI_BASE_URL.replace("https://", "", 1)
-            ws_protocol = "wss"
+        if warm is not None:
+            # 预热会话：问题已经通过打开的 WebSocket 发出
+            session_id = warm.session_id
+            print(f"--- Using pre-warmed session: {session_id} ---")
         else:
-            domain_part = FASTAPI_BASE_URL.replace("http://", "", 1)
-            ws_protocol = "ws"
-        ws_url = f"{ws_protocol}://{domain_part}/api/v1/chat/ws/{session_id}"
-        #------------------------------------
-
-        print(f"--- Connecting to WebSocket: {ws_url} ---")
-        async with websockets.connect(ws_url, timeout=60) as websocket:
-            print("--- WebSocket Connected ---")
-            while True:
-                try:
-                    message_str = await asyncio.wait_for(websocket.recv(), timeout=120)
-                    message = json.loads(message_str)
-                    message_type = message.get("type")
-                    print(f"Received WS Message: Type={message_type}, Speaker={message.get('speaker', 'N/A')}")
-                    if message_type == "agent_message":
-                        content = message.get("content", "")
-                        speaker = message.get("speaker", "")
-                        all_messages.append(f"{speaker}: {content}")
-                        if speaker == "Summarizer_Agent":
-                             final_answer = content
-                             print("--- Final answer identified from Summarizer_Agent ---")
-                    elif message_type == "error":
-                        error_content = message.get("content", "Unknown error")
-                        print(f"Error from WebSocket: {error_content}")
-                        final_answer = f"处理过程中发生错误: {error_content}"
-                        break
-                    elif message_type == "session_end":
-                        print("--- WebSocket Session Ended signal received ---")
-                        if final_answer == "未能获取到有效的 AI 回答." and all_messages:
-                            final_answer = "\n".join(all_messages)
-                        break
-                    else:
-                        print(f"Received unknown message type: {message_type}")
-                except asyncio.TimeoutError:
-                    print("WebSocket receive timeout.")
-                    final_answer = "等待 AI 响应超时。"
-                    break
-                except websockets.exceptions.ConnectionClosedOK:
-                    print("WebSocket connection closed normally.")
-                    break
-                except websockets.exceptions.ConnectionClosedError as e:
-                    print(f"WebSocket connection closed with error: {e}")
-                    final_answer = "与 AI 服务连接中断。"
-                    break
-                except Exception as e:
-                    print(f"Error processing WebSocket message: {e}")
-                    final_answer = f"处理 AI 消息时出错: {e}"
-                    break
+            print(f"--- Calling FastAPI: Starting chat session for question: {question[:50]}... ---")
+            start_started = time.monotonic()
+            response = await _post_with_retries(
+                start_api_url, timeout=START_TIMEOUT, deadline=deadline, breaker=breaker, headers=headers, json=payload
+            )
+            replica.observe_latency(time.monotonic() - start_started)
+            session_id = response.json().get("session_id")
+            print(f"--- FastAPI Session Started: {session_id} ---")
+            if not session_id:
+                raise ValueError("Failed to get session_id from FastAPI")
+        yield {"type": "session_started", "session_id": session_id}
+
+        # WebSocket (包括重连) 固定连接签发 session_id 的副本
+        ws_url = _build_ws_url(session_id, replica.base_url)
+        deduper = FrameDeduper()
+        reconnects = 0
+        while True:
+            dropped = None
+            try:
+                if warm is not None and not reconnects:
+                    connection = warm.websocket
+                else:
+                    print(f"--- Connecting to WebSocket: {ws_url} ---")
+                    connection = websockets.connect(ws_url, open_timeout=_time_left(deadline, CONNECT_TIMEOUT))
+                async with connection as websocket:
+                    print("--- WebSocket Connected ---")
+                    breaker.record_success()
+                    if reconnects:
+                        session_counters["resumed"] += 1
+                        deduper.start_replay()
+                    while True:
+                        try:
+                            message_str = await asyncio.wait_for(websocket.recv(), timeout=_time_left(deadline, RECV_TIMEOUT))
+                            message = json.loads(message_str)
+                        except (asyncio.TimeoutError, DeadlineExceeded):
+                            if _deadline_passed(deadline):
+                                print("--- Deadline exceeded, returning partial answer ---")
+                                yield _deadline_frame()
+                                return
+                            print("WebSocket receive timeout.")
+                            breaker.record_failure("WebSocket receive timeout")
+                            yield _local_error(TIMEOUT_ANSWER)
+                            return
+                        except websockets.exceptions.ConnectionClosedOK:
+                            print("WebSocket connection closed normally.")
+                            return
+                        except websockets.exceptions.ConnectionClosedError as e:
+                            print(f"WebSocket connection closed with error: {e}")
+                            breaker.record_failure(e)
+                            dropped = e
+                            break
+                        except Exception as e:
+                            print(f"Error processing WebSocket message: {e}")
+                            yield _local_error(f"处理 AI 消息时出错: {e}")
+                            return
+
+                        message_type = message.get("type")
+                        print(f"Received WS Message: Type={message_type}, Speaker={message.get('speaker', 'N/A')}")
+                        if message_type in ("agent_message", "error", "session_end"):
+                            if deduper.is_duplicate(message):
+                                session_counters["duplicate_frames"] += 1
+                                continue
+                            session_finished = message_type != "agent_message"
+                            yield message
+                            if message_type != "agent_message":
+                                if message_type == "session_end":
+                                    print("--- WebSocket Session Ended signal received ---")
+                                return
+                        else:
+                            print(f"Received unknown message type: {message_type}")
+            except websockets.exceptions.InvalidURI:
+                raise
+            except (websockets.exceptions.WebSocketException, OSError, asyncio.TimeoutError) as e:
+                # 首次连接失败交给下面统一处理；重连时握手失败则继续按退避重试
+                if not reconnects or _deadline_passed(deadline):
+                    raise
+                print(f"WebSocket reconnect failed: {e}")
+                breaker.record_failure(e)
+                dropped = e
+
+            # 连接异常中断：上游会话可能仍在运行，按 session_id 重连并继续接收
+            if reconnects >= LLM_WS_MAX_RECONNECTS or breaker.state == 'open':
+                yield _local_error("与 AI 服务连接中断。")
+                return
+            delay = random.uniform(0, LLM_WS_RECONNECT_BASE_DELAY * (2 ** reconnects))
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                yield _deadline_frame()
+                return
+            reconnects += 1
+            session_counters["reconnects"] += 1
+            print(f"--- WebSocket dropped ({dropped}), reconnecting in {delay:.2f}s "
+                  f"(attempt {reconnects}/{LLM_WS_MAX_RECONNECTS}) ---")
+            await asyncio.sleep(delay)
+    except DeadlineExceeded:
+        print("--- Deadline exceeded before the agent session produced an answer ---")
+        yield _deadline_frame()
     except requests.exceptions.RequestException as e:
+        if _deadline_passed(deadline):
+            # 截止时间到达导致的超时不计入熔断
+            print(f"--- Deadline exceeded while calling FastAPI start_chat API: {e} ---")
+            yield _deadline_frame()
+            return
         print(f"Error calling FastAPI start_chat API: {e}")
-        final_answer = f"无法连接到 AI 服务: {e}"
+        if _is_upstream_fault(e):
+            breaker.record_failure(e)
+        yield _local_error(f"无法连接到 AI 服务: {e}")
     except websockets.exceptions.InvalidURI:
-         print(f"Invalid WebSocket URI: {ws_url}")
-         final_answer = "配置的 AI 服务地址无效。"
+        print(f"Invalid WebSocket URI: {ws_url}")
+        yield _local_error("配置的 AI 服务地址无效。")
     except websockets.exceptions.WebSocketException as e:
-         print(f"WebSocket connection failed: {e}")
-         final_answer = f"无法建立与 AI 服务的实时连接: {e}"
+        print(f"WebSocket connection failed: {e}")
+        breaker.record_failure(e)
+        yield _local_error(f"无法建立与 AI 服务的实时连接: {e}")
+    except (OSError, asyncio.TimeoutError) as e:
+        # WebSocket 握手阶段的连接拒绝、DNS 失败、超时
+        if _deadline_passed(deadline):
+            print(f"--- Deadline exceeded while connecting to WebSocket: {e} ---")
+            yield _deadline_frame()
+            return
+        print(f"WebSocket connection failed: {e}")
+        breaker.record_failure(e)
+        yield _local_error(f"无法建立与 AI 服务的实时连接: {e}")
     except ValueError as e:
         print(f"Data error: {e}")
-        final_answer = f"AI 服务返回数据错误: {e}"
+        yield _local_error(f"AI 服务返回数据错误: {e}")
     except Exception as e:
-        print(f"An unexpected error occurred in get_dynamic_response_async: {e}")
-        final_answer = f"发生意外错误: {e}"
-    print(f"--- Dynamic Response Function Returning: {final_answer[:100]}... ---")
-    return final_answer
+        print(f"An unexpected error occurred in stream_dynamic_response_async: {e}")
+        yield _local_error(f"发生意外错误: {e}")
+    finally:
+        # 调用方提前关闭/取消生成器时 (GeneratorExit / CancelledError) 也会走到这里
+        if session_id and not session_finished:
+            _abandon_session(session_id, replica.base_url)
 
 
-# --- 同步包装器 (修改后) ---
-def _run_async_in_thread(coro):
-    """辅助函数：在一个新事件循环中运行协程"""
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+async def collect_dynamic_response_async(question: str, deadline: float = None,
+                                         priority: str = PRIORITY_INTERACTIVE, context: dict = None) -> AgentAnswerBuilder:
+    """消费完整的 WebSocket 会话，返回累积了全部帧的 AgentAnswerBuilder"""
+    builder = AgentAnswerBuilder()
+    stream = stream_dynamic_response_async(question, deadline, priority, context)
     try:
-        return loop.run_until_complete(coro)
+        async for message in stream:
+            if builder.feed(message):
+                break
     finally:
-        loop.close()
+        # 立即关闭生成器以释放 WebSocket 和上游并发名额
+        await stream.aclose()
+    return builder
+
+
+async def get_dynamic_response_async(question: str, deadline: float = None, priority: str = PRIORITY_INTERACTIVE,
+                                     context: dict = None) -> str:
+    """消费完整的 WebSocket 会话，返回最终回答"""
+    final_answer = (await collect_dynamic_response_async(question, deadline, priority, context)).result()
+    print(f"--- Dynamic Response Function Returning: {final_answer[:100]}... ---")
+    return final_answer
 
-def get_dynamic_response(question: str) -> str:
+
+# --- 同步包装器 ---
+def get_dynamic_response(question: str, deadline_seconds: float = None, cancelled=None,
+                         priority: str = PRIORITY_INTERACTIVE, context: dict = None) -> str:
     """
     同步调用 get_dynamic_response_async。
-    处理在 Flask 线程中运行 asyncio 的问题。
+    协程被提交到 llm_runtime 中常驻的事件循环上执行，不再为每个请求创建新的事件循环。
+    deadline_seconds 为整体时限，到期时返回已生成的部分回答 (见 is_partial_answer)。
+    cancelled 回调返回 True 时立即关闭上游会话并抛出 RequestCancelled。
     """
     current_thread = threading.current_thread()
     print(f"--- get_dynamic_response called in thread: {current_thread.name} ({current_thread.ident}) ---")
     try:
-        # 尝试直接使用 asyncio.run()，这是最简洁的方式，但在某些线程环境下可能失败
-        # 注意：asyncio.run() 会自动创建和管理事件循环
-        return asyncio.run(get_dynamic_response_async(question))
-    except RuntimeError as e:
-        # 捕获 asyncio.run() 可能抛出的 RuntimeError
-        print(f"asyncio.run() failed: {e}. Trying to run in a new event loop.")
-        # 如果 asyncio.run() 失败（比如因为当前线程已有循环但未运行，或明确无循环）
-        # 则尝试在一个新的、专用的事件循环中运行异步代码
-        try:
-            # 使用辅助函数在新循环中运行
-            return _run_async_in_thread(get_dynamic_response_async(question))
-        except Exception as inner_e:
-            print(f"Running async in new loop failed: {inner_e}")
-            return f"执行异步 AI 请求失败: {inner_e}"
+        return llm_runtime.run(
+            get_dynamic_response_async(question, deadline_after(deadline_seconds), priority, context), cancelled=cancelled
+        )
+    except (UpstreamBusyError, llm_runtime.RequestCancelled):
+        raise
     except Exception as e:
-        # 捕获其他可能的异常
         print(f"Error in get_dynamic_response wrapper: {e}")
         return f"调用 AI 服务时发生错误: {e}"
 
 
 # --- 替换旧的模拟函数 ---
-def get_ai_response(question: str) -> str:
+# 进程内的相同问题请求合并
+_inflight = single_flight.SingleFlight()
+
+
+def _fetch_answer(question: str, deadline: float = None, cancelled=None, priority: str = PRIORITY_INTERACTIVE,
+                  context: dict = None):
+    """真正调用上游一次，返回 (回答, 是否成功)；成功的回答写入缓存 (部分回答、错误提示不缓存)"""
+    try:
+        builder = llm_runtime.run(
+            collect_dynamic_response_async(question, deadline, priority, context), cancelled=cancelled
+        )
+    except (UpstreamBusyError, llm_runtime.RequestCancelled):
+        raise
+    except Exception as e:
+        print(f"Error in get_ai_response: {e}")
+        return f"调用 AI 服务时发生错误: {e}", False
+
+    ai_answer = builder.result()
+    if builder.succeeded:
+        answer_cache.store(question, ai_answer, context)
+    return ai_answer, builder.succeeded
+
+
+def get_ai_response(question: str, use_cache: bool = True, deadline_seconds: float = None, cancelled=None,
+                    priority: str = PRIORITY_INTERACTIVE, context: dict = None) -> str:
     """
-    获取 AI 对医疗问题的回答。
-    现在调用新的动态代理 API。
+    获取 AI 对医疗问题的回答。上游容量已满时抛出 UpstreamBusyError。
+    先查回答缓存 (按归一化后的问题)，未命中时调用动态代理 API，只有成功的回答会被写入缓存。
+    同一个归一化问题的并发请求 (重复提交、前端重试、热门问题) 只会发起一次上游会话并共享结果；
+    开启 LLM_SINGLEFLIGHT_DB 后跨 gunicorn worker 同样生效 (只共享成功的回答，失败时其他 worker 自行调用上游)。
+    use_cache=False 时完全跳过缓存与合并 (例如带附件的问题，或客户端要求不使用缓存)。
+    deadline_seconds 限定整体耗时，到期时返回带 PARTIAL_ANSWER_NOTICE 前缀的部分回答。
+    cancelled 回调返回 True (客户端断开、任务被取消) 时关闭上游会话并抛出 RequestCancelled；
+    合并请求中只有在没有其他请求等待同一结果时，leader 才会真正取消上游会话。
+    priority 决定排队时的调度类别 (见 bulkhead)；合并的请求沿用 leader 的优先级。
+    context 为问诊上下文 (见 context_service)；带上下文时缓存和合并的键包含上下文，
+    只有问题和上下文都相同的请求 (同一问诊中的重复提交、重试) 才共用回答。
     """
-    return get_dynamic_response(question)
+    if not use_cache:
+        answer_cache.record_bypass()
+        return get_dynamic_response(question, deadline_seconds, cancelled, priority, context)
+
+    cached_answer = answer_cache.lookup(question, context)
+    if cached_answer is not None:
+        print(f"--- Answer cache hit for question: {question[:50]}... ---")
+        return cached_answer
+
+    key = answer_cache.cache_key(question, context)
+    deadline = deadline_after(deadline_seconds)
+    leader_cancelled = None
+    if cancelled is not None:
+        leader_cancelled = lambda: cancelled() and _inflight.followers(key) == 0
+
+    outcome = {}
+
+    def fetch():
+        answer, outcome["succeeded"] = _fetch_answer(question, deadline, leader_cancelled, priority, context)
+        return answer
+
+    def publish(answer):
+        # 与缓存相同的成功判断：部分回答、超时和错误提示只返回给本请求，不写入租约行交给其他 worker
+        return outcome.get("succeeded", False)
 
+    while True:
+        try:
+            if single_flight.LLM_SINGLEFLIGHT_DB:
+                return _inflight.do(key, lambda: single_flight.run_with_lease(key, fetch, publish))
+            return _inflight.do(key, fetch)
+        except llm_runtime.RequestCancelled:
+            if cancelled is not None and cancelled():
+                raise
+            # 合并到的 leader 被它自己的调用方取消了，本请求重新发起
+            print(f"--- Coalesced leader was cancelled, retrying question: {question[:50]}... ---")
+
+
+async def _collect_answer_async(question: str, deadline: float = None, priority: str = PRIORITY_INTERACTIVE,
+                               context: dict = None):
+    """批量问答中的单个问题：返回 (回答, 是否成功)；只有 UpstreamBusyError 会向上抛出"""
+    try:
+        builder = await collect_dynamic_response_async(question, deadline, priority, context)
+    except UpstreamBusyError:
+        raise
+    except Exception as e:
+        print(f"Error in batch question: {e}")
+        return f"调用 AI 服务时发生错误: {e}", False
+    return builder.result(), builder.succeeded
+
+
+async def collect_many_async(questions, deadline: float = None, priority: str = PRIORITY_INTERACTIVE,
+                             context: dict = None) -> list:
+    """
+    并发执行多个问题的上游会话，按输入顺序返回 [(回答, 是否成功), ...]。
+    每个问题各自占用一个上游并发名额；任何一个问题拿不到名额 (UpstreamBusyError) 或整体被取消时，
+    其余会话全部取消，整批失败，避免只完成一部分问题。
+    """
+    tasks = [
+        asyncio.ensure_future(_collect_answer_async(question, deadline, priority, context)) for question in questions
+    ]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+def get_ai_responses(questions, use_cache: bool = True, deadline_seconds: float = None, cancelled=None,
+                     priority: str = PRIORITY_INTERACTIVE, context: dict = None) -> list:
+    """
+    批量版本的 get_ai_response：按输入顺序返回每个问题的回答。
+    缓存命中的问题直接返回，批内归一化后相同的问题只问一次，其余问题并发调用上游，
+    总耗时约等于最慢的一个问题，而不是逐个调用的总和。
+    任何一个问题拿不到上游名额时整批抛出 UpstreamBusyError；cancelled、context 的含义同 get_ai_response。
+    """
+    answers = [None] * len(questions)
+    pending = {}
+    for index, question in enumerate(questions):
+        key = answer_cache.cache_key(question, context) if use_cache else index
+        if key in pending:
+            pending[key].append(index)
+            continue
+        cached_answer = answer_cache.lookup(question, context) if use_cache else None
+        if cached_answer is not None:
+            answers[index] = cached_answer
+            continue
+        pending[key] = [index]
+    if not use_cache:
+        answer_cache.record_bypass()
+
+    if pending:
+        batch = [questions[indexes[0]] for indexes in pending.values()]
+        print(f"--- Batch of {len(questions)} questions, {len(batch)} sent upstream concurrently ---")
+        results = llm_runtime.run(
+            collect_many_async(batch, deadline_after(deadline_seconds), priority, context), cancelled=cancelled
+        )
+        for question, indexes, (answer, succeeded) in zip(batch, pending.values(), results):
+            if use_cache and succeeded:
+                answer_cache.store(question, answer, context)
+            for index in indexes:
+                answers[index] = answer
+    return answers
+
+
+def breaker_stats() -> dict:
+    """各副本的熔断器状态与 /chat/start 重试统计 (供监控接口使用)"""
+    snapshot = dict(retry_stats)
+    snapshot["replicas"] = [replica.breaker.snapshot() for replica in upstream_pool.replicas]
+    return snapshot
+
+
+def warm_pool_stats() -> dict:
+    """预热会话池统计 (供监控接口使用)"""
+    return warm_pool.snapshot()
+
+
+def upstream_stats() -> list:
+    """各副本的健康状态、在途会话数和延迟估计 (供监控接口使用)"""
+    return upstream_pool.snapshot()
+
+
+def session_stats() -> dict:
+    """上游会话的放弃、停止通知、断线重连统计 (供监控接口使用)"""
+    return dict(session_counters)
+
+
+def bulkhead_stats() -> dict:
+    """上游并发与排队统计 (供监控接口使用)"""
+    return upstream_bulkhead.snapshot()
+
+
+def single_flight_stats() -> dict:
+    """请求合并统计 (供监控接口使用)"""
+    return single_flight.flight_stats(_inflight)
+
+
+# --- 流式同步包装器 (供 SSE 接口使用) ---
+def iter_dynamic_response(question: str, deadline_seconds: float = None, heartbeat: float = None,
+                          priority: str = PRIORITY_INTERACTIVE, context: dict = None):
+    """
+    同步生成器：每收到一帧就立即交给调用方 (Flask 的流式响应)。
+    heartbeat 秒内没有新帧时产出 None，调用方可借此写出心跳以发现断开的客户端；
+    关闭生成器即关闭上游会话。
+    """
+    return llm_runtime.iterate(
+        stream_dynamic_response_async(question, deadline_after(deadline_seconds), priority, context), heartbeat=heartbeat
+    )
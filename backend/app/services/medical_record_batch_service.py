@@ -0,0 +1,189 @@
+# backend/app/services/medical_record_batch_service.py
+"""
+批量生成病历 (交接班时为大量病人重新生成病历，见 manage.py 中的 flask medical-records generate)。
+
+concurrency 个 worker 线程从同一个病人队列中领取任务，每个线程调用 generate_medical_record_from_history，
+因此同时占用的上游名额不超过 concurrency (并且仍然按后台优先级经过 bulkhead)。
+每个线程积累 batch_size 份病历后提交一次，提交成功后才把这些病人写入检查点文件；
+中断后重新运行会跳过检查点中已完成的病人 (未提交的病历会重新生成，输入未变化的病人会直接复用指纹相同的病历)。
+"""
+
+import json
+import math
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+
+from ..core.extensions import db
+from ..models.user_model import UserModel
+from ..models.consultation_model import AIConsultationModel, ChatMessageModel
+from .history_service import generate_medical_record_from_history
+from .bulkhead import UpstreamBusyError
+
+# 上游繁忙时单个病人最多重试的次数
+BUSY_MAX_RETRIES = 5
+
+
+def select_patients(patient_ids=None, active_since_hours=None):
+    """
+    要生成病历的病人 ID (升序)：指定了 patient_ids 时只取其中存在的病人，
+    否则取所有病人；active_since_hours 限定为最近 N 小时内有 AI 问诊消息的病人。
+    """
+    query = db.session.query(UserModel.id).filter(UserModel.role == 'patient')
+    if patient_ids:
+        query = query.filter(UserModel.id.in_(patient_ids))
+    if active_since_hours:
+        since = datetime.utcnow() - timedelta(hours=active_since_hours)
+        active = db.session.query(AIConsultationModel.patient_id).join(
+            ChatMessageModel, ChatMessageModel.consultation_id == AIConsultationModel.id
+        ).filter(ChatMessageModel.timestamp >= since)
+        query = query.filter(UserModel.id.in_(active))
+    return [patient_id for (patient_id,) in query.order_by(UserModel.id)]
+
+
+def load_checkpoint(path):
+    """读取检查点中已完成的病人 ID，文件不存在时返回空集合"""
+    if not path or not os.path.exists(path):
+        return set()
+    with open(path, encoding="utf-8") as f:
+        return set(json.load(f).get("done", []))
+
+
+def _save_checkpoint(path, done):
+    """先写临时文件再替换，避免中断时留下半个检查点"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"done": sorted(done), "updated_at": datetime.utcnow().isoformat()}, f)
+    os.replace(tmp_path, path)
+
+
+def _latency_summary(samples):
+    latencies = sorted(samples)
+    if not latencies:
+        return {"latency_ms_avg": 0.0, "latency_ms_p50": 0.0, "latency_ms_p95": 0.0, "latency_ms_max": 0.0}
+    return {
+        "latency_ms_avg": round(sum(latencies) / len(latencies) * 1000, 1),
+        "latency_ms_p50": round(latencies[math.ceil(len(latencies) * 0.5) - 1] * 1000, 1),
+        "latency_ms_p95": round(latencies[math.ceil(len(latencies) * 0.95) - 1] * 1000, 1),
+        "latency_ms_max": round(latencies[-1] * 1000, 1),
+    }
+
+
+class _BatchRun:
+    def __init__(self, app, patient_ids, batch_size, checkpoint_path, done, log):
+        self.app = app
+        self.batch_size = max(batch_size, 1)
+        self.checkpoint_path = checkpoint_path
+        self.done = done
+        self.log = log
+        self.pending = queue.Queue()
+        for patient_id in patient_ids:
+            self.pending.put(patient_id)
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.succeeded = 0
+        self.failed = 0
+        self.lost = 0
+        self.busy_retries = 0
+
+    def _generate(self, patient_id):
+        """生成单个病人的病历 (上游繁忙时等待后重试)，返回是否成功"""
+        for attempt in range(BUSY_MAX_RETRIES + 1):
+            try:
+                return generate_medical_record_from_history(patient_id, commit=False) is not None
+            except UpstreamBusyError as e:
+                if attempt == BUSY_MAX_RETRIES:
+                    raise
+                with self.lock:
+                    self.busy_retries += 1
+                time.sleep(e.retry_after)
+
+    def _commit(self, batch):
+        """提交本线程积累的病历，成功后记入检查点"""
+        if not batch:
+            return
+        db.session.commit()
+        with self.lock:
+            self.done.update(batch)
+            self.succeeded += len(batch)
+            if self.checkpoint_path:
+                _save_checkpoint(self.checkpoint_path, self.done)
+        self.log(f"committed {len(batch)} records ({len(self.done)} patients done)")
+        batch.clear()
+
+    def worker(self):
+        batch = []
+        with self.app.app_context():
+            try:
+                while True:
+                    try:
+                        patient_id = self.pending.get_nowait()
+                    except queue.Empty:
+                        break
+                    started = time.monotonic()
+                    try:
+                        ok = self._generate(patient_id)
+                    except Exception as e:
+                        print(f"medical-record-batch: patient {patient_id} failed: {e}")
+                        db.session.rollback()
+                        ok = False
+                    with self.lock:
+                        self.latencies.append(time.monotonic() - started)
+                    if not db.session().in_transaction() and batch:
+                        # 出错回滚时 (包括 generate_medical_record_from_history 保存失败) 本批未提交的病历随之丢失，
+                        # 这些病人不写入检查点，重新运行时会再次生成
+                        with self.lock:
+                            self.lost += len(batch)
+                        batch.clear()
+                    if ok:
+                        batch.append(patient_id)
+                    else:
+                        with self.lock:
+                            self.failed += 1
+                    if len(batch) >= self.batch_size:
+                        self._commit(batch)
+                self._commit(batch)
+            finally:
+                db.session.rollback()
+                db.session.remove()
+
+
+def run_batch(app, patient_ids, concurrency=4, batch_size=20, checkpoint_path=None, log=print):
+    """
+    为 patient_ids 批量生成病历，返回统计信息字典。
+    检查点中已完成的病人会被跳过；需要全部重新生成时删除检查点文件即可。
+    """
+    done = load_checkpoint(checkpoint_path)
+    todo = [patient_id for patient_id in patient_ids if patient_id not in done]
+    run = _BatchRun(app, todo, batch_size, checkpoint_path, done, log)
+    log(f"generating medical records for {len(todo)} patients "
+        f"({len(patient_ids) - len(todo)} skipped by checkpoint, concurrency={concurrency}, batch_size={batch_size})")
+
+    started = time.monotonic()
+    threads = [
+        threading.Thread(target=run.worker, name=f"medical-record-batch-{i}", daemon=True)
+        for i in range(max(min(concurrency, len(todo)), 1))
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    stats = {
+        "patients": len(patient_ids),
+        "skipped": len(patient_ids) - len(todo),
+        "succeeded": run.succeeded,
+        "failed": run.failed,
+        "lost": run.lost,
+        "busy_retries": run.busy_retries,
+        "elapsed_seconds": round(elapsed, 2),
+        "throughput_per_minute": round(run.succeeded / elapsed * 60, 2) if elapsed > 0 else 0.0,
+    }
+    stats.update(_latency_summary(run.latencies))
+    return stats
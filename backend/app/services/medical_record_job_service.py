@@ -0,0 +1,151 @@
+# backend/app/services/medical_record_job_service.py
+"""
+异步病历生成任务：POST /api/chat/medical/record 只负责入队并立即返回 202，
+由后台 worker 调用 generate_medical_record_from_history 生成病历，并把生成的病历关联到任务上。
+病历生成使用独立的 worker 数 (MEDICAL_RECORD_JOB_WORKERS)，与问答任务分开配置。
+
+可选的预生成 (MEDICAL_RECORD_PREGENERATE_TURNS > 0)：问诊中每新增 N 轮问答，自动入队一个预生成任务，
+用户打开病历页时病历通常已经生成好 (见 generate_medical_record_from_history 的指纹复用)。
+预生成按用户限频 (MEDICAL_RECORD_PREGENERATE_INTERVAL_SECONDS)，并让位于交互请求：
+上游有请求在排队或容量已满时直接放弃，不重试。
+"""
+
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from ..core.extensions import db
+from ..models.medical_record_model import MedicalRecordJobModel
+from .history_service import generate_medical_record_from_history, turns_since_last_medical_record
+from .bulkhead import UpstreamBusyError, upstream_bulkhead
+from .job_queue import (
+    JobWorkerPool, RetryJobLater, finish_claimed_job,
+    JOB_QUEUED, JOB_RUNNING, JOB_SUCCEEDED, JOB_FAILED, JOB_CANCELLED
+)
+
+_pool = None
+
+
+def _upstream_contended():
+    """上游是否有请求在排队或并发已满 (只读计数，可以在 worker 线程中调用)"""
+    return upstream_bulkhead.queued > 0 or upstream_bulkhead.active >= upstream_bulkhead.max_concurrent
+
+
+def _yield_to_interactive(job_id, attempts):
+    """
+    预生成任务让位于交互请求：放弃本次预生成，返回是否已放弃 (用户已在等待的任务不放弃)。
+    任务已被其他 worker 重新领取时不改动任务，本 worker 同样停止执行。
+    """
+    db.session.rollback()
+    job = db.session.get(MedicalRecordJobModel, job_id)
+    if not job.speculative:
+        return False
+    if finish_claimed_job(MedicalRecordJobModel, job_id, attempts, JOB_CANCELLED, error='上游繁忙，已放弃预生成'):
+        print(f"medical-record-job: speculative job {job_id} skipped, upstream is busy")
+    else:
+        print(f"medical-record-job: job {job_id} was re-claimed by another worker")
+    return True
+
+
+def _run_medical_record_job(job):
+    """
+    worker 中执行单个病历生成任务。
+    写回时以领取时的 attempts 确认任务仍属于本 worker：LLM 调用期间租约过期、任务被另一个 worker 重新领取时，
+    回滚本 worker 生成的病历，避免同一任务生成两份病历并互相覆盖任务状态。
+    """
+    job_id, attempts, patient_id = job.id, job.attempts, job.patient_id
+    # 结束领取任务的事务，避免在长时间的 LLM 调用期间占用数据库连接
+    db.session.commit()
+
+    if job.speculative and _upstream_contended() and _yield_to_interactive(job_id, attempts):
+        return
+    try:
+        record = generate_medical_record_from_history(patient_id, commit=False)
+    except UpstreamBusyError as e:
+        if _yield_to_interactive(job_id, attempts):
+            return
+        raise RetryJobLater(e.retry_after)
+
+    if record is None:
+        finish_claimed_job(MedicalRecordJobModel, job_id, attempts, JOB_FAILED, error='无足够的问诊记录生成病历')
+    # 病历与任务状态在同一事务中提交
+    elif not finish_claimed_job(MedicalRecordJobModel, job_id, attempts, JOB_SUCCEEDED, medical_record_id=int(record["id"])):
+        print(f"medical-record-job: job {job_id} was cancelled or re-claimed by another worker, record discarded")
+
+
+def _get_pool(app=None):
+    global _pool
+    if _pool is None:
+        config = (app or current_app).config
+        _pool = JobWorkerPool(
+            'medical-record-job',
+            MedicalRecordJobModel,
+            _run_medical_record_job,
+            workers=config.get('MEDICAL_RECORD_JOB_WORKERS', 0),
+            lease_seconds=config.get('MEDICAL_RECORD_JOB_LEASE_SECONDS', 300),
+            max_attempts=config.get('MEDICAL_RECORD_JOB_MAX_ATTEMPTS', 3)
+        )
+    return _pool
+
+
+def start_medical_record_job_workers(app):
+    """启动本进程的病历生成 worker (幂等)"""
+    _get_pool(app).start(app)
+
+
+def enqueue_medical_record_job(user_id, speculative=False):
+    """
+    创建一个排队中的病历生成任务并唤醒 worker。
+    同一用户已有未结束的任务时直接返回该任务，避免重复点击生成多份病历；
+    用户主动请求时，未结束的预生成任务转为普通任务 (不再因上游繁忙而放弃)。
+    """
+    job = MedicalRecordJobModel.query.filter(
+        MedicalRecordJobModel.patient_id == user_id,
+        MedicalRecordJobModel.status.in_((JOB_QUEUED, JOB_RUNNING))
+    ).order_by(MedicalRecordJobModel.id.desc()).first()
+    if job is not None:
+        if job.speculative and not speculative:
+            job.speculative = False
+            db.session.commit()
+        return job
+    job = MedicalRecordJobModel(patient_id=user_id, status=JOB_QUEUED, speculative=speculative)
+    db.session.add(job)
+    db.session.commit()
+    _get_pool().notify()
+    return job
+
+
+def maybe_pregenerate_medical_record(user_id):
+    """
+    新问答写入后调用：距上一份病历已新增 MEDICAL_RECORD_PREGENERATE_TURNS 轮问答，
+    且该用户在限频间隔内没有创建过病历任务时，入队一个预生成任务。返回入队的任务或 None。
+    预生成只是优化，任何错误都不影响问答本身。
+    """
+    config = current_app.config
+    every_turns = config.get('MEDICAL_RECORD_PREGENERATE_TURNS', 0)
+    if every_turns <= 0:
+        return None
+    try:
+        since = datetime.utcnow() - timedelta(seconds=config.get('MEDICAL_RECORD_PREGENERATE_INTERVAL_SECONDS', 600))
+        recent_job = MedicalRecordJobModel.query.filter(
+            MedicalRecordJobModel.patient_id == user_id,
+            MedicalRecordJobModel.created_at >= since
+        ).first()
+        if recent_job is not None or turns_since_last_medical_record(user_id) < every_turns:
+            return None
+        print(f"--- medical-record-job: pre-generating medical record for user {user_id} ---")
+        return enqueue_medical_record_job(user_id, speculative=True)
+    except Exception as e:
+        print(f"maybe_pregenerate_medical_record: failed for user {user_id}: {e}")
+        db.session.rollback()
+        return None
+
+
+def get_medical_record_job(user_id, job_id):
+    """获取任务，同时验证任务是否属于该用户"""
+    return MedicalRecordJobModel.query.filter_by(id=job_id, patient_id=user_id).first()
+
+
+def process_next_medical_record_job():
+    """在当前线程中领取并执行一条任务 (测试或运维脚本使用)，返回是否执行了任务"""
+    return _get_pool().process_next()
@@ -0,0 +1,234 @@
+# backend/app/services/single_flight.py
+"""
+相同问题的并发请求合并 (single-flight)。
+
+进程内：同一个键同时只有一个线程 (leader) 真正调用上游，其他线程等待并共享它的结果。
+跨进程 (可选，LLM_SINGLEFLIGHT_DB=1)：leader 在 llm_request_leases 表中持有一行租约，
+其他 gunicorn worker 轮询这一行，变为 done 后直接读取 answer；
+leader 没有拿到成功的回答时删除租约行，租约过期 (持有者崩溃) 后同样由下一个 worker 接手。
+"""
+
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+
+# --- 配置 ---
+LLM_SINGLEFLIGHT_DB = os.environ.get("LLM_SINGLEFLIGHT_DB", "0") == "1"
+# 租约时长需大于一次上游会话的最长耗时
+LLM_LEASE_SECONDS = int(os.environ.get("LLM_LEASE_SECONDS", "150"))
+# leader 完成后结果在租约行中保留的时间，供仍在轮询的 worker 读取
+LLM_LEASE_RESULT_TTL_SECONDS = int(os.environ.get("LLM_LEASE_RESULT_TTL_SECONDS", "10"))
+LLM_LEASE_POLL_INTERVAL = float(os.environ.get("LLM_LEASE_POLL_INTERVAL", "0.5"))
+
+
+class FlightStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+        self.remote_waits = 0
+        self.remote_shared = 0
+
+    def incr(self, field):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "remote_waits": self.remote_waits,
+                "remote_shared": self.remote_shared,
+            }
+
+
+stats = FlightStats()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """进程内的请求合并：do(key, fn) 对同一个 key 同时只执行一次 fn"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+            else:
+                call.followers += 1
+
+        if not leader:
+            stats.incr("coalesced")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        stats.incr("leaders")
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def followers(self, key):
+        """正在等待 key 的 leader 结果的请求数"""
+        with self._lock:
+            call = self._calls.get(key)
+            return call.followers if call is not None else 0
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+
+# --- 跨 worker 的数据库租约 ---
+
+def _owner_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+def _table():
+    from ..models.answer_cache_model import LLMRequestLeaseModel
+    return LLMRequestLeaseModel.__table__
+
+
+def _engine():
+    from ..core.extensions import db
+    return db.engine
+
+
+def _try_insert(key, owner, now):
+    table = _table()
+    try:
+        with _engine().begin() as conn:
+            conn.execute(table.insert().values(
+                request_key=key, owner=owner, status='running', answer=None,
+                expires_at=now + timedelta(seconds=LLM_LEASE_SECONDS), created_at=now
+            ))
+        return True
+    except IntegrityError:
+        return False
+
+
+def acquire_lease(key, owner):
+    """
+    尝试成为 leader。返回:
+        ('leader', None)   获得租约，调用方负责调用上游并 complete_lease
+        ('done', answer)   其他 worker 刚刚完成，可直接使用结果
+        ('wait', None)     其他 worker 正在执行
+    """
+    table = _table()
+    now = datetime.utcnow()
+    with _engine().begin() as conn:
+        row = conn.execute(
+            select(table.c.id, table.c.status, table.c.answer, table.c.expires_at)
+            .where(table.c.request_key == key)
+        ).first()
+        if row is not None and row.expires_at >= now:
+            if row.status == 'done':
+                return 'done', row.answer
+            return 'wait', None
+        if row is not None:
+            # 租约已过期：持有者可能已崩溃，使用条件更新接手
+            taken = conn.execute(
+                update(table).where(table.c.id == row.id, table.c.expires_at == row.expires_at)
+                .values(owner=owner, status='running', answer=None, created_at=now,
+                        expires_at=now + timedelta(seconds=LLM_LEASE_SECONDS))
+            )
+            return ('leader', None) if taken.rowcount == 1 else ('wait', None)
+    return ('leader', None) if _try_insert(key, owner, now) else ('wait', None)
+
+
+def complete_lease(key, owner, answer):
+    """leader 写入结果，结果保留 LLM_LEASE_RESULT_TTL_SECONDS 供等待者读取"""
+    table = _table()
+    with _engine().begin() as conn:
+        conn.execute(
+            update(table).where(table.c.request_key == key, table.c.owner == owner)
+            .values(status='done', answer=answer,
+                    expires_at=datetime.utcnow() + timedelta(seconds=LLM_LEASE_RESULT_TTL_SECONDS))
+        )
+        # 顺带清理早已过期的租约行
+        conn.execute(delete(table).where(table.c.expires_at < datetime.utcnow() - timedelta(seconds=LLM_LEASE_SECONDS)))
+
+
+def release_lease(key, owner):
+    """leader 执行失败时释放租约，让等待者自行重试"""
+    table = _table()
+    with _engine().begin() as conn:
+        conn.execute(delete(table).where(table.c.request_key == key, table.c.owner == owner))
+
+
+def run_with_lease(key, fn, publish=None):
+    """
+    跨 worker 合并：拿到租约就执行 fn()，否则等待持有者的结果。
+    publish(answer) 返回 False 时 (例如超时、出错的回答) 不写入结果而是释放租约，
+    等待者随后自行接手调用上游，而不是把失败的回答当成自己的结果。
+    数据库不可用 (例如不在 app context 中) 时直接执行 fn()。
+    """
+    owner = _owner_id()
+    give_up_at = time.monotonic() + LLM_LEASE_SECONDS
+    waited = False
+    while True:
+        try:
+            state, answer = acquire_lease(key, owner)
+        except Exception as e:
+            print(f"single_flight: lease unavailable, calling upstream directly: {e}")
+            return fn()
+
+        if state == 'done':
+            if waited:
+                stats.incr("remote_shared")
+            return answer
+        if state == 'leader':
+            try:
+                answer = fn()
+            except BaseException:
+                release_lease(key, owner)
+                raise
+            if publish is None or publish(answer):
+                complete_lease(key, owner, answer)
+            else:
+                release_lease(key, owner)
+            return answer
+
+        if not waited:
+            stats.incr("remote_waits")
+            waited = True
+        if time.monotonic() > give_up_at:
+            print(f"single_flight: gave up waiting for lease {key[:8]}, calling upstream directly")
+            return fn()
+        time.sleep(LLM_LEASE_POLL_INTERVAL)
+
+
+def flight_stats(flight=None):
+    snapshot = stats.snapshot()
+    snapshot["cross_worker"] = LLM_SINGLEFLIGHT_DB
+    if flight is not None:
+        snapshot["in_flight"] = flight.in_flight()
+    return snapshot
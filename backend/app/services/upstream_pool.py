@@ -0,0 +1,144 @@
+# backend/app/services/upstream_pool.py
+"""
+多个 FastAPI 代理副本之间的客户端负载均衡。
+
+FASTAPI_BASE_URLS 配置逗号分隔的副本地址 (未配置时退回单个 FASTAPI_BASE_URL)。
+每个会话按"最少在途会话 × 延迟"选择副本：score = (outstanding + 1) * latency_ewma，
+同一会话的 /chat/start、WebSocket (含重连) 和停止通知都固定发往签发 session_id 的副本。
+每个副本有独立的熔断器；配置了多个副本时，后台定期探测 /health，探测失败的副本暂时不参与选择。
+"""
+
+import asyncio
+import os
+import random
+import time
+
+from . import llm_runtime
+from .circuit_breaker import (
+    CircuitBreaker, CircuitOpenError, OPEN, CLOSED,
+    LLM_BREAKER_FAILURE_THRESHOLD, LLM_BREAKER_RECOVERY_SECONDS
+)
+
+# --- 配置 ---
+FASTAPI_BASE_URLS = [
+    url.strip().rstrip("/")
+    for url in os.environ.get("FASTAPI_BASE_URLS", os.environ.get("FASTAPI_BASE_URL", "http://localhost:8000")).split(",")
+    if url.strip()
+]
+LLM_HEALTH_PATH = os.environ.get("LLM_HEALTH_PATH", "/health")
+LLM_HEALTH_INTERVAL = float(os.environ.get("LLM_HEALTH_INTERVAL", "10"))
+# 延迟的指数移动平均系数，以及没有样本时的初始估计(秒)
+LATENCY_EWMA_ALPHA = 0.3
+INITIAL_LATENCY = 0.5
+
+
+class Replica:
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.breaker = CircuitBreaker(base_url, LLM_BREAKER_FAILURE_THRESHOLD, LLM_BREAKER_RECOVERY_SECONDS)
+        self.outstanding = 0
+        self.latency = INITIAL_LATENCY
+        self.healthy = True
+        self.sessions = 0
+        self.last_probe_at = None
+
+    def observe_latency(self, seconds):
+        self.latency = LATENCY_EWMA_ALPHA * seconds + (1 - LATENCY_EWMA_ALPHA) * self.latency
+
+    def score(self):
+        return (self.outstanding + 1) * self.latency
+
+    def snapshot(self):
+        return {
+            "base_url": self.base_url,
+            "healthy": self.healthy,
+            "breaker": self.breaker.state,
+            "outstanding": self.outstanding,
+            "sessions": self.sessions,
+            "latency_ms": round(self.latency * 1000, 1),
+        }
+
+
+class UpstreamPool:
+    """所有方法都在 llm_runtime 的事件循环线程上调用 (snapshot 除外)"""
+
+    def __init__(self, base_urls):
+        self.replicas = [Replica(url) for url in base_urls]
+        self._probe_task = None
+
+    def check_available(self):
+        """进入排队之前调用：所有副本都在熔断中时立即抛出 CircuitOpenError"""
+        breakers = [replica.breaker.snapshot() for replica in self.replicas]
+        if all(breaker["state"] == OPEN for breaker in breakers):
+            raise CircuitOpenError("AI 服务暂时不可用，请稍后重试", min(b["retry_after"] for b in breakers))
+
+    def pick(self, closed_only=False):
+        """
+        为新会话选择一个副本 (已通过该副本熔断器的 before_call)。
+        closed_only=True 时只选择熔断器关闭的副本 (预热会话使用)，不占用半开副本唯一的探测名额。
+        """
+        self._ensure_probing()
+        if closed_only:
+            candidates = [r for r in self.replicas if r.breaker.state == CLOSED]
+            if not candidates:
+                raise CircuitOpenError("没有熔断器关闭的副本", LLM_BREAKER_RECOVERY_SECONDS)
+            healthy = [r for r in candidates if r.healthy]
+            return min(healthy or candidates, key=lambda r: (r.score(), random.random()))
+        candidates = [r for r in self.replicas if r.healthy and r.breaker.state != OPEN]
+        if not candidates:
+            # 健康探测可能误判，全部不健康时仍尝试未熔断的副本
+            candidates = [r for r in self.replicas if r.breaker.state != OPEN] or self.replicas
+        ranked = sorted(candidates, key=lambda r: (r.score(), random.random()))
+        error = None
+        for replica in ranked:
+            try:
+                replica.breaker.before_call()
+                return replica
+            except CircuitOpenError as e:
+                # 半开状态下已有探测请求在进行，换下一个副本
+                error = e
+        raise error
+
+    def acquire(self, replica, new_session=True):
+        """计入副本的在途负载；使用预热会话时 new_session=False (会话在预热时已经计数)"""
+        replica.outstanding += 1
+        if new_session:
+            replica.sessions += 1
+
+    def release(self, replica):
+        replica.outstanding -= 1
+
+    def _ensure_probing(self):
+        if len(self.replicas) < 2 or not LLM_HEALTH_PATH:
+            return
+        loop = asyncio.get_running_loop()
+        # fork 之后子进程有新的事件循环，旧循环上的任务不会再运行
+        if self._probe_task is None or self._probe_task.done() or self._probe_task.get_loop() is not loop:
+            self._probe_task = loop.create_task(self._probe_forever())
+
+    async def _probe_forever(self):
+        while True:
+            await asyncio.gather(*(self.probe(replica) for replica in self.replicas))
+            await asyncio.sleep(LLM_HEALTH_INTERVAL)
+
+    async def probe(self, replica):
+        """探测一次副本：能返回非 5xx 响应即视为存活 (没有 /health 接口的副本返回 404 也算存活)"""
+        started = time.monotonic()
+        try:
+            response = await llm_runtime.http_get(replica.base_url + LLM_HEALTH_PATH, timeout=5)
+            healthy = response.status_code < 500
+        except Exception as e:
+            print(f"upstream_pool: health probe failed for {replica.base_url}: {e}")
+            healthy = False
+        if healthy:
+            replica.observe_latency(time.monotonic() - started)
+        if healthy != replica.healthy:
+            print(f"--- upstream_pool: {replica.base_url} is now {'healthy' if healthy else 'unhealthy'} ---")
+        replica.healthy = healthy
+        replica.last_probe_at = time.time()
+
+    def snapshot(self):
+        return [replica.snapshot() for replica in self.replicas]
+
+
+upstream_pool = UpstreamPool(FASTAPI_BASE_URLS)
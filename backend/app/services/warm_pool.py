@@ -0,0 +1,195 @@
+# backend/app/services/warm_pool.py
+"""
+预热的上游会话池 (可选，LLM_WARM_POOL_SIZE > 0 时启用)。
+
+普通会话要先 POST /chat/start 再完成 WebSocket 握手，然后才开始推理。
+预热池在后台提前创建好会话并打开 WebSocket，问答到来时直接把问题通过 WebSocket 发给一个现成的会话，
+省掉这两次往返。空闲超过 LLM_WARM_IDLE_SECONDS 的会话会被关闭丢弃，并在后台补充。
+预热会话只在熔断器关闭的副本上创建 (不占用半开副本的探测名额)，并且在池中等待期间也计入副本的在途负载。
+
+依赖 FastAPI 端支持"延迟提问"协议：
+    POST /api/v1/chat/start  {"deferred": true}         -> {"session_id": ...}
+    WebSocket 上发送            {"type": "question", "question": ..., "context": ...}
+FastAPI 端不支持时请保持关闭 (默认)。
+"""
+
+import asyncio
+import json
+import os
+import time
+from collections import deque
+
+import websockets
+
+from . import llm_runtime
+from .upstream_pool import upstream_pool
+
+# --- 配置 ---
+LLM_WARM_POOL_SIZE = int(os.environ.get("LLM_WARM_POOL_SIZE", "0"))
+LLM_WARM_IDLE_SECONDS = float(os.environ.get("LLM_WARM_IDLE_SECONDS", "60"))
+# 补充失败后的等待时间(秒)，避免上游故障时不停重试
+REFILL_ERROR_BACKOFF = 5.0
+
+
+class WarmSession:
+    def __init__(self, replica, session_id, websocket):
+        self.replica = replica
+        self.session_id = session_id
+        self.websocket = websocket
+        self.created_at = time.monotonic()
+
+    def expired(self, idle_seconds):
+        return time.monotonic() - self.created_at > idle_seconds
+
+
+class WarmSessionPool:
+    """所有方法都在 llm_runtime 的事件循环线程上调用 (snapshot 除外)"""
+
+    def __init__(self, size, idle_seconds):
+        self.size = size
+        self.idle_seconds = idle_seconds
+        self._sessions = deque()
+        self._creating = 0
+        self._refill_task = None
+        self._wake = None
+        # 统计
+        self.hits = 0
+        self.misses = 0
+        self.created = 0
+        self.expired = 0
+        self.failed = 0
+
+    @property
+    def enabled(self):
+        return self.size > 0
+
+    async def take(self, question, context=None):
+        """
+        取出一个预热会话并把问题 (及问诊上下文) 发给它；成功返回 WarmSession，没有可用会话时返回 None (调用方走普通流程)。
+        """
+        if not self.enabled:
+            return None
+        self._ensure_refilling()
+        try:
+            while self._sessions:
+                warm = self._sessions.popleft()
+                if warm.expired(self.idle_seconds) or warm.replica.breaker.state == 'open':
+                    self.expired += 1
+                    await self._discard(warm)
+                    continue
+                try:
+                    message = {"type": "question", "question": question}
+                    if context:
+                        message["context"] = context
+                    await warm.websocket.send(json.dumps(message, ensure_ascii=False))
+                except Exception as e:
+                    # 会话在空闲期间已被上游关闭
+                    print(f"warm_pool: session {warm.session_id} is no longer usable: {e}")
+                    self.expired += 1
+                    await self._discard(warm)
+                    continue
+                self.hits += 1
+                # 交给调用方后由调用方计入在途负载 (见 llm_service.stream_dynamic_response_async)
+                upstream_pool.release(warm.replica)
+                return warm
+            self.misses += 1
+            return None
+        finally:
+            self._wake.set()
+
+    async def _discard(self, warm):
+        upstream_pool.release(warm.replica)
+        try:
+            await warm.websocket.close()
+        except Exception:
+            pass
+
+    def _ensure_refilling(self):
+        loop = asyncio.get_running_loop()
+        # fork 之后子进程有新的事件循环，旧循环上的任务不会再运行
+        if self._refill_task is None or self._refill_task.done() or self._refill_task.get_loop() is not loop:
+            while self._sessions:
+                upstream_pool.release(self._sessions.popleft().replica)
+            self._wake = asyncio.Event()
+            self._refill_task = loop.create_task(self._refill_forever())
+
+    async def _refill_forever(self):
+        while True:
+            self._wake.clear()
+            # 丢弃空闲过久的会话
+            fresh = deque()
+            while self._sessions:
+                warm = self._sessions.popleft()
+                if warm.expired(self.idle_seconds):
+                    self.expired += 1
+                    await self._discard(warm)
+                else:
+                    fresh.append(warm)
+            self._sessions.extend(fresh)
+
+            missing = self.size - len(self._sessions) - self._creating
+            results = await asyncio.gather(*(self._create() for _ in range(max(missing, 0))))
+            if not all(results):
+                await asyncio.sleep(REFILL_ERROR_BACKOFF)
+                continue
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=max(self.idle_seconds / 2, 1))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _create(self):
+        """创建一个延迟提问的会话并打开 WebSocket，返回是否成功"""
+        from .llm_service import _build_ws_url
+        self._creating += 1
+        replica = None
+        created = False
+        try:
+            replica = upstream_pool.pick(closed_only=True)
+            upstream_pool.acquire(replica)
+            response = await llm_runtime.http_post(
+                f"{replica.base_url}/api/v1/chat/start", json={"deferred": True}, timeout=10
+            )
+            response.raise_for_status()
+            session_id = response.json().get("session_id")
+            if not session_id:
+                raise ValueError("Failed to get session_id from FastAPI")
+            websocket = await websockets.connect(_build_ws_url(session_id, replica.base_url), open_timeout=10)
+            replica.breaker.record_success()
+            self._sessions.append(WarmSession(replica, session_id, websocket))
+            created = True
+            self.created += 1
+            return True
+        except Exception as e:
+            self.failed += 1
+            if replica is not None:
+                replica.breaker.record_failure(e)
+            print(f"warm_pool: failed to pre-create a session: {e}")
+            return False
+        finally:
+            self._creating -= 1
+            # 创建失败或被取消时退回预占的在途负载
+            if replica is not None and not created:
+                upstream_pool.release(replica)
+
+    async def close(self):
+        """停止后台补充并关闭所有预热会话"""
+        if self._refill_task is not None:
+            self._refill_task.cancel()
+            self._refill_task = None
+        while self._sessions:
+            await self._discard(self._sessions.popleft())
+
+    def snapshot(self):
+        return {
+            "enabled": self.enabled,
+            "size": self.size,
+            "available": len(self._sessions),
+            "hits": self.hits,
+            "misses": self.misses,
+            "created": self.created,
+            "expired": self.expired,
+            "failed": self.failed,
+        }
+
+
+warm_pool = WarmSessionPool(LLM_WARM_POOL_SIZE, LLM_WARM_IDLE_SECONDS)
@@ -1,4 +1,5 @@
 import os
+import click
 # --- 核心修改：在所有其他导入之前，首先加载 .env 文件 ---
 from dotenv import load_dotenv
 load_dotenv()
@@ -6,6 +7,7 @@ load_dotenv()
 from app import create_app
 from app.core.extensions import db
 from app.models import user_model, consultation_model, appointment_model, review_model
+from app.services import medical_record_batch_service
 
 # 根据环境变量创建 app, 默认为 'default' (开发环境)
 app = create_app(os.getenv('FLASK_CONFIG') or 'default')
@@ -21,4 +23,45 @@ def make_shell_context():
         ChatMessageModel=consultation_model.ChatMessageModel,
         AppointmentModel=appointment_model.AppointmentModel,
         DoctorReviewModel=review_model.DoctorReviewModel
-    )
\ No newline at end of file
+    )
+
+@app.cli.group('medical-records')
+def medical_records_cli():
+    """病历相关的运维命令"""
+
+
+@medical_records_cli.command('generate')
+@click.option('--patient-id', 'patient_ids', type=int, multiple=True, help='只为指定病人生成 (可重复)')
+@click.option('--patients-file', type=click.File('r'), help='病人 ID 列表文件，每行一个')
+@click.option('--active-since', 'active_since_hours', type=float, help='只处理最近 N 小时内有 AI 问诊的病人')
+@click.option('--concurrency', type=int, default=4, show_default=True, help='同时生成的病人数 (占用的上游名额上限)')
+@click.option('--batch-size', type=int, default=20, show_default=True, help='每个线程积累多少份病历提交一次')
+@click.option('--checkpoint', 'checkpoint_path', type=click.Path(dir_okay=False),
+              help='检查点文件，默认 instance/medical_record_batch.json')
+@click.option('--restart', is_flag=True, help='忽略已有检查点，从头开始')
+def generate_medical_records(patient_ids, patients_file, active_since_hours, concurrency, batch_size, checkpoint_path, restart):
+    """批量生成病历：有界并发、分批提交，中断后重新运行会从检查点继续"""
+    from flask import current_app
+    ids = list(patient_ids)
+    if patients_file:
+        ids.extend(int(line) for line in patients_file if line.strip())
+    patients = medical_record_batch_service.select_patients(ids or None, active_since_hours)
+    if ids and not patients:
+        raise click.ClickException('指定的病人都不存在')
+    checkpoint_path = checkpoint_path or os.path.join(current_app.instance_path, 'medical_record_batch.json')
+    if restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    stats = medical_record_batch_service.run_batch(
+        current_app._get_current_object(), patients,
+        concurrency=concurrency, batch_size=batch_size, checkpoint_path=checkpoint_path, log=click.echo
+    )
+    click.echo(
+        f"done: {stats['succeeded']} succeeded, {stats['failed']} failed, {stats['lost']} lost (rerun to retry), "
+        f"{stats['skipped']} skipped by checkpoint, {stats['busy_retries']} busy retries"
+    )
+    click.echo(
+        f"throughput: {stats['throughput_per_minute']} records/min over {stats['elapsed_seconds']}s; "
+        f"latency avg {stats['latency_ms_avg']}ms p50 {stats['latency_ms_p50']}ms "
+        f"p95 {stats['latency_ms_p95']}ms max {stats['latency_ms_max']}ms"
+    )
@@ -0,0 +1,65 @@
+"""Add per-patient composite indexes
+
+Revision ID: b9e1f3a5c7d2
+Revises: f2d4b6a8c1e3
+Create Date: 2026-10-18 22:02:41.870156
+
+"""
+from alembic import op, context
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b9e1f3a5c7d2'
+down_revision = 'f2d4b6a8c1e3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    _create_composite_index('ai_consultations', 'patient_id', 'ix_ai_consultations_patient_id_created_at', ['patient_id', 'created_at'])
+    _create_composite_index('appointments', 'patient_id', 'ix_appointments_patient_id_status_appointment_time', ['patient_id', 'status', 'appointment_time'])
+    _create_composite_index('chat_messages', 'consultation_id', 'ix_chat_messages_consultation_id_timestamp', ['consultation_id', 'timestamp'])
+    _create_composite_index('doctor_consultations', 'patient_id', 'ix_doctor_consultations_patient_id_created_at', ['patient_id', 'created_at'])
+    _create_composite_index('medical_records', 'patient_id', 'ix_medical_records_patient_id_created_at', ['patient_id', 'created_at'])
+
+
+def _index_names(table):
+    """表上已有的索引名 (离线生成 SQL 时无法检查，视为没有)"""
+    if context.is_offline_mode():
+        return set()
+    return {index['name'] for index in sa.inspect(op.get_bind()).get_indexes(table)}
+
+
+def _create_composite_index(table, column, index_name, columns):
+    """
+    建立外键列开头的复合索引。之前的降级在外键列上补建的单列索引 (见 _drop_composite_index)
+    在复合索引建好后删除，升级后的索引与模型定义一致。
+    """
+    plain_index = f'ix_{table}_{column}'
+    existing = _index_names(table)
+    with op.batch_alter_table(table, schema=None) as batch_op:
+        batch_op.create_index(index_name, columns, unique=False)
+        if plain_index in existing:
+            batch_op.drop_index(plain_index)
+
+
+def _drop_composite_index(table, column, index_name):
+    """
+    删除外键列开头的复合索引。建立复合索引后 InnoDB 用它支撑外键 (并删除了原来的隐式索引)，
+    直接删除会报错 1553，因此先在外键列上建立单列索引。
+    """
+    plain_index = f'ix_{table}_{column}'
+    existing = _index_names(table)
+    with op.batch_alter_table(table, schema=None) as batch_op:
+        if plain_index not in existing:
+            batch_op.create_index(plain_index, [column], unique=False)
+        batch_op.drop_index(index_name)
+
+
+def downgrade():
+    _drop_composite_index('medical_records', 'patient_id', 'ix_medical_records_patient_id_created_at')
+    _drop_composite_index('doctor_consultations', 'patient_id', 'ix_doctor_consultations_patient_id_created_at')
+    _drop_composite_index('chat_messages', 'consultation_id', 'ix_chat_messages_consultation_id_timestamp')
+    _drop_composite_index('appointments', 'patient_id', 'ix_appointments_patient_id_status_appointment_time')
+    _drop_composite_index('ai_consultations', 'patient_id', 'ix_ai_consultations_patient_id_created_at')
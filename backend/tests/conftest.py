@@ -1,12 +1,17 @@
 import pytest
 from app import create_app # 从您的应用工厂导入 create_app
 from app.core.extensions import db
+from app.services import answer_cache, faq_index
 
 @pytest.fixture(scope='function')
 def test_app():
     """创建一个测试用的 Flask app 实例"""
     # 使用'testing'配置来创建app，例如使用一个独立的测试数据库
     app = create_app('testing') 
+    # 每个测试使用一个全新的进程内回答缓存，避免用例之间互相影响
+    answer_cache.configure_cache('memory')
+    # FAQ 索引默认不加载，需要的用例自行指定临时目录构建
+    faq_index.configure_index()
     
     # 'yield' 之前的代码是“准备”阶段
     with app.app_context():
@@ -0,0 +1,115 @@
+import pytest
+from datetime import datetime, timedelta
+
+from flask_jwt_extended import create_access_token
+
+from app.core.extensions import db
+from app.models.user_model import UserModel
+from app.models.answer_cache_model import AnswerCacheModel
+from app.services import answer_cache, llm_service
+from app.services.answer_cache import normalize_question, MemoryAnswerCache, DatabaseAnswerCache
+
+
+class FakeBuilder:
+    """模拟一次上游会话的结果"""
+    def __init__(self, answer, succeeded=True):
+        self._answer = answer
+        self.succeeded = succeeded
+
+    def result(self):
+        return self._answer
+
+
+@pytest.fixture(scope='function')
+def upstream_calls(monkeypatch):
+    """替换上游调用，记录实际发往上游的问题"""
+    calls = []
+
+    async def fake_collect(question, deadline=None, priority=None, context=None):
+        calls.append(question)
+        return FakeBuilder(f"回答{len(calls)}")
+
+    monkeypatch.setattr(llm_service, "collect_dynamic_response_async", fake_collect)
+    return calls
+
+# --- 归一化 ---
+
+def test_normalize_question_folds_width_punctuation_and_traditional():
+    """全角/半角、标点空白、繁简体都归一到同一个键"""
+    assert normalize_question("感冒发烧怎么办？") == normalize_question("感冒 發燒 怎麼辦?")
+    assert normalize_question("ＡＢＣ　１２３！") == "abc123"
+
+# --- 后端 ---
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = MemoryAnswerCache(max_size=2, ttl_seconds=60)
+    cache.set("a", "a", "A")
+    cache.set("b", "b", "B")
+    assert cache.get("a") == "A"  # a 变为最近使用
+    cache.set("c", "c", "C")
+    assert cache.get("b") is None
+    assert cache.get("a") == "A"
+
+def test_memory_cache_entries_expire():
+    cache = MemoryAnswerCache(max_size=2, ttl_seconds=-1)
+    cache.set("a", "a", "A")
+    assert cache.get("a") is None
+
+def test_database_cache_shares_entries_and_bounds_size(test_app):
+    with test_app.app_context():
+        cache = DatabaseAnswerCache(max_size=2, ttl_seconds=60)
+        cache.set("k1", "q1", "A1")
+        cache.set("k2", "q2", "A2")
+        assert cache.get("k1") == "A1"
+        cache.set("k3", "q3", "A3")
+
+        assert cache.size() == 2
+        assert cache.get("k2") is None
+        assert AnswerCacheModel.query.filter_by(cache_key="k1").first().hit_count == 1
+
+        AnswerCacheModel.query.filter_by(cache_key="k3").first().expires_at = datetime.utcnow() - timedelta(seconds=1)
+        db.session.commit()
+        assert cache.get("k3") is None
+
+# --- get_ai_response 集成 ---
+
+def test_get_ai_response_serves_normalized_repeat_from_cache(test_app, upstream_calls):
+    assert llm_service.get_ai_response("感冒发烧怎么办？") == "回答1"
+    assert llm_service.get_ai_response("感冒 發燒 怎麼辦") == "回答1"
+    assert upstream_calls == ["感冒发烧怎么办？"]
+    assert answer_cache.cache_stats()["hits"] == 1
+
+def test_get_ai_response_bypass_flag_skips_cache(test_app, upstream_calls):
+    llm_service.get_ai_response("头痛")
+    assert llm_service.get_ai_response("头痛", use_cache=False) == "回答2"
+    assert len(upstream_calls) == 2
+
+def test_failed_answers_are_not_cached(test_app, monkeypatch):
+    async def failing_collect(question, deadline=None, priority=None, context=None):
+        return FakeBuilder("无法连接到 AI 服务", succeeded=False)
+
+    monkeypatch.setattr(llm_service, "collect_dynamic_response_async", failing_collect)
+    llm_service.get_ai_response("咳嗽")
+    assert answer_cache.lookup("咳嗽") is None
+
+def metrics_headers(user_id, role):
+    """创建指定角色的用户并返回带 Token 的请求头"""
+    user = UserModel(id=user_id, username=f'{role}{user_id}', role=role)
+    user.set_password('password')
+    db.session.add(user)
+    db.session.commit()
+    return {'Authorization': f'Bearer {create_access_token(identity=str(user_id))}'}
+
+def test_llm_metrics_endpoint_exposes_cache_counters(test_client, test_app, upstream_calls):
+    llm_service.get_ai_response("胃痛")
+    llm_service.get_ai_response("胃痛")
+    response = test_client.get('/api/metrics/llm', headers=metrics_headers(1, 'doctor'))
+    assert response.status_code == 200
+    assert response.get_json()["cache"]["hits"] == 1
+    assert response.get_json()["cache"]["misses"] == 1
+
+def test_llm_metrics_endpoint_requires_doctor(test_client, test_app):
+    """未登录返回 401，病人账号返回 403"""
+    assert test_client.get('/api/metrics/llm').status_code == 401
+    response = test_client.get('/api/metrics/llm', headers=metrics_headers(2, 'patient'))
+    assert response.status_code == 403
@@ -0,0 +1,115 @@
+import asyncio
+import pytest
+
+from app.services.bulkhead import (
+    Bulkhead, UpstreamBusyError, PRIORITY_URGENT, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+)
+
+# --- 测试用例 ---
+
+def test_bulkhead_queues_then_rejects_when_queue_full():
+    """
+    测试场景1: 超过并发上限的请求排队，队列满了之后立即拒绝
+    """
+    async def scenario():
+        bulkhead = Bulkhead(max_concurrent=1, max_queue=1, queue_timeout=5)
+        await bulkhead.acquire()
+        waiter = asyncio.ensure_future(bulkhead.acquire())
+        await asyncio.sleep(0)
+        assert bulkhead.queued == 1
+
+        with pytest.raises(UpstreamBusyError) as excinfo:
+            await bulkhead.acquire()
+        assert excinfo.value.retry_after >= 1
+
+        bulkhead.release(held_seconds=0.5)
+        await waiter
+        assert bulkhead.active == 1
+        assert bulkhead.queued == 0
+        bulkhead.release()
+        return bulkhead.snapshot()
+
+    snapshot = asyncio.run(scenario())
+    assert snapshot["active"] == 0
+    assert snapshot["admitted"] == 2
+    assert snapshot["rejected"] == 1
+
+def test_bulkhead_wait_timeout_raises_busy():
+    """
+    测试场景2: 排队超过 queue_timeout 后放弃，名额不会泄漏
+    """
+    async def scenario():
+        bulkhead = Bulkhead(max_concurrent=1, max_queue=5, queue_timeout=0.01)
+        async with bulkhead.slot():
+            with pytest.raises(UpstreamBusyError):
+                await bulkhead.acquire()
+        return bulkhead
+
+    bulkhead = asyncio.run(scenario())
+    assert bulkhead.active == 0
+    assert bulkhead.queued == 0
+    assert bulkhead.timed_out == 1
+
+WEIGHTS = {PRIORITY_URGENT: 4, PRIORITY_INTERACTIVE: 2, PRIORITY_BACKGROUND: 1}
+
+async def _admission_order(bulkhead, arrivals):
+    """占满唯一名额后按 arrivals 顺序排队，逐个释放，返回实际获得名额的顺序"""
+    priorities = dict(arrivals)
+    await bulkhead.acquire()
+    order = []
+
+    async def waiter(name, priority):
+        await bulkhead.acquire(priority=priority)
+        order.append(name)
+
+    tasks = [asyncio.ensure_future(waiter(name, priority)) for name, priority in arrivals]
+    await asyncio.sleep(0)
+    bulkhead.release()
+    while len(order) < len(arrivals):
+        admitted = len(order)
+        while len(order) == admitted:
+            await asyncio.sleep(0)
+        bulkhead.release(priority=priorities[order[-1]])
+    await asyncio.gather(*tasks)
+    return order
+
+def test_bulkhead_weighted_fair_queuing_order():
+    """
+    测试场景3: 名额按权重分配：加急请求优先，但后台任务在积压中也能按比例拿到名额
+    """
+    arrivals = [(f"b{i}", PRIORITY_BACKGROUND) for i in range(3)] + \
+               [(f"i{i}", PRIORITY_INTERACTIVE) for i in range(4)] + \
+               [(f"u{i}", PRIORITY_URGENT) for i in range(2)]
+
+    async def scenario():
+        bulkhead = Bulkhead(max_concurrent=1, max_queue=20, queue_timeout=5,
+                            weights=WEIGHTS, background_max_share=1.0)
+        return await _admission_order(bulkhead, arrivals), bulkhead.snapshot()
+
+    order, snapshot = asyncio.run(scenario())
+    # 虚拟完成时间: u0=0.25 u1=0.5 i0=0.5 i1=1 b0=1 i2=1.5 i3=2 b1=2 b2=3 (相同时按类别顺序)
+    assert order == ["u0", "u1", "i0", "i1", "b0", "i2", "i3", "b1", "b2"]
+    assert order.index("b0") < order.index("i3")
+    assert snapshot["classes"][PRIORITY_BACKGROUND]["admitted"] == 3
+    assert snapshot["active"] == 0
+
+def test_bulkhead_caps_background_share():
+    """
+    测试场景4: 后台任务最多占用 background_max_share 的并发名额，其余名额留给交互请求
+    """
+    async def scenario():
+        bulkhead = Bulkhead(max_concurrent=4, max_queue=10, queue_timeout=0.05,
+                            weights=WEIGHTS, background_max_share=0.5)
+        await bulkhead.acquire(priority=PRIORITY_BACKGROUND)
+        await bulkhead.acquire(priority=PRIORITY_BACKGROUND)
+        with pytest.raises(UpstreamBusyError):
+            await bulkhead.acquire(priority=PRIORITY_BACKGROUND)
+        # 后台任务排队时，交互请求仍然可以直接拿到剩余名额
+        await bulkhead.acquire(priority=PRIORITY_INTERACTIVE)
+        await bulkhead.acquire(priority=PRIORITY_URGENT)
+        return bulkhead.snapshot()
+
+    snapshot = asyncio.run(scenario())
+    assert snapshot["active"] == 4
+    assert snapshot["classes"][PRIORITY_BACKGROUND]["active"] == 2
+    assert snapshot["timed_out"] == 1
@@ -0,0 +1,365 @@
+import json
+import time
+import asyncio
+import pytest
+from datetime import datetime, timedelta
+from flask_jwt_extended import create_access_token
+
+from app.models.user_model import UserModel
+from app.models.consultation_model import ChatMessageModel, ChatJobModel
+from app.models.appointment_model import AppointmentModel
+from app.core.extensions import db
+from app.services import llm_service, llm_runtime
+from app.services.chat_job_service import process_next_chat_job
+from app.services.bulkhead import UpstreamBusyError
+from app.services.upstream_pool import UpstreamPool
+from app.services.llm_runtime import RequestCancelled
+
+# --- 准备测试数据用的 Fixtures ---
+
+@pytest.fixture(scope='function')
+def auth_headers(test_app):
+    """创建一个病人并返回带 Token 的请求头"""
+    with test_app.app_context():
+        patient = UserModel(id=1, username='patient1', role='patient', full_name='病人张三')
+        patient.set_password('password')
+        db.session.add(patient)
+        db.session.commit()
+        access_token = create_access_token(identity=str(patient.id))
+    yield {'Authorization': f'Bearer {access_token}'}
+
+
+def parse_sse(body):
+    """把 text/event-stream 响应体解析成 (event, data) 列表"""
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+# --- 测试用例 ---
+
+def test_chat_medical_stream_relays_frames_and_saves_answer(test_client, test_app, auth_headers, monkeypatch):
+    """
+    测试场景1: 流式接口逐帧推送 agent 发言，并在结束后保存最终问答
+    """
+    frames = [
+        {"type": "agent_message", "speaker": "Triage_Agent", "content": "分析症状中"},
+        {"type": "agent_message", "speaker": "Summarizer_Agent", "content": "多喝水，注意休息"},
+        {"type": "session_end"},
+    ]
+    monkeypatch.setattr(llm_service, "iter_dynamic_response", lambda question, deadline_seconds=None, heartbeat=None, priority=None, context=None: (frame for frame in frames))
+
+    response = test_client.post('/api/chat/medical/stream', json={"question": "感冒了怎么办"}, headers=auth_headers)
+
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    events = parse_sse(response.get_data(as_text=True))
+    assert [event for event, _ in events] == ["start", "agent_message", "agent_message", "done"]
+    assert events[1][1]["speaker"] == "Triage_Agent"
+    assert events[-1][1]["answer"] == "多喝水，注意休息"
+
+    with test_app.app_context():
+        contents = [m.content for m in ChatMessageModel.query.order_by(ChatMessageModel.id).all()]
+    assert contents[-2:] == ["感冒了怎么办", "多喝水，注意休息"]
+
+def test_chat_medical_stream_reports_upstream_error(test_client, auth_headers, monkeypatch):
+    """
+    测试场景2: 上游报错时推送 error 事件，done 事件携带错误文本
+    """
+    frames = [{"type": "error", "content": "agent crashed"}]
+    monkeypatch.setattr(llm_service, "iter_dynamic_response", lambda question, deadline_seconds=None, heartbeat=None, priority=None, context=None: (frame for frame in frames))
+
+    response = test_client.post('/api/chat/medical/stream', json={"question": "头痛"}, headers=auth_headers)
+    events = parse_sse(response.get_data(as_text=True))
+
+    assert [event for event, _ in events] == ["start", "error", "done"]
+    assert events[-1][1]["answer"] == "处理过程中发生错误: agent crashed"
+
+def test_chat_medical_stream_missing_question(test_client, auth_headers):
+    """
+    测试场景3: 缺少 question 参数
+    """
+    response = test_client.post('/api/chat/medical/stream', json={}, headers=auth_headers)
+    assert response.status_code == 400
+
+def test_chat_medical_async_job_lifecycle(test_client, test_app, auth_headers, monkeypatch):
+    """
+    测试场景4: 异步模式返回 202，worker 执行后可查询到答案，且问答已写入历史
+    """
+    monkeypatch.setattr(llm_service, "get_ai_response", lambda question, use_cache=True, deadline_seconds=None, cancelled=None, priority=None, context=None: f"回答: {question}")
+
+    response = test_client.post('/api/chat/medical?async=1', json={"question": "发烧"}, headers=auth_headers)
+    assert response.status_code == 202
+    job_id = response.get_json()["jobId"]
+    assert response.headers["Location"] == f"/api/chat/jobs/{job_id}"
+
+    status = test_client.get(f'/api/chat/jobs/{job_id}', headers=auth_headers).get_json()
+    assert status["status"] == "queued"
+
+    with test_app.app_context():
+        assert process_next_chat_job() is True
+        assert process_next_chat_job() is False
+
+    status = test_client.get(f'/api/chat/jobs/{job_id}', headers=auth_headers).get_json()
+    assert status["status"] == "succeeded"
+    assert status["answer"] == "回答: 发烧"
+
+    history = test_client.get('/api/chat/history', headers=auth_headers).get_json()["history"]
+    assert history[-1]["question"] == "发烧"
+
+def test_chat_job_with_expired_lease_is_reclaimed(test_client, test_app, auth_headers, monkeypatch):
+    """
+    测试场景5: worker 崩溃后 (租约过期的 running 任务) 会被重新领取执行
+    """
+    monkeypatch.setattr(llm_service, "get_ai_response", lambda question, use_cache=True, deadline_seconds=None, cancelled=None, priority=None, context=None: "恢复后的回答")
+    response = test_client.post('/api/chat/medical', json={"question": "咳嗽"}, headers={**auth_headers, "Prefer": "respond-async"})
+    job_id = int(response.get_json()["jobId"])
+
+    with test_app.app_context():
+        job = db.session.get(ChatJobModel, job_id)
+        job.status = 'running'
+        job.attempts = 1
+        job.lease_expires_at = datetime.utcnow() - timedelta(seconds=1)
+        db.session.commit()
+
+        assert process_next_chat_job() is True
+        job = db.session.get(ChatJobModel, job_id)
+        assert job.status == 'succeeded'
+        assert job.attempts == 2
+
+def test_chat_job_of_other_user_is_hidden(test_client, test_app, auth_headers):
+    """
+    测试场景6: 不能查询其他用户的任务
+    """
+    response = test_client.post('/api/chat/medical?async=1', json={"question": "胃痛"}, headers=auth_headers)
+    job_id = response.get_json()["jobId"]
+    with test_app.app_context():
+        other_token = create_access_token(identity="99")
+
+    response = test_client.get(f'/api/chat/jobs/{job_id}', headers={'Authorization': f'Bearer {other_token}'})
+    assert response.status_code == 404
+
+def test_cancel_queued_chat_job(test_client, test_app, auth_headers):
+    """
+    测试场景9: 取消排队中的任务后不会再被执行；已结束的任务不能再取消
+    """
+    response = test_client.post('/api/chat/medical?async=1', json={"question": "头晕"}, headers=auth_headers)
+    job_id = response.get_json()["jobId"]
+
+    response = test_client.delete(f'/api/chat/jobs/{job_id}', headers=auth_headers)
+    assert response.status_code == 200
+    assert response.get_json()["status"] == "cancelled"
+
+    with test_app.app_context():
+        assert process_next_chat_job() is False
+
+    response = test_client.delete(f'/api/chat/jobs/{job_id}', headers=auth_headers)
+    assert response.status_code == 409
+
+def test_cancel_running_chat_job_discards_answer(test_client, test_app, auth_headers, monkeypatch):
+    """
+    测试场景10: 执行中的任务被取消时，worker 关闭上游会话且不写回回答
+    """
+    response = test_client.post('/api/chat/medical?async=1', json={"question": "失眠"}, headers=auth_headers)
+    job_id = response.get_json()["jobId"]
+
+    def cancelled_midway(question, use_cache=True, deadline_seconds=None, cancelled=None, priority=None, context=None):
+        assert test_client.delete(f'/api/chat/jobs/{job_id}', headers=auth_headers).status_code == 200
+        assert cancelled()
+        raise RequestCancelled()
+
+    monkeypatch.setattr(llm_service, "get_ai_response", cancelled_midway)
+    with test_app.app_context():
+        messages_before = ChatMessageModel.query.count()
+        assert process_next_chat_job() is True
+        job = db.session.get(ChatJobModel, int(job_id))
+        assert job.status == "cancelled"
+        assert job.answer is None
+        assert ChatMessageModel.query.count() == messages_before
+
+def test_chat_medical_returns_429_when_upstream_is_saturated(test_client, auth_headers, monkeypatch):
+    """
+    测试场景7: 上游并发和等待队列都已满时快速失败，并带上 Retry-After
+    """
+    def busy(question, use_cache=True, deadline_seconds=None, cancelled=None, priority=None, context=None):
+        raise UpstreamBusyError("AI 服务繁忙，请稍后重试", retry_after=7)
+
+    monkeypatch.setattr(llm_service, "get_ai_response", busy)
+    response = test_client.post('/api/chat/medical', json={"question": "发烧"}, headers=auth_headers)
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "7"
+
+def test_chat_medical_returns_503_when_circuit_is_open(test_client, auth_headers, monkeypatch):
+    """
+    测试场景8: 上游熔断中时不发起网络请求，直接返回 503 + Retry-After
+    """
+    pool = UpstreamPool(["http://127.0.0.1:9"])
+    breaker = pool.replicas[0].breaker
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure("connection refused")
+    monkeypatch.setattr(llm_service, "upstream_pool", pool)
+
+    def unexpected_post(*args, **kwargs):
+        raise AssertionError("upstream must not be called while the circuit is open")
+
+    monkeypatch.setattr(llm_runtime, "http_post", unexpected_post)
+    response = test_client.post('/api/chat/medical', json={"question": "熔断测试"}, headers=auth_headers)
+
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1
+    assert breaker.state == "open"
+
+def test_chat_medical_priority_follows_urgent_appointment(test_client, test_app, auth_headers, monkeypatch):
+    """
+    测试场景9: 有未完成加急预约的患者以 urgent 优先级排队，其余情况为 interactive
+    """
+    priorities = []
+
+    def record_priority(question, use_cache=True, deadline_seconds=None, cancelled=None, priority=None, context=None):
+        priorities.append(priority)
+        return "回答"
+
+    monkeypatch.setattr(llm_service, "get_ai_response", record_priority)
+    test_client.post('/api/chat/medical', json={"question": "胸痛"}, headers=auth_headers)
+
+    with test_app.app_context():
+        db.session.add(AppointmentModel(
+            patient_id=1, doctor_id=1, appointment_time=datetime.utcnow() + timedelta(days=1),
+            status='scheduled', is_urgent=True
+        ))
+        db.session.commit()
+    test_client.post('/api/chat/medical', json={"question": "胸痛"}, headers=auth_headers)
+
+    assert priorities == ["interactive", "urgent"]
+
+class FakeBuilder:
+    def __init__(self, answer):
+        self._answer = answer
+        self.succeeded = True
+
+    def result(self):
+        return self._answer
+
+def test_chat_medical_batch_runs_questions_concurrently(test_client, test_app, auth_headers, monkeypatch):
+    """
+    测试场景10: 批量问答并发调用上游，按提交顺序返回回答，并在一个事务中写入全部问答
+    """
+    async def slow_collect(question, deadline=None, priority=None, context=None):
+        await asyncio.sleep(0.3)
+        return FakeBuilder(f"回答: {question}")
+
+    monkeypatch.setattr(llm_service, "collect_dynamic_response_async", slow_collect)
+    questions = ["问卷一：最近是否发热", "问卷二：是否咳嗽", "问卷三：睡眠情况"]
+
+    started = time.monotonic()
+    response = test_client.post('/api/chat/medical/batch', json={"questions": questions, "noCache": True}, headers=auth_headers)
+    elapsed = time.monotonic() - started
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert [item["answer"] for item in body["answers"]] == [f"回答: {q}" for q in questions]
+    assert elapsed < 0.8
+    history = test_client.get('/api/chat/history', headers=auth_headers).get_json()["history"]
+    assert [item["question"] for item in history[-3:]] == questions
+
+def test_chat_medical_batch_busy_saves_nothing(test_client, test_app, auth_headers, monkeypatch):
+    """
+    测试场景11: 批量中任何一个问题拿不到上游名额时整批返回 429，且不写入任何问答
+    """
+    async def collect(question, deadline=None, priority=None, context=None):
+        if question == "繁忙":
+            raise UpstreamBusyError("AI 服务繁忙，请稍后重试", retry_after=3)
+        await asyncio.sleep(0.05)
+        return FakeBuilder("回答")
+
+    monkeypatch.setattr(llm_service, "collect_dynamic_response_async", collect)
+    # 先创建主问诊 (含欢迎消息)，再统计消息数
+    test_client.get('/api/chat/history', headers=auth_headers)
+    with test_app.app_context():
+        messages_before = ChatMessageModel.query.count()
+
+    response = test_client.post('/api/chat/medical/batch', json={"questions": ["头晕", "繁忙"], "noCache": True}, headers=auth_headers)
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "3"
+    with test_app.app_context():
+        assert ChatMessageModel.query.count() == messages_before
+
+def test_chat_medical_batch_validates_questions(test_client, auth_headers):
+    """
+    测试场景12: questions 缺失、含空问题或超过上限时返回 400
+    """
+    assert test_client.post('/api/chat/medical/batch', json={}, headers=auth_headers).status_code == 400
+    assert test_client.post('/api/chat/medical/batch', json={"questions": ["头痛", " "]}, headers=auth_headers).status_code == 400
+    too_many = [f"问题{i}" for i in range(20)]
+    assert test_client.post('/api/chat/medical/batch', json={"questions": too_many}, headers=auth_headers).status_code == 400
+
+def test_chat_job_reclaimed_by_another_worker_writes_nothing(test_client, test_app, auth_headers, monkeypatch):
+    """
+    测试场景13: 上游调用带有短于租约的时限；执行期间任务被其他 worker 重新领取时，本 worker 不写回问答
+    """
+    deadlines = []
+    def reclaimed_meanwhile(question, use_cache=True, deadline_seconds=None, cancelled=None, priority=None, context=None):
+        deadlines.append(deadline_seconds)
+        # 模拟租约过期后另一个 worker 领取了同一任务
+        job = db.session.get(ChatJobModel, job_id)
+        job.attempts += 1
+        db.session.commit()
+        return "迟到的回答"
+    monkeypatch.setattr(llm_service, "get_ai_response", reclaimed_meanwhile)
+    response = test_client.post('/api/chat/medical?async=1', json={"question": "牙疼"}, headers=auth_headers)
+    job_id = int(response.get_json()["jobId"])
+
+    with test_app.app_context():
+        assert process_next_chat_job() is True
+        assert 0 < deadlines[0] < test_app.config['CHAT_JOB_LEASE_SECONDS']
+        job = db.session.get(ChatJobModel, job_id)
+        assert job.status == 'running'
+        assert job.answer is None
+        assert ChatMessageModel.query.filter_by(content="牙疼").count() == 0
+
+def test_chat_job_busy_retry_does_not_use_up_attempts(test_client, test_app, auth_headers, monkeypatch):
+    """
+    测试场景14: 上游繁忙时任务重新排队，不消耗尝试次数
+    """
+    def busy(question, use_cache=True, deadline_seconds=None, cancelled=None, priority=None, context=None):
+        raise UpstreamBusyError("busy", retry_after=0)
+    monkeypatch.setattr(llm_service, "get_ai_response", busy)
+    response = test_client.post('/api/chat/medical?async=1', json={"question": "头晕"}, headers=auth_headers)
+    job_id = int(response.get_json()["jobId"])
+
+    with test_app.app_context():
+        for _ in range(test_app.config['CHAT_JOB_MAX_ATTEMPTS'] + 1):
+            assert process_next_chat_job() is True
+        job = db.session.get(ChatJobModel, job_id)
+        assert job.status == 'queued'
+        assert job.attempts == 0
+
+def test_chat_medical_stream_closes_upstream_when_body_not_consumed(test_client, auth_headers, monkeypatch):
+    """
+    测试场景15: 响应体还没开始迭代客户端就断开时，已启动的上游会话也会被关闭
+    """
+    closed, started = [], []
+
+    def fake_frames():
+        try:
+            yield {"type": "session_started", "session_id": "s1"}
+            yield {"type": "agent_message", "speaker": "Triage_Agent", "content": "分析症状中"}
+        finally:
+            closed.append(True)
+
+    def fake_iter(question, deadline_seconds=None, heartbeat=None, priority=None, context=None):
+        # 保留引用，避免生成器被垃圾回收时顺带执行 finally
+        started.append(fake_frames())
+        return started[-1]
+
+    monkeypatch.setattr(llm_service, "iter_dynamic_response", fake_iter)
+
+    response = test_client.post('/api/chat/medical/stream', json={"question": "头痛"}, headers=auth_headers, buffered=False)
+    assert response.status_code == 200
+    assert closed == []
+
+    response.close()
+    assert closed == [True]
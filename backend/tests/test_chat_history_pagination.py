@@ -0,0 +1,168 @@
+import pytest
+from datetime import datetime, timedelta
+from flask_jwt_extended import create_access_token
+
+from app.models.user_model import UserModel
+from app.models.consultation_model import AIConsultationModel, ChatMessageModel
+from app.core.extensions import db
+from app.services.history_service import get_chat_history, get_chat_history_page
+
+BASE_TIME = datetime(2026, 1, 1, 8, 0, 0)
+
+
+@pytest.fixture(scope='function')
+def auth_headers(test_app):
+    """创建一个病人并返回带 Token 的请求头"""
+    patient = UserModel(id=1, username='patient1', role='patient', full_name='病人张三')
+    patient.set_password('password')
+    db.session.add(patient)
+    db.session.commit()
+    yield {'Authorization': f'Bearer {create_access_token(identity="1")}'}
+
+
+def add_consultation(messages, start_minute):
+    """messages 为 [(sender_type, content), ...]；相邻两条消息使用相同的时间戳，以覆盖 (timestamp, id) 的并列情况"""
+    consultation = AIConsultationModel(patient_id=1, status='completed')
+    db.session.add(consultation)
+    db.session.flush()
+    for index, (sender_type, content) in enumerate(messages):
+        db.session.add(ChatMessageModel(
+            consultation_id=consultation.id, sender_type=sender_type, content=content,
+            timestamp=BASE_TIME + timedelta(minutes=start_minute + index // 2)
+        ))
+    db.session.commit()
+
+
+def build_history():
+    add_consultation([('user', 'q1'), ('ai', 'a1'), ('user', 'q2'), ('ai', 'a2'), ('user', 'q3'), ('ai', 'a3')], 0)
+    # 第二次问诊以一条没有配对提问的 AI 消息开头，最后一个问题还没有回答
+    add_consultation([('ai', 'orphan'), ('user', 'q4'), ('ai', 'a4'), ('user', 'q5')], 10)
+    add_consultation([('user', 'q6'), ('ai', 'a6')], 20)
+
+
+def all_pages(user_id, limit):
+    pages, cursor = [], None
+    while True:
+        page, cursor = get_chat_history_page(user_id, limit, cursor)
+        pages.append(page)
+        if cursor is None:
+            return pages
+
+# --- 测试用例 ---
+
+@pytest.mark.parametrize('limit', [1, 2, 3, 4, 100])
+def test_pages_concatenate_to_full_history(test_app, auth_headers, limit):
+    """
+    测试场景1: 从最新一页开始翻页，每页最多 limit 个问答，各页按时间拼接后与完整历史完全一致 (包括会话分隔标记)
+    """
+    build_history()
+    full = get_chat_history(1)
+    pages = all_pages(1, limit)
+
+    assert all(sum(1 for item in page if "question" in item) <= limit for page in pages)
+    assert pages[0][-1]["question"] == "q6"
+    assert [item for page in reversed(pages) for item in page] == full
+
+def test_separator_kept_at_page_boundary(test_app, auth_headers):
+    """
+    测试场景2: 分页边界恰好在两次问诊之间时，分隔标记出现在较新一页的页首
+    """
+    build_history()
+    first, cursor = get_chat_history_page(1, 1)
+    assert first == [{"type": "separator"}, {"question": "q6", "answer": "a6", "createdAt": first[1]["createdAt"]}]
+    second, cursor = get_chat_history_page(1, 1, cursor)
+    assert [item.get("question") for item in second] == ["q5"]
+    assert second[0]["answer"] == ""
+
+def test_history_api_returns_next_cursor(test_client, test_app, auth_headers):
+    """
+    测试场景3: /api/chat/history 支持 limit / before 分页并返回 nextCursor，无效游标或 limit 返回 400
+    """
+    build_history()
+    data = test_client.get('/api/chat/history?limit=4', headers=auth_headers).get_json()
+    assert [item.get("question") for item in data["history"]] == ["q3", None, "q4", "q5", None, "q6"]
+    assert data["nextCursor"]
+
+    older = test_client.get(f'/api/chat/history?limit=4&before={data["nextCursor"]}', headers=auth_headers).get_json()
+    assert [item.get("question") for item in older["history"]] == ["q1", "q2"]
+    assert older["nextCursor"] is None
+
+    full = test_client.get('/api/chat/history', headers=auth_headers).get_json()
+    assert full["nextCursor"] is None
+    assert len(full["history"]) == 8
+
+    response = test_client.get('/api/chat/history?before=not-a-cursor', headers=auth_headers)
+    assert response.status_code == 400
+    response = test_client.get('/api/chat/history?limit=abc', headers=auth_headers)
+    assert response.status_code == 400
+
+def test_history_delta_returns_only_new_pairs(test_client, test_app, auth_headers):
+    """
+    测试场景4: 传入 since=syncCursor 时只返回之后的新问答，新会话前带分隔标记，没有新消息时返回空增量，无效 since 返回 400
+    """
+    build_history()
+    data = test_client.get('/api/chat/history', headers=auth_headers).get_json()
+    cursor = data["syncCursor"]
+
+    empty = test_client.get(f'/api/chat/history?since={cursor}', headers=auth_headers).get_json()
+    assert empty["history"] == []
+    assert empty["syncCursor"] == cursor
+    assert empty["consultation_id"] == data["consultation_id"]
+
+    add_consultation([('user', 'q7'), ('ai', 'a7')], 30)
+    delta = test_client.get(f'/api/chat/history?since={cursor}', headers=auth_headers).get_json()
+    assert [item.get("question") for item in delta["history"]] == [None, "q7"]
+    assert delta["history"][0] == {"type": "separator"}
+    assert delta["syncCursor"] > cursor
+    assert delta["consultation_id"] != data["consultation_id"]
+
+    # 客户端把增量拼接到已有历史后，与完整历史一致
+    with test_app.app_context():
+        assert data["history"] + delta["history"] == get_chat_history(1)
+
+    # 格式不正确的 since 返回 400，而不是退回完整历史
+    for bad in ('abc', '-1', '1.5', ''):
+        response = test_client.get(f'/api/chat/history?since={bad}', headers=auth_headers)
+        assert response.status_code == 400
+
+def test_history_not_modified_when_etag_matches(test_client, test_app, auth_headers):
+    """
+    测试场景5: If-None-Match 与当前 ETag 一致时返回 304，有新消息后重新返回 200
+    """
+    build_history()
+    cursor = test_client.get('/api/chat/history', headers=auth_headers).get_json()["syncCursor"]
+    response = test_client.get(f'/api/chat/history?since={cursor}', headers=auth_headers)
+    etag = response.headers["ETag"]
+
+    not_modified = test_client.get(f'/api/chat/history?since={cursor}', headers={**auth_headers, 'If-None-Match': etag})
+    assert not_modified.status_code == 304
+    assert not_modified.get_data() == b""
+
+    add_consultation([('user', 'q7'), ('ai', 'a7')], 30)
+    changed = test_client.get(f'/api/chat/history?since={cursor}', headers={**auth_headers, 'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    assert [item.get("question") for item in changed.get_json()["history"]] == [None, "q7"]
+
+def test_history_etag_differs_between_pages(test_client, test_app, auth_headers):
+    """
+    测试场景6: 完整历史、不同分页和增量请求的 ETag 互不相同，拿别的请求的 ETag 不会得到 304
+    """
+    build_history()
+    full = test_client.get('/api/chat/history', headers=auth_headers)
+    first = test_client.get('/api/chat/history?limit=2', headers=auth_headers)
+    second = test_client.get(f'/api/chat/history?limit=2&before={first.get_json()["nextCursor"]}', headers=auth_headers)
+    delta = test_client.get(f'/api/chat/history?since={full.get_json()["syncCursor"]}', headers=auth_headers)
+    etags = [r.headers["ETag"] for r in (full, first, second, delta)]
+    assert len(set(etags)) == 4
+
+    for etag in etags[:2]:
+        page = test_client.get(
+            f'/api/chat/history?limit=2&before={first.get_json()["nextCursor"]}',
+            headers={**auth_headers, 'If-None-Match': etag}
+        )
+        assert page.status_code == 200
+        assert page.get_json()["history"] == second.get_json()["history"]
+
+    same_page = test_client.get('/api/chat/history?limit=2', headers={**auth_headers, 'If-None-Match': etags[1]})
+    assert same_page.status_code == 304
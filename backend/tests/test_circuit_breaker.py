@@ -0,0 +1,57 @@
+import time
+import pytest
+
+from app.services.circuit_breaker import CircuitBreaker, CircuitOpenError
+
+# --- 测试用例 ---
+
+def test_breaker_opens_after_consecutive_failures():
+    """
+    测试场景1: 连续失败达到阈值后熔断，之后的调用立即被拒绝
+    """
+    breaker = CircuitBreaker("test", failure_threshold=3, recovery_seconds=60)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record_failure("boom")
+    assert breaker.state == "closed"
+
+    breaker.record_failure("boom")
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError) as excinfo:
+        breaker.before_call()
+    assert excinfo.value.status_code == 503
+    assert excinfo.value.retry_after >= 1
+    assert breaker.snapshot()["rejected"] == 1
+
+def test_breaker_success_resets_failure_count():
+    """
+    测试场景2: 中间的一次成功会清零连续失败计数
+    """
+    breaker = CircuitBreaker("test", failure_threshold=2, recovery_seconds=60)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+
+def test_breaker_half_open_allows_single_probe():
+    """
+    测试场景3: 恢复期过后只放行一个探测请求，探测成功则关闭，失败则重新熔断
+    """
+    breaker = CircuitBreaker("test", failure_threshold=1, recovery_seconds=0.05)
+    breaker.record_failure()
+    assert breaker.state == "open"
+    time.sleep(0.06)
+
+    assert breaker.state == "half_open"
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    breaker.record_failure()
+    assert breaker.state == "open"
+    time.sleep(0.06)
+
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    breaker.before_call()
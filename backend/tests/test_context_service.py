@@ -0,0 +1,121 @@
+import pytest
+
+from app.core.extensions import db
+from app.models.user_model import UserModel
+from app.models.consultation_model import AIConsultationModel, ChatMessageModel
+from app.services import answer_cache, context_service, llm_service
+from app.services.context_service import build_context, estimate_tokens
+from app.services.history_service import find_or_create_main_ai_consultation, add_chat_message_to_consultation
+
+
+@pytest.fixture(scope='function')
+def consultation_id(test_app):
+    """创建一个病人及其主问诊 (只有欢迎消息)"""
+    patient = UserModel(id=1, username='context-patient', role='patient')
+    patient.set_password('password')
+    db.session.add(patient)
+    db.session.commit()
+    return find_or_create_main_ai_consultation(1).id
+
+
+def add_turns(consultation_id, count, start=0):
+    for i in range(start, start + count):
+        add_chat_message_to_consultation(
+            1, consultation_id, f"第{i}轮问题：我最近{i}天一直头痛，需要做什么检查？",
+            f"第{i}轮回答：建议先测量血压。" + "如果头痛持续或加重，请尽快到神经内科就诊。" * 5
+        )
+
+# --- 测试用例 ---
+
+def test_new_consultation_has_no_context(consultation_id):
+    """
+    测试场景1: 只有欢迎消息的问诊没有上下文 (回答仍可使用缓存)
+    """
+    assert build_context(consultation_id) is None
+
+def test_recent_turns_are_sent_verbatim(consultation_id):
+    """
+    测试场景2: 轮次不多时按时间顺序原样携带最近的问答，没有摘要
+    """
+    add_turns(consultation_id, 2)
+    context = build_context(consultation_id)
+    assert context["summary"] == ""
+    assert [m["role"] for m in context["history"]] == ["user", "assistant", "user", "assistant"]
+    assert context["history"][0]["content"].startswith("第0轮问题")
+    assert context["history"][-1]["content"].startswith("第1轮回答")
+
+def test_payload_size_stays_constant_for_long_consultations(consultation_id, monkeypatch):
+    """
+    测试场景3: 问诊越来越长时，较早的轮次并入摘要，上下文始终不超过预算
+    """
+    monkeypatch.setattr(context_service, "LLM_CONTEXT_TOKEN_BUDGET", 400)
+    monkeypatch.setattr(context_service, "LLM_CONTEXT_SUMMARY_TOKENS", 150)
+    sizes = []
+    for round_start in range(0, 60, 6):
+        add_turns(consultation_id, 6, start=round_start)
+        context = build_context(consultation_id)
+        sizes.append(context["tokens"])
+        assert estimate_tokens(context["summary"]) <= 150
+        assert estimate_tokens(context["summary"]) + sum(estimate_tokens(m["content"]) for m in context["history"]) <= 400
+
+    assert max(sizes[2:]) - min(sizes[2:]) < 60
+    assert context["summary"].startswith("主诉：第0轮问题")
+    assert "第55轮问题" in context["summary"]
+    assert context["history"][-2]["content"].startswith("第59轮问题")
+
+def test_summary_is_updated_only_with_new_turns(consultation_id):
+    """
+    测试场景4: 摘要只追加新滚出窗口的轮次，不会根据完整历史重新计算
+    """
+    add_turns(consultation_id, 6)
+    build_context(consultation_id)
+    consultation = db.session.get(AIConsultationModel, consultation_id)
+    watermark = consultation.summary_message_id
+    assert watermark is not None
+    assert "第1轮问题" in consultation.context_summary
+
+    # 手动改写已有摘要：如果摘要是根据完整历史重算的，改写的内容就会消失
+    consultation.context_summary = "主诉：(已由医生整理)"
+    db.session.commit()
+    # 没有新轮次时不改动摘要
+    build_context(consultation_id)
+    assert db.session.get(AIConsultationModel, consultation_id).context_summary == "主诉：(已由医生整理)"
+
+    add_turns(consultation_id, 1, start=6)
+    context = build_context(consultation_id)
+    lines = context["summary"].split("\n")
+    assert lines[0] == "主诉：(已由医生整理)"
+    assert len(lines) == 2 and lines[1].startswith("问：第2轮问题")
+    assert db.session.get(AIConsultationModel, consultation_id).summary_message_id > watermark
+
+def test_get_ai_response_with_context_is_cached_per_context(test_app, monkeypatch):
+    """
+    测试场景5: 带上下文的问题把上下文交给上游；缓存键包含上下文，不会用到通用回答，
+    同一上下文的重复提交命中缓存，上下文变化后重新调用上游
+    """
+    received = []
+
+    class Builder:
+        succeeded = True
+
+        def result(self):
+            return f"结合上下文的回答{len(received)}"
+
+    async def fake_collect(question, deadline=None, priority=None, context=None):
+        received.append(context)
+        return Builder()
+
+    monkeypatch.setattr(llm_service, "collect_dynamic_response_async", fake_collect)
+    answer_cache.store("还需要吃药吗", "缓存里的通用回答")
+    context = {"summary": "主诉：头痛", "history": [], "tokens": 5}
+
+    assert llm_service.get_ai_response("还需要吃药吗", context=context) == "结合上下文的回答1"
+    assert received == [context]
+    assert answer_cache.lookup("还需要吃药吗") == "缓存里的通用回答"
+
+    assert llm_service.get_ai_response("还需要吃药吗？", context=dict(context)) == "结合上下文的回答1"
+    assert len(received) == 1
+
+    changed = {"summary": "主诉：头痛", "history": [{"role": "user", "content": "吃了布洛芬"}], "tokens": 9}
+    assert llm_service.get_ai_response("还需要吃药吗", context=changed) == "结合上下文的回答2"
+    assert received == [context, changed]
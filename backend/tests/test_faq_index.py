@@ -0,0 +1,267 @@
+import time
+import numpy as np
+import pytest
+from flask_jwt_extended import create_access_token
+
+from app.core.extensions import db
+from app.models.user_model import UserModel
+from app.models.consultation_model import AIConsultationModel, ChatMessageModel
+from app.models.review_model import DoctorReviewModel
+from app.services import faq_index, llm_service
+from app.services.circuit_breaker import CircuitOpenError
+from app.services.history_service import WELCOME_QUESTION, WELCOME_ANSWER
+from app.services.faq_index import FaqIndex, FAQ_MATCH_THRESHOLD
+
+
+@pytest.fixture(scope='function')
+def index(test_app, tmp_path, monkeypatch):
+    """在临时目录中用默认 FAQ 语料构建索引 (审核完成后立即可以收录)"""
+    monkeypatch.setattr(faq_index, "REVIEW_SETTLE_SECONDS", 0)
+    index = faq_index.configure_index(index_dir=str(tmp_path / "faq_index"), rebuild_delta=10)
+    index.rebuild()
+    return index
+
+
+def add_turns(consultation_id, turns):
+    for question, answer in turns:
+        db.session.add(ChatMessageModel(consultation_id=consultation_id, sender_type='user', content=question))
+        db.session.add(ChatMessageModel(consultation_id=consultation_id, sender_type='ai', content=answer))
+    db.session.commit()
+
+
+def create_consultation():
+    patient = UserModel(username=f'faq-patient-{UserModel.query.count()}', role='patient')
+    patient.set_password('password')
+    db.session.add(patient)
+    db.session.flush()
+    consultation = AIConsultationModel(patient_id=patient.id, status='completed')
+    db.session.add(consultation)
+    db.session.commit()
+    return consultation.id
+
+
+def review(consultation_id, approved=True):
+    """医生审核问诊 (审核时间为当前时间，此前的问答才算审核过)"""
+    db.session.add(DoctorReviewModel(consultation_id=consultation_id, doctor_id=1, is_approved=approved))
+    db.session.commit()
+
+# --- 测试用例 ---
+
+def test_lookup_matches_paraphrased_question(index):
+    """
+    测试场景1: 写法不同 (繁体/标点/空格) 的同一问题命中 FAQ，无关问题不命中
+    """
+    match = index.lookup("感冒 發燒 怎麼辦啊")
+    assert match is not None
+    assert match.question == "感冒发烧怎么办？"
+    assert match.source == "curated"
+    assert match.score >= FAQ_MATCH_THRESHOLD
+
+    assert index.lookup("膝盖做完半月板手术后多久可以跑步") is None
+    assert index.snapshot()["hits"] == 1
+
+def test_index_is_memory_mapped_and_shared_between_instances(index):
+    """
+    测试场景2: 索引数组以 mmap 方式加载，另一个进程 (实例) 直接映射同一份文件
+    """
+    other = FaqIndex(index.index_dir, index.corpus_path)
+    assert other.load() is True
+    assert isinstance(other._snapshot.doc, np.memmap)
+    assert isinstance(other._snapshot.idf, np.memmap)
+    assert other.search("孩子发烧怎么处理").question == "孩子发烧应该怎么处理？"
+
+def test_refresh_adds_reviewed_answers_incrementally(index):
+    """
+    测试场景3: 刷新时只加入医生审核确认过的问答 (增量段，不重建)，错误回答和未审核的问答不会进入索引
+    """
+    approved = create_consultation()
+    unreviewed = create_consultation()
+    add_turns(approved, [
+        ("布洛芬和对乙酰氨基酚可以一起吃吗", "一般不建议两种退烧药同时服用，如需交替使用请遵医嘱并间隔足够时间，注意每日最大剂量。"),
+        ("甲状腺结节需要手术吗", "调用 AI 服务时发生错误: connection refused"),
+    ])
+    review(approved)
+    add_turns(unreviewed, [("脚踝扭伤冰敷还是热敷", "扭伤后 48 小时内应冰敷，之后可以改为热敷促进恢复，疼痛明显时请就医。")])
+
+    version = index.snapshot()["version"]
+    index.refresh()
+    stats = index.snapshot()
+    assert stats["version"] == version
+    assert stats["delta_entries"] == 1
+    assert stats["rebuilds"] == 1
+
+    match = index.lookup("布洛芬和对乙酰氨基酚可以一起吃吗？")
+    assert match is not None and match.source == "mined"
+    assert index.lookup("甲状腺结节需要手术吗") is None
+    assert index.lookup("脚踝扭伤冰敷还是热敷") is None
+
+def test_refresh_rebuilds_when_delta_is_large(index):
+    """
+    测试场景4: 增量超过 rebuild_delta 时全量重建并写出新版本，重建后的索引包含全部挖掘结果
+    """
+    for i in range(12):
+        consultation_id = create_consultation()
+        add_turns(consultation_id, [
+            (f"第{i}种慢性病的日常护理要点是什么", f"第{i}种慢性病需要规律服药、定期复查，并保持健康的生活方式和饮食习惯。")
+        ])
+        review(consultation_id)
+    version = index.snapshot()["version"]
+    index.refresh()
+    stats = index.snapshot()
+    assert stats["version"] != version
+    assert stats["delta_entries"] == 0
+    assert stats["rebuilds"] == 2
+    assert index.lookup("第7种慢性病的日常护理要点是什么").answer.startswith("第7种")
+
+def test_refresh_follows_review_time(index):
+    """
+    测试场景8: 问答之后才被审核的问诊在审核后的刷新中收录；审核之后继续追加的问答不会收录
+    """
+    consultation_id = create_consultation()
+    add_turns(consultation_id, [("晚上总是失眠怎么调理", "失眠可以先从规律作息入手，睡前避免使用手机和摄入咖啡因，长期失眠请到睡眠门诊就诊。")])
+    index.refresh()
+    assert index.lookup("晚上总是失眠怎么调理") is None
+
+    review(consultation_id)
+    add_turns(consultation_id, [("牙龈出血是什么原因", "牙龈出血多与牙龈炎有关，建议使用软毛牙刷并定期洁牙，持续出血请到口腔科检查。")])
+    index.refresh()
+    match = index.lookup("晚上总是失眠怎么调理")
+    assert match is not None and match.source == "mined"
+    assert index.lookup("牙龈出血是什么原因") is None
+    assert index.snapshot()["delta_entries"] == 1
+
+    # 全量重建同样只收录审核之前的问答
+    index.rebuild()
+    assert index.lookup("晚上总是失眠怎么调理") is not None
+    assert index.lookup("牙龈出血是什么原因") is None
+
+def test_refresh_only_mines_first_question_of_consultation(index):
+    """
+    测试场景9: 只收录问诊中的第一个真实问题 (欢迎消息不算)，之后带着病人上下文生成的回答不会进入索引
+    """
+    consultation_id = create_consultation()
+    add_turns(consultation_id, [
+        (WELCOME_QUESTION, WELCOME_ANSWER),
+        ("嘴里长溃疡怎么办", "口腔溃疡多数一到两周可以自愈，期间少吃辛辣食物，反复发作或超过两周不愈请就医。"),
+        ("我刚才说的溃疡可以涂什么药", "结合您前面描述的溃疡情况，可以在医生指导下使用口腔溃疡贴或含漱液。"),
+    ])
+    review(consultation_id)
+    index.refresh()
+
+    assert index.lookup("嘴里长溃疡怎么办").source == "mined"
+    assert index.lookup("我刚才说的溃疡可以涂什么药") is None
+    assert index.snapshot()["delta_entries"] == 1
+
+def test_lookup_is_fast(index):
+    """
+    测试场景5: 单次查询远低于 5 毫秒
+    """
+    for _ in range(200):
+        index.lookup("高血压平时要注意什么")
+    started = time.perf_counter()
+    for _ in range(500):
+        index.lookup("高血压平时要注意什么")
+    assert (time.perf_counter() - started) / 500 < 0.005
+
+@pytest.fixture(scope='function')
+def headers(test_app):
+    patient = UserModel(id=99, username='faq-chat', role='patient')
+    patient.set_password('password')
+    db.session.add(patient)
+    db.session.commit()
+    return {'Authorization': f'Bearer {create_access_token(identity="99")}'}
+
+def test_chat_medical_returns_faq_answer_without_upstream(test_client, index, headers, monkeypatch):
+    """
+    测试场景6: /medical 命中 FAQ 时立即返回并标注来源，不调用上游，问答照常写入历史
+    """
+    def unexpected(*args, **kwargs):
+        raise AssertionError("upstream must not be called for FAQ hits")
+
+    monkeypatch.setattr(llm_service, "get_ai_response", unexpected)
+    response = test_client.post('/api/chat/medical', json={"question": "喉咙痛怎么办"}, headers=headers)
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["source"] == "faq"
+    assert body["fallback"] is False
+    assert body["faq"]["question"] == "喉咙痛怎么办？"
+    history = test_client.get('/api/chat/history', headers=headers).get_json()["history"]
+    assert history[-1]["question"] == "喉咙痛怎么办"
+
+def test_chat_medical_falls_back_to_faq_when_circuit_is_open(test_client, index, headers, monkeypatch):
+    """
+    测试场景7: 上游熔断时用相似度稍低的 FAQ 兜底；只差几个字但不是同一问题的，以及完全无关的问题仍返回 503
+    """
+    def circuit_open(question, **kwargs):
+        raise CircuitOpenError("AI 服务暂时不可用，请稍后重试", retry_after=30)
+
+    monkeypatch.setattr(llm_service, "get_ai_response", circuit_open)
+    response = test_client.post('/api/chat/medical', json={"question": "头痛是什么原因"}, headers=headers)
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["source"] == "faq"
+    assert body["fallback"] is True
+    assert body["faq"]["question"] == "头痛是什么原因引起的？"
+
+    for question in ("孕妇感冒发烧怎么办", "高血压患者平时需要吃什么药", "膝盖手术后多久可以跑步"):
+        response = test_client.post('/api/chat/medical', json={"question": question}, headers=headers)
+        assert response.status_code == 503, question
+
+def test_chat_medical_skips_faq_when_consultation_has_context(test_client, index, headers, monkeypatch):
+    """
+    测试场景10: 问诊已有上下文时不走 FAQ 快速通道，带着上下文调用上游
+    """
+    calls = []
+
+    def upstream(question, **kwargs):
+        calls.append(kwargs.get("context"))
+        return "结合您之前的情况，建议多休息。"
+
+    monkeypatch.setattr(llm_service, "get_ai_response", upstream)
+    first = test_client.post('/api/chat/medical', json={"question": "喉咙痛怎么办"}, headers=headers)
+    assert first.get_json()["source"] == "faq"
+    assert calls == []
+
+    second = test_client.post('/api/chat/medical', json={"question": "喉咙痛怎么办"}, headers=headers)
+    assert second.get_json()["source"] == "ai"
+    assert len(calls) == 1 and calls[0]["history"]
+
+def test_faq_fallback_survives_history_save_error(test_client, index, headers, monkeypatch):
+    """
+    测试场景11: 熔断兜底时写入历史失败，仍然返回 FAQ 回答而不是 500
+    """
+    from app.api import chat_api
+
+    def circuit_open(question, **kwargs):
+        raise CircuitOpenError("AI 服务暂时不可用，请稍后重试", retry_after=30)
+
+    def broken_save(*args, **kwargs):
+        raise RuntimeError("database is unavailable")
+
+    monkeypatch.setattr(llm_service, "get_ai_response", circuit_open)
+    monkeypatch.setattr(chat_api, "add_chat_message_to_consultation", broken_save)
+    response = test_client.post('/api/chat/medical', json={"question": "头痛是什么原因"}, headers=headers)
+
+    assert response.status_code == 200
+    assert response.get_json()["fallback"] is True
+
+def test_chat_medical_stream_falls_back_to_faq_when_circuit_is_open(test_client, index, headers, monkeypatch):
+    """
+    测试场景12: 流式接口在上游熔断时同样用 FAQ 兜底，没有相似问题时返回 503
+    """
+    def circuit_open(question, **kwargs):
+        raise CircuitOpenError("AI 服务暂时不可用，请稍后重试", retry_after=30)
+        yield
+
+    monkeypatch.setattr(llm_service, "iter_dynamic_response", circuit_open)
+    response = test_client.post('/api/chat/medical/stream', json={"question": "头痛是什么原因"}, headers=headers)
+    assert response.status_code == 200
+    body = response.get_data(as_text=True)
+    assert body.startswith("event: start\n")
+    assert '"fallback": true' in body and "头痛是什么原因引起的？" in body
+    history = test_client.get('/api/chat/history', headers=headers).get_json()["history"]
+    assert history[-1]["question"] == "头痛是什么原因"
+
+    response = test_client.post('/api/chat/medical/stream', json={"question": "膝盖手术后多久可以跑步"}, headers=headers)
+    assert response.status_code == 503
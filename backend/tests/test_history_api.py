@@ -97,4 +97,98 @@ def test_get_recent_unauthorized(test_client):
     测试场景4: 未提供认证 Token
     """
     response = test_client.get('/api/history/recent')
-    assert response.status_code == 401
\ No newline at end of file
+    assert response.status_code == 401
+
+def seed_timeline(patient_id, doctor_id):
+    """交替创建 AI 问诊和医生问诊，返回按时间从新到旧排列的 (type, id)"""
+    now = datetime.utcnow().replace(microsecond=0)
+    expected = []
+    for i in range(7):
+        occurred_at = now - timedelta(hours=i)
+        if i % 2 == 0:
+            record = AIConsultationModel(patient_id=patient_id, created_at=occurred_at, ai_diagnosis=f"AI问诊{i}")
+            kind = 'ai'
+        else:
+            # 医生问诊按预约的问诊时间排序，与记录创建时间无关
+            record = DoctorConsultationModel(patient_id=patient_id, doctor_id=doctor_id, created_at=now - timedelta(days=30),
+                                             appointment_time=occurred_at, patient_symptoms=f"医生问诊{i}")
+            kind = 'doctor'
+        db.session.add(record)
+        db.session.flush()
+        expected.append((kind, record.id))
+    db.session.commit()
+    return expected
+
+
+def test_get_all_history_sorted_by_time(test_client, test_app, seed_users):
+    """
+    测试场景5: 全部问诊记录按真实的问诊时间倒序合并 AI 与医生问诊
+    """
+    with test_app.app_context():
+        expected = seed_timeline(seed_users['patient_id'], seed_users['doctor_id'])
+        access_token = create_access_token(identity=str(seed_users['patient_id']))
+
+    response = test_client.get('/api/history/all', headers={'Authorization': f'Bearer {access_token}'})
+    assert response.status_code == 200
+    records = response.get_json()
+    assert [(r['type'], r['id']) for r in records] == expected
+    assert records[1]['doctor'] == '李医生'
+
+
+def test_get_all_history_paginated(test_client, test_app, seed_users):
+    """
+    测试场景6: 按页获取问诊记录，各页依次拼接与完整列表一致，同一时间的记录不会重复或遗漏；无效游标或 limit 返回 400
+    """
+    with test_app.app_context():
+        expected = seed_timeline(seed_users['patient_id'], seed_users['doctor_id'])
+        # 与最新的 AI 问诊同一时间的医生问诊
+        latest = db.session.get(AIConsultationModel, expected[0][1]).created_at
+        tie = DoctorConsultationModel(patient_id=seed_users['patient_id'], doctor_id=seed_users['doctor_id'],
+                                      appointment_time=latest, patient_symptoms="同时")
+        db.session.add(tie)
+        db.session.commit()
+        expected.insert(0, ('doctor', tie.id))
+        access_token = create_access_token(identity=str(seed_users['patient_id']))
+
+    headers = {'Authorization': f'Bearer {access_token}'}
+    assert [(r['type'], r['id']) for r in test_client.get('/api/history/all', headers=headers).get_json()] == expected
+    assert test_client.get('/api/history/recent', headers=headers).get_json()['title'] == '同时'
+
+    pages, cursor = [], None
+    while True:
+        url = '/api/history/all?limit=3' + (f'&before={cursor}' if cursor else '')
+        data = test_client.get(url, headers=headers).get_json()
+        assert len(data['records']) <= 3
+        pages.append(data['records'])
+        cursor = data['nextCursor']
+        if cursor is None:
+            break
+    assert [len(page) for page in pages] == [3, 3, 2]
+    assert [(r['type'], r['id']) for page in pages for r in page] == expected
+
+    response = test_client.get('/api/history/all?before=not-a-cursor', headers=headers)
+    assert response.status_code == 400
+    for bad in ('abc', '0', '-1', ''):
+        response = test_client.get(f'/api/history/all?limit={bad}', headers=headers)
+        assert response.status_code == 400, bad
+
+def test_get_recent_ignores_future_appointment(test_client, test_app, seed_users):
+    """
+    测试场景7: 今天的 AI 问诊与明天的医生预约，/recent 返回已发生的 AI 问诊，/all 仍按预约时间排在最前
+    """
+    patient_id = seed_users['patient_id']
+    with test_app.app_context():
+        ai_record = AIConsultationModel(patient_id=patient_id, created_at=datetime.utcnow() - timedelta(hours=1), ai_diagnosis="感冒", ai_analysis="多喝热水")
+        doctor_record = DoctorConsultationModel(patient_id=patient_id, doctor_id=seed_users['doctor_id'], created_at=datetime.utcnow() - timedelta(hours=2), appointment_time=datetime.utcnow() + timedelta(days=1), patient_symptoms="头痛", department="内科")
+        db.session.add_all([ai_record, doctor_record])
+        db.session.commit()
+        access_token = create_access_token(identity=str(patient_id))
+
+    headers = {'Authorization': f'Bearer {access_token}'}
+    response = test_client.get('/api/history/recent', headers=headers)
+    assert response.status_code == 200
+    assert response.get_json()['type'] == 'ai'
+    assert response.get_json()['title'] == '感冒'
+
+    records = test_client.get('/api/history/all', headers=headers).get_json()
+    assert [record['type'] for record in records] == ['doctor', 'ai']
@@ -0,0 +1,237 @@
+import asyncio
+import json
+import time
+
+import websockets
+
+import pytest
+
+from app.services import llm_service, llm_runtime
+from app.services.upstream_pool import upstream_pool
+
+# --- 准备测试用的假上游 ---
+
+class FakeStartResponse:
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {"session_id": "s-1"}
+
+
+def start_slow_agent_server(frames, stall_seconds):
+    """在 llm_runtime 的事件循环上启动一个 WebSocket 服务：先推送 frames，然后长时间不再发送"""
+    async def handler(websocket):
+        for frame in frames:
+            await websocket.send(json.dumps(frame, ensure_ascii=False))
+        await asyncio.sleep(stall_seconds)
+
+    async def start():
+        return await websockets.serve(handler, "127.0.0.1", 0)
+
+    server = llm_runtime.run(start())
+    port = list(server.sockets)[0].getsockname()[1]
+    return server, f"ws://127.0.0.1:{port}/api/v1/chat/ws/s-1"
+
+
+def fake_upstream(monkeypatch, frames, stall_seconds=5, stop_calls=None):
+    async def fake_post(url, **kwargs):
+        if stop_calls is not None and "/chat/stop/" in url:
+            stop_calls.append(url)
+        return FakeStartResponse()
+
+    server, ws_url = start_slow_agent_server(frames, stall_seconds)
+    monkeypatch.setattr(llm_runtime, "http_post", fake_post)
+    monkeypatch.setattr(llm_service, "_build_ws_url", lambda session_id, base_url=None: ws_url)
+    return server
+
+# --- 测试用例 ---
+
+def test_deadline_returns_partial_answer_from_received_frames(test_app, monkeypatch):
+    """
+    测试场景1: 截止时间先到时返回已收到的 agent 发言，并标记为部分回答 (不写入缓存)
+    """
+    server = fake_upstream(monkeypatch, [
+        {"type": "agent_message", "speaker": "Triage_Agent", "content": "可能是普通感冒"},
+    ])
+    try:
+        started = time.monotonic()
+        answer = llm_service.get_ai_response("截止时间测试", deadline_seconds=0.5)
+        elapsed = time.monotonic() - started
+    finally:
+        server.close()
+
+    assert elapsed < 2
+    assert llm_service.is_partial_answer(answer)
+    assert "Triage_Agent: 可能是普通感冒" in answer
+    assert llm_service.answer_cache.lookup("截止时间测试") is None
+
+def test_deadline_without_any_frames_returns_timeout_message(test_app, monkeypatch):
+    """
+    测试场景2: 截止前一条 agent 发言都没有收到时，返回超时提示
+    """
+    server = fake_upstream(monkeypatch, [])
+    try:
+        answer = llm_service.get_ai_response("截止时间测试2", use_cache=False, deadline_seconds=0.3)
+    finally:
+        server.close()
+
+    assert answer == llm_service.TIMEOUT_ANSWER
+    assert not llm_service.is_partial_answer(answer)
+
+def test_summarizer_answer_is_complete_even_if_deadline_hits_before_session_end():
+    """
+    测试场景3: Summarizer 已经给出最终答案后到期，回答视为完整
+    """
+    builder = llm_service.AgentAnswerBuilder()
+    builder.feed({"type": "agent_message", "speaker": "Summarizer_Agent", "content": "多喝水，注意休息"})
+    assert builder.feed({"type": "deadline_exceeded", "local": True})
+    assert not builder.partial
+    assert builder.succeeded
+    assert builder.result() == "多喝水，注意休息"
+
+def test_cancelled_request_closes_session_and_notifies_upstream(test_app, monkeypatch):
+    """
+    测试场景4: 调用方放弃 (客户端断开) 时立即关闭会话、释放并发名额，并通知上游停止会话
+    """
+    stop_calls = []
+    server = fake_upstream(monkeypatch, [
+        {"type": "agent_message", "speaker": "Triage_Agent", "content": "正在分析"},
+    ], stop_calls=stop_calls)
+    monkeypatch.setattr(llm_runtime, "CANCEL_POLL_INTERVAL", 0.05)
+    abandoned_before = llm_service.session_counters["abandoned_sessions"]
+    checks = []
+
+    def cancelled():
+        checks.append(1)
+        return len(checks) >= 4
+
+    try:
+        started = time.monotonic()
+        with pytest.raises(llm_runtime.RequestCancelled):
+            llm_service.get_ai_response("取消测试", cancelled=cancelled)
+        assert time.monotonic() - started < 2
+        time.sleep(0.2)
+    finally:
+        server.close()
+
+    assert llm_service.upstream_bulkhead.active == 0
+    assert llm_service.session_counters["abandoned_sessions"] == abandoned_before + 1
+    assert stop_calls and stop_calls[0].endswith("/api/v1/chat/stop/s-1")
+
+def test_closing_stream_iterator_cancels_pending_recv(test_app, monkeypatch):
+    """
+    测试场景5: SSE 生成器在等待下一帧时被关闭 (心跳写入失败)，上游会话随之关闭
+    """
+    stop_calls = []
+    server = fake_upstream(monkeypatch, [], stop_calls=stop_calls)
+    try:
+        frames = llm_service.iter_dynamic_response("流式取消测试", heartbeat=0.05)
+        assert next(frames)["type"] == "session_started"
+        assert next(frames) is None
+        frames.close()
+        time.sleep(0.2)
+    finally:
+        server.close()
+
+    assert llm_service.upstream_bulkhead.active == 0
+    assert len(stop_calls) == 1
+
+def test_dropped_websocket_is_resumed_without_duplicate_frames(test_app, monkeypatch):
+    """
+    测试场景6: 连接异常中断后按 session_id 重连，服务端重放的帧被去重，会话继续完成
+    """
+    connections = []
+
+    async def handler(websocket):
+        connections.append(1)
+        await websocket.send(json.dumps({"type": "agent_message", "speaker": "Triage_Agent", "content": "初步判断"}))
+        if len(connections) == 1:
+            await websocket.close(code=1011)
+            return
+        await websocket.send(json.dumps({"type": "agent_message", "speaker": "Summarizer_Agent", "content": "最终建议"}))
+        await websocket.send(json.dumps({"type": "session_end"}))
+
+    async def start():
+        return await websockets.serve(handler, "127.0.0.1", 0)
+
+    async def fake_post(url, **kwargs):
+        return FakeStartResponse()
+
+    server = llm_runtime.run(start())
+    port = list(server.sockets)[0].getsockname()[1]
+    monkeypatch.setattr(llm_runtime, "http_post", fake_post)
+    monkeypatch.setattr(llm_service, "_build_ws_url", lambda session_id, base_url=None: f"ws://127.0.0.1:{port}/api/v1/chat/ws/{session_id}")
+    monkeypatch.setattr(llm_service, "LLM_WS_RECONNECT_BASE_DELAY", 0.01)
+    reconnects_before = llm_service.session_counters["reconnects"]
+    try:
+        frames = list(llm_service.iter_dynamic_response("重连测试"))
+    finally:
+        server.close()
+
+    assert len(connections) == 2
+    assert llm_service.session_counters["reconnects"] == reconnects_before + 1
+    assert [frame.get("content") for frame in frames if frame["type"] == "agent_message"] == ["初步判断", "最终建议"]
+    assert frames[-1]["type"] == "session_end"
+
+def test_frame_deduper_uses_sequence_numbers_when_present():
+    """
+    测试场景7: 帧带有 seq 时按编号去重，同样内容的新帧不会被误删
+    """
+    deduper = llm_service.FrameDeduper()
+    assert not deduper.is_duplicate({"type": "agent_message", "seq": 1, "content": "好的"})
+    deduper.start_replay()
+    assert deduper.is_duplicate({"type": "agent_message", "seq": 1, "content": "好的"})
+    assert not deduper.is_duplicate({"type": "agent_message", "seq": 2, "content": "好的"})
+
+def test_warm_session_is_used_without_start_round_trip(test_app, monkeypatch):
+    """
+    测试场景8: 启用预热池后，问题通过预先打开的 WebSocket 发出，不再调用 /chat/start
+    """
+    from app.services.warm_pool import WarmSessionPool
+
+    received_questions = []
+
+    async def handler(websocket):
+        message = json.loads(await websocket.recv())
+        received_questions.append(message)
+        await websocket.send(json.dumps({"type": "agent_message", "speaker": "Summarizer_Agent", "content": "预热回答"}))
+        await websocket.send(json.dumps({"type": "session_end"}))
+
+    async def start():
+        return await websockets.serve(handler, "127.0.0.1", 0)
+
+    server = llm_runtime.run(start())
+    port = list(server.sockets)[0].getsockname()[1]
+    start_payloads = []
+
+    async def fake_post(url, **kwargs):
+        start_payloads.append(kwargs.get("json"))
+        return FakeStartResponse()
+
+    pool = WarmSessionPool(size=1, idle_seconds=30)
+    monkeypatch.setattr(llm_service, "warm_pool", pool)
+    monkeypatch.setattr(llm_runtime, "http_post", fake_post)
+    monkeypatch.setattr(llm_service, "_build_ws_url", lambda session_id, base_url=None: f"ws://127.0.0.1:{port}/ws/{session_id}")
+    try:
+        # 第一次请求触发后台补充，此时池中还没有会话
+        llm_runtime.run(pool.take("预热"))
+        for _ in range(50):
+            if pool.snapshot()["available"]:
+                break
+            time.sleep(0.02)
+        start_calls_before = len(start_payloads)
+        assert sum(replica.outstanding for replica in upstream_pool.replicas) == pool.snapshot()["available"] == 1
+        answer = llm_service.get_ai_response("预热测试", use_cache=False)
+    finally:
+        llm_runtime.run(pool.close())
+        server.close()
+
+    assert answer == "预热回答"
+    assert start_payloads[0] == {"deferred": True}
+    assert received_questions == [{"type": "question", "question": "预热测试"}]
+    assert pool.snapshot()["hits"] == 1
+    # 池中等待的预热会话计入在途负载，用掉或关闭后全部退回
+    assert all(replica.outstanding == 0 for replica in upstream_pool.replicas)
+    # 用掉的会话由后台补充 (deferred)，问答本身没有调用带问题的 /chat/start
+    assert all(payload == {"deferred": True} for payload in start_payloads[start_calls_before:])
@@ -0,0 +1,80 @@
+import json
+
+from app.models.user_model import UserModel
+from app.models.medical_record_model import MedicalRecordModel
+from app.core.extensions import db
+from app.services import llm_service
+from app.services.bulkhead import UpstreamBusyError
+from app.services.medical_record_batch_service import run_batch, select_patients, load_checkpoint
+
+
+def add_patients(*names):
+    for i, name in enumerate(names, start=1):
+        patient = UserModel(id=i, username=f'patient{i}', role='patient', full_name=name)
+        patient.set_password('password')
+        db.session.add(patient)
+    db.session.commit()
+
+
+def fake_record(patient_name, context=None, incremental=None):
+    return {"patient_name": patient_name, "summary": f"{patient_name}的主诉", "encounters": [{"diagnosis": "感冒"}]}
+
+# --- 测试用例 ---
+
+def test_batch_generation_commits_and_checkpoints(test_app, tmp_path, monkeypatch):
+    """
+    测试场景1: 批量生成为每个病人生成病历，分批提交并写入检查点，返回吞吐与延迟统计
+    """
+    monkeypatch.setattr(llm_service, "generate_structured_medical_record", fake_record)
+    add_patients('张三', '李四', None)
+    checkpoint = str(tmp_path / "batch.json")
+
+    stats = run_batch(test_app, select_patients(), concurrency=1, batch_size=2, checkpoint_path=checkpoint, log=lambda message: None)
+
+    assert stats["patients"] == 3
+    assert stats["succeeded"] == 2
+    # 没有姓名的病人无法生成病历，不写入检查点
+    assert stats["failed"] == 1
+    assert stats["latency_ms_max"] >= stats["latency_ms_p50"] >= 0
+    assert "throughput_per_minute" in stats
+    assert load_checkpoint(checkpoint) == {1, 2}
+    assert sorted(r.chief_complaint for r in MedicalRecordModel.query.all()) == ["张三的主诉", "李四的主诉"]
+
+def test_batch_generation_resumes_from_checkpoint(test_app, tmp_path, monkeypatch):
+    """
+    测试场景2: 重新运行时跳过检查点中已完成的病人，只处理剩余的病人
+    """
+    calls = []
+    def counting_record(patient_name, context=None, incremental=None):
+        calls.append(patient_name)
+        return fake_record(patient_name, context, incremental)
+    monkeypatch.setattr(llm_service, "generate_structured_medical_record", counting_record)
+    add_patients('张三', '李四', '王五')
+    checkpoint = tmp_path / "batch.json"
+    checkpoint.write_text(json.dumps({"done": [1, 2]}), encoding="utf-8")
+
+    stats = run_batch(test_app, [1, 2, 3], concurrency=2, batch_size=10, checkpoint_path=str(checkpoint), log=lambda message: None)
+
+    assert stats["skipped"] == 2
+    assert stats["succeeded"] == 1
+    assert calls == ['王五']
+    assert load_checkpoint(str(checkpoint)) == {1, 2, 3}
+
+def test_batch_generation_retries_when_upstream_busy(test_app, monkeypatch):
+    """
+    测试场景3: 上游繁忙时等待后重试同一个病人
+    """
+    attempts = []
+    def busy_once(patient_name, context=None, incremental=None):
+        attempts.append(patient_name)
+        if len(attempts) == 1:
+            raise UpstreamBusyError("busy", retry_after=0)
+        return fake_record(patient_name)
+    monkeypatch.setattr(llm_service, "generate_structured_medical_record", busy_once)
+    add_patients('张三')
+
+    stats = run_batch(test_app, [1], concurrency=1, log=lambda message: None)
+
+    assert stats["succeeded"] == 1
+    assert stats["busy_retries"] == 1
+    assert attempts == ['张三', '张三']
@@ -0,0 +1,291 @@
+import json
+import pytest
+from flask_jwt_extended import create_access_token
+
+from app.models.user_model import UserModel
+from app.models.consultation_model import ChatMessageModel
+from app.models.medical_record_model import MedicalRecordModel, MedicalRecordJobModel
+from app.core.extensions import db
+from app.services import llm_service
+from app.services.bulkhead import UpstreamBusyError, upstream_bulkhead
+from app.services.medical_record_job_service import process_next_medical_record_job, enqueue_medical_record_job
+from app.services.history_service import (
+    find_or_create_main_ai_consultation, add_chat_message_to_consultation, generate_medical_record_from_history
+)
+
+# --- 准备测试数据用的 Fixtures ---
+
+@pytest.fixture(scope='function')
+def auth_headers(test_app):
+    """创建一个病人并返回带 Token 的请求头"""
+    with test_app.app_context():
+        patient = UserModel(id=1, username='patient1', role='patient', full_name='病人张三')
+        patient.set_password('password')
+        db.session.add(patient)
+        db.session.commit()
+        access_token = create_access_token(identity=str(patient.id))
+    yield {'Authorization': f'Bearer {access_token}'}
+
+
+def fake_record(patient_name, context=None, incremental=None):
+    return {
+        "patient_name": patient_name,
+        "summary": "咳嗽三天",
+        "encounters": [{"diagnosis": "上呼吸道感染"}]
+    }
+
+# --- 测试用例 ---
+
+def test_generate_medical_record_returns_job_immediately(test_client, test_app, auth_headers, monkeypatch):
+    """
+    测试场景1: 生成病历接口只入队并返回 202，重复提交返回同一个未完成的任务
+    """
+    def fail(*args, **kwargs):
+        raise AssertionError("POST 不应同步调用 LLM")
+    monkeypatch.setattr(llm_service, "generate_structured_medical_record", fail)
+
+    response = test_client.post('/api/chat/medical/record', headers=auth_headers)
+    assert response.status_code == 202
+    data = response.get_json()
+    assert data["status"] == "queued"
+    assert data["statusUrl"] == f"/api/chat/medical/record/jobs/{data['jobId']}"
+    assert response.headers["Location"] == data["statusUrl"]
+    assert response.headers["Retry-After"] == "2"
+
+    again = test_client.post('/api/chat/medical/record', headers=auth_headers).get_json()
+    assert again["jobId"] == data["jobId"]
+
+    status_response = test_client.get(data["statusUrl"], headers=auth_headers)
+    assert status_response.headers["Retry-After"] == "2"
+    status = status_response.get_json()
+    assert status["status"] == "queued"
+    assert status["record"] is None
+
+def test_medical_record_job_links_generated_record(test_client, test_app, auth_headers, monkeypatch):
+    """
+    测试场景2: worker 生成病历后任务成功，任务关联到新病历，查询接口返回病历详情
+    """
+    monkeypatch.setattr(llm_service, "generate_structured_medical_record", fake_record)
+    job_id = test_client.post('/api/chat/medical/record', headers=auth_headers).get_json()["jobId"]
+
+    with test_app.app_context():
+        assert process_next_medical_record_job() is True
+        assert process_next_medical_record_job() is False
+        job = db.session.get(MedicalRecordJobModel, int(job_id))
+        record = db.session.get(MedicalRecordModel, job.medical_record_id)
+        assert job.status == "succeeded"
+        assert record.patient_id == 1
+        assert record.diagnosis == "上呼吸道感染"
+
+    status_response = test_client.get(f'/api/chat/medical/record/jobs/{job_id}', headers=auth_headers)
+    assert "Retry-After" not in status_response.headers
+    status = status_response.get_json()
+    assert status["status"] == "succeeded"
+    assert status["recordId"] == str(record.id)
+    assert status["record"]["主诉"] == "咳嗽三天"
+    assert status["record"]["诊断"] == "上呼吸道感染"
+
+def test_medical_record_job_requeued_when_upstream_busy(test_client, test_app, auth_headers, monkeypatch):
+    """
+    测试场景3: 上游繁忙时任务放回队列稍后重试，不产生病历
+    """
+    def busy(patient_name, context=None, incremental=None):
+        raise UpstreamBusyError("busy", retry_after=0)
+    monkeypatch.setattr(llm_service, "generate_structured_medical_record", busy)
+    job_id = test_client.post('/api/chat/medical/record', headers=auth_headers).get_json()["jobId"]
+
+    with test_app.app_context():
+        assert process_next_medical_record_job() is True
+        job = db.session.get(MedicalRecordJobModel, int(job_id))
+        assert job.status == "queued"
+        assert job.attempts == 0
+        assert MedicalRecordModel.query.count() == 0
+
+def test_medical_record_job_fails_without_valid_record(test_client, test_app, auth_headers, monkeypatch):
+    """
+    测试场景4: LLM 没有返回有效病历时任务失败，并给出原因
+    """
+    monkeypatch.setattr(llm_service, "generate_structured_medical_record", lambda patient_name, context=None, incremental=None: {})
+    job_id = test_client.post('/api/chat/medical/record', headers=auth_headers).get_json()["jobId"]
+
+    with test_app.app_context():
+        assert process_next_medical_record_job() is True
+
+    status = test_client.get(f'/api/chat/medical/record/jobs/{job_id}', headers=auth_headers).get_json()
+    assert status["status"] == "failed"
+    assert status["error"] == "无足够的问诊记录生成病历"
+    assert status["recordId"] is None
+
+def test_medical_record_job_of_other_user_is_hidden(test_client, test_app, auth_headers):
+    """
+    测试场景5: 不能查询其他用户的病历生成任务
+    """
+    job_id = test_client.post('/api/chat/medical/record', headers=auth_headers).get_json()["jobId"]
+    with test_app.app_context():
+        other = UserModel(id=2, username='patient2', role='patient')
+        other.set_password('password')
+        db.session.add(other)
+        db.session.commit()
+        other_token = create_access_token(identity='2')
+
+    response = test_client.get(f'/api/chat/medical/record/jobs/{job_id}', headers={'Authorization': f'Bearer {other_token}'})
+    assert response.status_code == 404
+
+def test_medical_record_reused_when_history_unchanged(test_app, auth_headers, monkeypatch):
+    """
+    测试场景6: 问诊消息和病史档案都没有变化时复用已有病历，有新消息或档案修改后重新生成
+    """
+    calls = []
+    def counting_record(patient_name, context=None, incremental=None):
+        calls.append(patient_name)
+        return fake_record(patient_name, context, incremental)
+    monkeypatch.setattr(llm_service, "generate_structured_medical_record", counting_record)
+
+    with test_app.app_context():
+        consultation = find_or_create_main_ai_consultation(1)
+        first = generate_medical_record_from_history(1)
+        assert generate_medical_record_from_history(1) == first
+        assert len(calls) == 1
+
+        add_chat_message_to_consultation(1, consultation.id, "还有点发烧", "注意测量体温")
+        second = generate_medical_record_from_history(1)
+        assert second["id"] != first["id"]
+
+        user = db.session.get(UserModel, 1)
+        user.family_history = "父亲高血压"
+        db.session.commit()
+        third = generate_medical_record_from_history(1)
+        assert third["id"] != second["id"]
+        assert third["家族史"] == "父亲高血压"
+
+        # 只有档案变化时沿用上一份病历的 AI 内容，不调用 LLM
+        assert len(calls) == 2
+        assert MedicalRecordModel.query.count() == 3
+
+def test_medical_record_generated_incrementally_from_new_turns(test_app, auth_headers, monkeypatch):
+    """
+    测试场景7: 已有病历时只发送新问答和上一份病历，并把新的 encounters 合并到已有 encounters 之后
+    """
+    calls = []
+    def incremental_record(patient_name, context=None, incremental=None):
+        calls.append(incremental)
+        if incremental is None:
+            return {"patient_name": patient_name, "summary": "咳嗽三天", "encounters": [{"diagnosis": "上呼吸道感染"}]}
+        return {"patient_name": patient_name, "summary": "咳嗽伴发热", "encounters": [{"diagnosis": "支气管炎"}]}
+    monkeypatch.setattr(llm_service, "generate_structured_medical_record", incremental_record)
+
+    with test_app.app_context():
+        consultation = find_or_create_main_ai_consultation(1)
+        add_chat_message_to_consultation(1, consultation.id, "咳嗽三天了", "多喝水")
+        first = generate_medical_record_from_history(1)
+        add_chat_message_to_consultation(1, consultation.id, "现在开始发烧", "建议就医")
+        second = generate_medical_record_from_history(1)
+
+        assert calls[0] is None
+        assert calls[1]["new_turns"] == [{"question": "现在开始发烧", "answer": "建议就医"}]
+        assert calls[1]["previous_record"]["encounters"] == [{"diagnosis": "上呼吸道感染"}]
+        assert json.loads(second["现病史"]) == [{"diagnosis": "上呼吸道感染"}, {"diagnosis": "支气管炎"}]
+        assert second["主诉"] == "咳嗽伴发热"
+        assert second["诊断"] == "支气管炎"
+        last_message = ChatMessageModel.query.order_by(ChatMessageModel.id.desc()).first()
+        assert db.session.get(MedicalRecordModel, int(second["id"])).last_message_id == last_message.id
+        assert db.session.get(MedicalRecordModel, int(first["id"])).last_message_id < last_message.id
+
+def test_medical_record_pregenerated_after_every_n_turns(test_client, test_app, auth_headers, monkeypatch):
+    """
+    测试场景8: 开启预生成后每新增 N 轮问答入队一个预生成任务 (按用户限频)，之后用户请求生成时直接复用结果
+    """
+    calls = []
+    def counting_record(patient_name, context=None, incremental=None):
+        calls.append(patient_name)
+        return fake_record(patient_name, context, incremental)
+    monkeypatch.setattr(llm_service, "generate_structured_medical_record", counting_record)
+
+    with test_app.app_context():
+        consultation = find_or_create_main_ai_consultation(1)
+        add_chat_message_to_consultation(1, consultation.id, "咳嗽三天了", "多喝水")
+        add_chat_message_to_consultation(1, consultation.id, "有痰", "注意休息")
+        # 默认关闭
+        assert MedicalRecordJobModel.query.count() == 0
+
+        test_app.config['MEDICAL_RECORD_PREGENERATE_TURNS'] = 3
+        add_chat_message_to_consultation(1, consultation.id, "晚上咳得厉害", "可以用止咳糖浆")
+        job = MedicalRecordJobModel.query.one()
+        assert job.speculative is True
+        # 限频间隔内不会再次入队
+        add_chat_message_to_consultation(1, consultation.id, "需要拍片吗", "暂时不需要")
+        assert MedicalRecordJobModel.query.count() == 1
+
+        assert process_next_medical_record_job() is True
+        record_id = db.session.get(MedicalRecordJobModel, job.id).medical_record_id
+        assert record_id is not None
+
+    job_id = test_client.post('/api/chat/medical/record', headers=auth_headers).get_json()["jobId"]
+    with test_app.app_context():
+        assert process_next_medical_record_job() is True
+    status = test_client.get(f'/api/chat/medical/record/jobs/{job_id}', headers=auth_headers).get_json()
+    assert status["status"] == "succeeded"
+    assert status["recordId"] == str(record_id)
+    assert len(calls) == 1
+
+def test_speculative_medical_record_job_yields_to_interactive_traffic(test_client, test_app, auth_headers, monkeypatch):
+    """
+    测试场景9: 上游繁忙时预生成任务直接放弃；用户主动请求后同一任务不再放弃
+    """
+    monkeypatch.setattr(llm_service, "generate_structured_medical_record", fake_record)
+    monkeypatch.setattr(upstream_bulkhead, "active", upstream_bulkhead.max_concurrent)
+
+    with test_app.app_context():
+        speculative = enqueue_medical_record_job(1, speculative=True)
+        assert process_next_medical_record_job() is True
+        speculative = db.session.get(MedicalRecordJobModel, speculative.id)
+        assert speculative.status == "cancelled"
+        assert MedicalRecordModel.query.count() == 0
+
+        speculative_id = enqueue_medical_record_job(1, speculative=True).id
+
+    job_id = test_client.post('/api/chat/medical/record', headers=auth_headers).get_json()["jobId"]
+    assert int(job_id) == speculative_id
+    with test_app.app_context():
+        assert process_next_medical_record_job() is True
+        job = db.session.get(MedicalRecordJobModel, speculative_id)
+        assert job.speculative is False
+        assert job.status == "succeeded"
+
+def test_medical_record_job_reclaimed_by_another_worker_writes_nothing(test_client, test_app, auth_headers, monkeypatch):
+    """
+    测试场景10: 生成病历期间租约过期、任务被其他 worker 重新领取时，本 worker 生成的病历回滚，不改动任务状态；
+    预生成任务在此期间遇到上游繁忙时同样不会把别人领取的任务标记为已取消
+    """
+    def reclaimed_meanwhile(patient_name, context=None, incremental=None):
+        # 模拟租约过期后另一个 worker 领取了同一任务
+        job = db.session.get(MedicalRecordJobModel, job_id)
+        job.attempts += 1
+        db.session.commit()
+        return fake_record(patient_name, context, incremental)
+    monkeypatch.setattr(llm_service, "generate_structured_medical_record", reclaimed_meanwhile)
+    job_id = int(test_client.post('/api/chat/medical/record', headers=auth_headers).get_json()["jobId"])
+
+    with test_app.app_context():
+        assert process_next_medical_record_job() is True
+        job = db.session.get(MedicalRecordJobModel, job_id)
+        assert job.status == "running"
+        assert job.attempts == 2
+        assert job.medical_record_id is None
+        assert MedicalRecordModel.query.count() == 0
+
+    def reclaimed_then_busy(patient_name, context=None, incremental=None):
+        job = db.session.get(MedicalRecordJobModel, speculative_id)
+        job.attempts += 1
+        db.session.commit()
+        raise UpstreamBusyError("busy", retry_after=0)
+    monkeypatch.setattr(llm_service, "generate_structured_medical_record", reclaimed_then_busy)
+
+    with test_app.app_context():
+        db.session.get(MedicalRecordJobModel, job_id).status = "failed"
+        db.session.commit()
+        speculative_id = enqueue_medical_record_job(1, speculative=True).id
+        assert process_next_medical_record_job() is True
+        job = db.session.get(MedicalRecordJobModel, speculative_id)
+        assert job.status == "running"
+        assert job.attempts == 2
@@ -0,0 +1,71 @@
+import pytest
+from contextlib import contextmanager
+from sqlalchemy import event
+
+from app.models.user_model import UserModel
+from app.core.extensions import db
+from app.services.history_service import (
+    get_recent_consultation, get_consultation_timeline, find_or_create_main_ai_consultation, get_chat_history
+)
+from app.services.appointment_service import get_pending_appointments, has_urgent_appointment
+from app.services.medical_record_service import get_records_for_patient
+
+# 这些表的按病人查询必须走索引
+HOT_TABLES = ('ai_consultations', 'doctor_consultations', 'chat_messages', 'appointments', 'medical_records')
+
+
+@contextmanager
+def captured_selects():
+    """记录期间执行的所有 SELECT 语句及其参数"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def full_scans(statement, parameters):
+    """用 EXPLAIN QUERY PLAN 找出语句中对热点表的全表扫描"""
+    with db.engine.connect() as conn:
+        plan = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+    details = [row[-1] for row in plan]
+    return [detail for detail in details if detail.startswith('SCAN') and any(table in detail.split() for table in HOT_TABLES)]
+
+
+@pytest.fixture(scope='function')
+def patient(test_app):
+    patient = UserModel(id=1, username='patient1', role='patient', full_name='病人张三')
+    patient.set_password('password')
+    db.session.add(patient)
+    db.session.commit()
+    return patient
+
+# --- 测试用例 ---
+
+@pytest.mark.parametrize('query', [
+    get_recent_consultation,
+    get_consultation_timeline,
+    lambda patient_id: get_consultation_timeline(patient_id, limit=20),
+    find_or_create_main_ai_consultation,
+    get_chat_history,
+    get_pending_appointments,
+    has_urgent_appointment,
+    get_records_for_patient,
+])
+def test_per_patient_queries_use_indexes(test_app, patient, query):
+    """
+    测试场景1: 每个按病人查询的热点接口都通过索引定位，而不是扫描整张表
+    """
+    with captured_selects() as statements:
+        query(patient.id)
+
+    hot = [(s, p) for s, p in statements if any(table in s for table in HOT_TABLES)]
+    assert hot
+    for statement, parameters in hot:
+        assert full_scans(statement, parameters) == [], statement
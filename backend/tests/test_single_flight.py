@@ -0,0 +1,118 @@
+import asyncio
+import threading
+import pytest
+from datetime import datetime, timedelta
+
+from app.core.extensions import db
+from app.models.answer_cache_model import LLMRequestLeaseModel
+from app.services import llm_service, single_flight
+from app.services.answer_cache import cache_key
+
+
+class FakeBuilder:
+    def __init__(self, answer):
+        self._answer = answer
+        self.succeeded = True
+
+    def result(self):
+        return self._answer
+
+# --- 测试用例 ---
+
+def test_concurrent_identical_questions_share_one_upstream_call(test_app, monkeypatch):
+    """
+    测试场景1: 同一进程内并发的相同问题只调用一次上游
+    """
+    calls = []
+    release = threading.Event()
+
+    async def slow_collect(question, deadline=None, priority=None, context=None):
+        calls.append(question)
+        # 在事件循环线程之外等待，模拟一次耗时的上游会话
+        await asyncio.get_running_loop().run_in_executor(None, release.wait)
+        return FakeBuilder("共享的回答")
+
+    monkeypatch.setattr(llm_service, "collect_dynamic_response_async", slow_collect)
+
+    coalesced_before = single_flight.stats.coalesced
+    results = []
+    threads = [
+        threading.Thread(target=lambda q=q: results.append(llm_service.get_ai_response(q)))
+        for q in ["感冒发烧怎么办", "感冒 發燒 怎麼辦？", "感冒发烧怎么办!"]
+    ]
+    for t in threads:
+        t.start()
+    while single_flight.stats.coalesced < coalesced_before + 2:
+        threading.Event().wait(0.01)
+    release.set()
+    for t in threads:
+        t.join(5)
+
+    assert results == ["共享的回答"] * 3
+    assert len(calls) == 1
+
+def test_waits_for_result_of_other_worker_lease(test_app, monkeypatch):
+    """
+    测试场景2: 另一个 worker 持有租约时，等待其结果而不是再次调用上游
+    """
+    monkeypatch.setattr(single_flight, "LLM_LEASE_POLL_INTERVAL", 0.01)
+    key = cache_key("头痛")
+    with test_app.app_context():
+        db.session.add(LLMRequestLeaseModel(
+            request_key=key, owner="other-worker", status="running",
+            expires_at=datetime.utcnow() + timedelta(seconds=60)
+        ))
+        db.session.commit()
+
+        def other_worker_finishes():
+            threading.Event().wait(0.05)
+            with test_app.app_context():
+                single_flight.complete_lease(key, "other-worker", "另一个worker的回答")
+
+        threading.Thread(target=other_worker_finishes).start()
+        answer = single_flight.run_with_lease(key, lambda: pytest.fail("should not call upstream"))
+
+    assert answer == "另一个worker的回答"
+
+def test_expired_lease_is_taken_over(test_app):
+    """
+    测试场景3: 持有者崩溃 (租约过期) 后由当前 worker 接手执行
+    """
+    key = cache_key("咳嗽")
+    with test_app.app_context():
+        db.session.add(LLMRequestLeaseModel(
+            request_key=key, owner="dead-worker", status="running",
+            expires_at=datetime.utcnow() - timedelta(seconds=1)
+        ))
+        db.session.commit()
+
+        answer = single_flight.run_with_lease(key, lambda: "重新执行的回答")
+        lease = LLMRequestLeaseModel.query.filter_by(request_key=key).first()
+
+    assert answer == "重新执行的回答"
+    assert lease.status == "done"
+    assert lease.answer == "重新执行的回答"
+
+def test_failed_answer_is_not_shared_through_lease(test_app, monkeypatch):
+    """
+    测试场景4: leader 只拿到超时/部分回答时不写入租约结果，而是释放租约，由等待的 worker 自己调用上游
+    """
+    monkeypatch.setattr(single_flight, "LLM_SINGLEFLIGHT_DB", True)
+    builders = [FakeBuilder(llm_service.TIMEOUT_ANSWER), FakeBuilder("第二次调用的回答")]
+    builders[0].succeeded = False
+
+    async def collect(question, deadline=None, priority=None, context=None):
+        return builders.pop(0)
+
+    monkeypatch.setattr(llm_service, "collect_dynamic_response_async", collect)
+    key = cache_key("胸闷气短")
+    with test_app.app_context():
+        assert llm_service.get_ai_response("胸闷气短") == llm_service.TIMEOUT_ANSWER
+        assert LLMRequestLeaseModel.query.filter_by(request_key=key).first() is None
+
+        # 等待者此时会接手租约并自己调用上游
+        assert llm_service.get_ai_response("胸闷气短") == "第二次调用的回答"
+        lease = LLMRequestLeaseModel.query.filter_by(request_key=key).first()
+
+    assert lease.status == "done"
+    assert lease.answer == "第二次调用的回答"
@@ -0,0 +1,151 @@
+import asyncio
+import json
+import pytest
+import websockets
+
+from app.services import llm_service, llm_runtime, upstream_pool
+from app.services.upstream_pool import UpstreamPool
+from app.services.circuit_breaker import CircuitOpenError
+
+# --- 测试用例 ---
+
+@pytest.fixture(autouse=True)
+def no_health_probes(monkeypatch):
+    monkeypatch.setattr(upstream_pool, "LLM_HEALTH_PATH", "")
+
+def test_pick_prefers_least_outstanding_weighted_by_latency():
+    """
+    测试场景1: 按 (在途会话数 + 1) × 延迟选择副本
+    """
+    pool = UpstreamPool(["http://a", "http://b"])
+    a, b = pool.replicas
+    a.latency, b.latency = 0.1, 0.4
+
+    async def scenario():
+        picked = pool.pick()
+        pool.acquire(picked)
+        assert picked is a
+        # a: (1+1)*0.1 = 0.2 < b: 0.4
+        picked = pool.pick()
+        pool.acquire(picked)
+        assert picked is a
+        # a 有 4 个在途会话时: (4+1)*0.1 = 0.5 > b: 0.4
+        pool.acquire(a)
+        pool.acquire(a)
+        assert pool.pick() is b
+
+    asyncio.run(scenario())
+
+def test_pick_skips_open_and_unhealthy_replicas():
+    """
+    测试场景2: 熔断中或健康探测失败的副本不参与选择，全部熔断时快速失败
+    """
+    pool = UpstreamPool(["http://a", "http://b", "http://c"])
+    a, b, c = pool.replicas
+    for _ in range(a.breaker.failure_threshold):
+        a.breaker.record_failure("down")
+    b.healthy = False
+
+    async def scenario():
+        assert pool.pick() is c
+        for _ in range(c.breaker.failure_threshold):
+            c.breaker.record_failure("down")
+        # 唯一未熔断的副本探测不健康时仍会被尝试
+        assert pool.pick() is b
+        for _ in range(b.breaker.failure_threshold):
+            b.breaker.record_failure("down")
+        with pytest.raises(CircuitOpenError):
+            pool.check_available()
+
+    asyncio.run(scenario())
+
+def test_pick_closed_only_does_not_use_half_open_probe():
+    """
+    测试场景5: 预热会话只选择熔断器关闭的副本，不占用半开副本的探测名额
+    """
+    pool = UpstreamPool(["http://a", "http://b"])
+    a, b = pool.replicas
+    a.latency, b.latency = 0.1, 0.4
+    for _ in range(a.breaker.failure_threshold):
+        a.breaker.record_failure("down")
+    a.breaker._opened_at -= a.breaker.recovery_seconds
+    assert a.breaker.state == 'half_open'
+
+    async def scenario():
+        assert pool.pick(closed_only=True) is b
+        # 半开副本的探测名额仍然留给真实请求
+        assert pool.pick() is a
+        for _ in range(b.breaker.failure_threshold):
+            b.breaker.record_failure("down")
+        with pytest.raises(CircuitOpenError):
+            pool.pick(closed_only=True)
+
+    asyncio.run(scenario())
+
+def test_probe_marks_replica_unhealthy_on_server_error(monkeypatch):
+    """
+    测试场景3: 探测返回 5xx 或连接失败时标记为不健康，恢复后重新参与选择
+    """
+    class FakeResponse:
+        def __init__(self, status_code):
+            self.status_code = status_code
+
+    statuses = iter([503, 404])
+
+    async def fake_get(url, **kwargs):
+        return FakeResponse(next(statuses))
+
+    monkeypatch.setattr(llm_runtime, "http_get", fake_get)
+    pool = UpstreamPool(["http://a", "http://b"])
+    replica = pool.replicas[0]
+
+    asyncio.run(pool.probe(replica))
+    assert replica.healthy is False
+    asyncio.run(pool.probe(replica))
+    assert replica.healthy is True
+
+def test_session_sticks_to_the_replica_that_issued_it(test_app, monkeypatch):
+    """
+    测试场景4: /chat/start 和 WebSocket 使用同一个副本
+    """
+    class FakeStartResponse:
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return {"session_id": "s-9"}
+
+    async def handler(websocket):
+        await websocket.send(json.dumps({"type": "agent_message", "speaker": "Summarizer_Agent", "content": "好"}))
+        await websocket.send(json.dumps({"type": "session_end"}))
+
+    async def start():
+        return await websockets.serve(handler, "127.0.0.1", 0)
+
+    server = llm_runtime.run(start())
+    port = list(server.sockets)[0].getsockname()[1]
+    start_urls, ws_bases = [], []
+
+    async def fake_post(url, **kwargs):
+        start_urls.append(url)
+        return FakeStartResponse()
+
+    def fake_ws_url(session_id, base_url=None):
+        ws_bases.append(base_url)
+        return f"ws://127.0.0.1:{port}/api/v1/chat/ws/{session_id}"
+
+    pool = UpstreamPool(["http://replica-a", "http://replica-b"])
+    pool.replicas[0].latency = 5.0
+    monkeypatch.setattr(llm_service, "upstream_pool", pool)
+    monkeypatch.setattr(llm_runtime, "http_post", fake_post)
+    monkeypatch.setattr(llm_service, "_build_ws_url", fake_ws_url)
+    try:
+        answer = llm_service.get_ai_response("粘性测试", use_cache=False)
+    finally:
+        server.close()
+
+    assert answer == "好"
+    assert start_urls == ["http://replica-b/api/v1/chat/start"]
+    assert ws_bases == ["http://replica-b"]
+    assert pool.replicas[1].sessions == 1
+    assert pool.replicas[1].outstanding == 0
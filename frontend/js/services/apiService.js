@@ -333,6 +333,62 @@ const apiService = {
     }
   },
 
+  /**
+   * 以流式 (SSE) 方式发送医疗问题，每收到一条 agent 发言就回调一次
+   * 后端接口：POST /api/chat/medical/stream
+   * @param {string} question 用户的问题
+   * @param {Function} onAgentMessage 回调 (speaker, content)
+   * @returns {Promise<string>} 最终的AI回答
+   */
+  sendMedicalQueryStream: async function(question, onAgentMessage) {
+    try {
+      const response = await fetch(`${API_BASE_URL}/chat/medical/stream`, {
+        method: 'POST',
+        headers: { ...getAuthHeaders(), 'Content-Type': 'application/json' },
+        body: JSON.stringify({ question }),
+        credentials: 'include'
+      });
+
+      if (response.status === 401) {
+        localStorage.removeItem('access_token');
+        throw new Error('登录已过期，请重新登录');
+      }
+      if (!response.ok) {
+        const errorData = await response.json();
+        throw new Error(`请求失败: ${errorData.message || response.statusText}`);
+      }
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder('utf-8');
+      let buffer = '';
+      let answer = '';
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        // SSE 事件之间以空行分隔
+        const blocks = buffer.split('\n\n');
+        buffer = blocks.pop();
+        for (const block of blocks) {
+          const eventLine = block.split('\n').find(l => l.startsWith('event: '));
+          const dataLine = block.split('\n').find(l => l.startsWith('data: '));
+          if (!eventLine || !dataLine) continue;
+          const event = eventLine.slice(7);
+          const data = JSON.parse(dataLine.slice(6));
+          if (event === 'agent_message' && onAgentMessage) {
+            onAgentMessage(data.speaker, data.content);
+          } else if (event === 'done') {
+            answer = data.answer;
+          }
+        }
+      }
+      return answer;
+    } catch (error) {
+      console.error('sendMedicalQueryStream 调用失败:', error.message);
+      throw error;
+    }
+  },
+
   /**
    * 发送医疗问题和文件到AI模型，获取诊断建议
    * 后端接口：POST /api/chat/medical/upload
@@ -411,11 +467,19 @@ const apiService = {
   /**
    * 获取AI问诊历史对话记录
    * 后端接口：GET /api/chat/history
-   * @returns {Promise<Array>} 历史对话数组，格式为 [{question: "用户问题", answer: "AI回答", createdAt: "时间戳"}, ...]
+   * @param {Object} [page] 可选的分页参数 {limit, before} 或增量同步参数 {since}；不传时返回全部历史
+   * @returns {Promise<Object>} {consultation_id, history: [{question: "用户问题", answer: "AI回答", createdAt: "时间戳"}, ...], nextCursor, syncCursor}
+   *          分页时从最新一页开始，把 nextCursor 作为 before 传入获取更早的一页，为 null 时表示没有更早的记录；
+   *          刷新时把上次返回的 syncCursor 作为 since 传入，只获取之后的新问答 (拼接到已有历史之后)
    */
-  getMedicalChatHistory: async function() {
+  getMedicalChatHistory: async function(page = {}) {
     try {
-      const response = await fetch(`${API_BASE_URL}/chat/history`, {
+      const params = new URLSearchParams();
+      if (page.limit) params.set('limit', page.limit);
+      if (page.before) params.set('before', page.before);
+      if (page.since !== undefined && page.since !== null) params.set('since', page.since);
+      const query = params.toString() ? `?${params.toString()}` : '';
+      const response = await fetch(`${API_BASE_URL}/chat/history${query}`, {
         method: 'GET',
         headers: getAuthHeaders(),
         credentials: 'include'
@@ -476,7 +540,8 @@ const apiService = {
 
   /**
    * 生成病历并保存
-   * 后端接口：POST /api/chat/medical/record
+   * 后端接口：POST /api/chat/medical/record (返回 202 和任务ID)
+   *          GET  /api/chat/medical/record/jobs/<id> (按 Retry-After 间隔轮询直到任务结束)
    * @returns {Promise<Object>} AI生成的病历对象
    */
   generateMedicalRecord: async function() {
@@ -502,8 +567,29 @@ const apiService = {
         throw new Error(`生成病历失败: ${errorData.message || response.statusText}`);
       }
 
-      const data = await response.json();
-      return data.record; // 假设后端返回 { "record": {...} }
+      // 病历在后台生成，按 Retry-After 的间隔轮询任务状态直到成功或失败
+      let job = await response.json();
+      let retryAfter = Number(response.headers.get('Retry-After')) || 2;
+      const statusUrl = `${API_BASE_URL}${job.statusUrl.replace(/^\/api/, '')}`;
+      while (job.status === 'queued' || job.status === 'running') {
+        await new Promise(resolve => setTimeout(resolve, retryAfter * 1000));
+        const statusResponse = await fetch(statusUrl, {
+          method: 'GET',
+          headers: getAuthHeaders(),
+          credentials: 'include'
+        });
+        if (!statusResponse.ok) {
+          const errorData = await statusResponse.json();
+          throw new Error(`查询病历生成进度失败: ${errorData.message || statusResponse.statusText}`);
+        }
+        retryAfter = Number(statusResponse.headers.get('Retry-After')) || retryAfter;
+        job = await statusResponse.json();
+      }
+
+      if (job.status !== 'succeeded') {
+        throw new Error(`生成病历失败: ${job.error || '任务已取消'}`);
+      }
+      return job.record;
     } catch (error) {
       console.error('generateMedicalRecord 调用失败:', error.message);
       throw error;